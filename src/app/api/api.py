@@ -1,49 +1,77 @@
+import datetime
+import hashlib
 import uuid
+from email.utils import format_datetime
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
 
-from fastapi import APIRouter, Depends, HTTPException, Path
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.connections import get_connection
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.params import Param
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
-from starlette.status import (
-    HTTP_200_OK,
-    HTTP_404_NOT_FOUND,
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED, HTTP_404_NOT_FOUND
+
+from app.api.collections.collection_validation import (
+    CollectionValidation,
+    build_collection_validation,
+    collection_validation,
+    collection_validation_filter_path,
+    collection_validation_search,
 )
-
-from app.api.collections.collection_validation import collection_validation, CollectionValidation
 from app.api.collections.counts import AggregationMappings, Counts, counts
-from app.api.collections.material_counts import (
-    MaterialCounts,
-    material_counts,
-)
+from app.api.collections.material_counts import MaterialCounts, material_counts
 from app.api.collections.material_validation import (
-    material_validation,
     MaterialValidation,
+    material_validation,
     material_validation_cache,
 )
 from app.api.collections.pending_collections import (
-    pending_collections,
     PendingCollection,
+    build_pending_collections,
+    pending_collections,
+    pending_collections_filter_path,
+    pending_collections_search,
 )
 from app.api.collections.pending_materials import (
-    PendingMaterial,
     MissingAttributeFilter,
+    PendingMaterial,
+    build_pending_materials,
     materials_filter_params,
     pending_materials,
+    pending_materials_filter_path,
+    pending_materials_search,
 )
 from app.api.collections.quality_matrix import (
-    QualityMatrixMode,
-    quality_matrix,
-    timestamps,
     QualityMatrix,
+    QualityMatrixMode,
+    QualityMatrixSeries,
     past_quality_matrix,
+    quality_matrix_cache,
+    quality_matrix_series,
+    select_columns,
+    timestamps,
 )
 from app.api.collections.score import Score, score
-from app.api.collections.statistics import statistics, Statistics
-from app.api.collections.tree import Tree
-from app.api.collections.tree import tree
+from app.api.collections.statistics import Statistics, statistics
+from app.api.collections.tree import (
+    TreeCacheStats,
+    TreeField,
+    TreeSlice,
+    tree,
+    tree_cache,
+    tree_slice,
+)
+from app.core.config import ELASTIC_MAX_PAGE_SIZE, ELASTIC_PAGE_SIZE
 from app.core.constants import COLLECTION_NAME_TO_ID, COLLECTION_ROOT_ID
 from app.db.tasks import get_session
 from app.elastic.attributes import ElasticResourceAttribute
+from app.elastic.cache import SearchCacheStats, search_cache
+from app.elastic.connection import ConnectionPoolStats, connection_pool_stats
+from app.elastic.pagination import iterate_pages, search_page
 
 router = APIRouter()
 
@@ -56,11 +84,137 @@ valid_node_ids = {
 def toplevel_collections(
     node_id: uuid.UUID = Path(default=..., examples=valid_node_ids),
 ) -> uuid.UUID:
-    #if str(node_id) not in {value["value"] for value in valid_node_ids.values()}:
+    # if str(node_id) not in {value["value"] for value in valid_node_ids.values()}:
     #    raise HTTPException(status_code=404, detail=f"Could not find collection with node id {node_id}")
     return node_id
 
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+T = TypeVar("T")
+
+
+class Pagination(BaseModel):
+    limit: int
+    cursor: Optional[str]
+
+
+def pagination_params(
+    *,
+    limit: Optional[int] = Query(
+        default=None,
+        ge=1,
+        le=ELASTIC_MAX_PAGE_SIZE,
+        description=f"Return at most this many entries (default {ELASTIC_PAGE_SIZE} if only a cursor is given). "
+        f"If neither limit nor cursor are given, all entries are returned at once.",
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description=f"Opaque cursor of the next page as returned in the {NEXT_CURSOR_HEADER} header of the previous "
+        f"page.",
+    ),
+) -> Optional[Pagination]:
+    if limit is None and cursor is None:
+        return None
+    return Pagination(limit=limit or ELASTIC_PAGE_SIZE, cursor=cursor)
+
+
+async def paginate(
+    search: Search,
+    build: Callable[[dict], list[T]],
+    filter_path: list[str],
+    pagination: Pagination,
+    response: Response,
+) -> list[T]:
+    """
+    Return a single page of the results of given search. The cursor of the next page is passed via the
+    X-Next-Cursor header which is missing on the last page.
+    """
+    page, next_cursor = await search_page(
+        search, limit=pagination.limit, cursor=pagination.cursor, filter_path=filter_path
+    )
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return build(page)
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def stream_params(
+    *,
+    request: Request,
+    stream: bool = Query(
+        default=False,
+        description=f"Stream all entries as newline delimited JSON (same as `Accept: {NDJSON_MEDIA_TYPE}`).",
+    ),
+) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def stream_ndjson(
+    search: Search, build: Callable[[dict], list[BaseModel]], filter_path: list[str]
+) -> StreamingResponse:
+    """
+    Stream all results of the given search as newline delimited JSON (one object per line).
+
+    The results are fetched and serialized page by page, hence memory usage does not grow with the number of results.
+    The first page is fetched before the response is started, such that failing searches are still reported via the
+    status code.
+    """
+    pages = iterate_pages(search, filter_path=filter_path)
+    first = await pages.__anext__()
+
+    async def lines() -> AsyncIterator[str]:
+        for item in build(first):
+            yield item.json() + "\n"
+        async for page in pages:
+            for item in build(page):
+                yield item.json() + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def etag(*parts: Any) -> str:
+    """Build a (strong) ETag from the given parts, e.g. the version of the data and the request parameters."""
+    return f'"{hashlib.sha256("/".join(map(str, parts)).encode()).hexdigest()[:32]}"'
+
+
+def not_modified(request: Request, tag: str) -> Optional[Response]:
+    """
+    Return an empty `304 Not Modified` response if the If-None-Match header of the request matches the given ETag.
+
+    See https://www.rfc-editor.org/rfc/rfc9110#field.if-none-match (If-None-Match uses the weak comparison).
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return None
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if "*" in tags or tag.removeprefix("W/") in tags:
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": tag})
+    return None
+
+
+def conditional_response(request: Request, content: Any, tag: Optional[str] = None) -> Response:
+    """
+    Serialize the content into a JSON response with an ETag header, or answer with `304 Not Modified` if the client
+    already has this version of the content.
+
+    :param tag: The ETag of the content. By default, the hash of the serialized content is used. Callers that can derive
+                the ETag from the version of the underlying data should rather check `not_modified` before computing
+                the content.
+    """
+    if tag is not None and (response := not_modified(request, tag)) is not None:
+        return response
+    response = JSONResponse(jsonable_encoder(content))
+    if tag is None:
+        tag = f'"{hashlib.sha256(response.body).hexdigest()[:32]}"'
+        if (unchanged := not_modified(request, tag)) is not None:
+            return unchanged
+    response.headers["ETag"] = tag
+    return response
+
+
 @router.get(
     "/collections/{node_id}/quality-matrix/{mode}",
     status_code=HTTP_200_OK,
@@ -69,7 +223,24 @@ def toplevel_collections(
     tags=["Collections"],
     summary="Calculate the replication-source or collection quality matrix",
 )
-async def get_quality_matrix(*, node_id: uuid.UUID = Depends(toplevel_collections), mode: QualityMatrixMode):
+async def get_quality_matrix(
+    *,
+    node_id: uuid.UUID = Depends(toplevel_collections),
+    mode: QualityMatrixMode,
+    fresh: bool = Query(
+        default=False,
+        description="Compute the quality matrix live instead of serving the precomputed one of top level collections.",
+    ),
+    groups: Optional[list[str]] = Query(
+        default=None,
+        description="Only return the columns of these groups of the metadata hierarchy, e.g. `Beschreibendes`.",
+    ),
+    columns: Optional[list[str]] = Query(
+        default=None,
+        description="Only return these columns (in addition to the ones of `groups`), e.g. `title`.",
+    ),
+    request: Request,
+):
     """
     Calculate the quality matrix w.r.t. the replication source, or collection.
 
@@ -91,10 +262,89 @@ async def get_quality_matrix(*, node_id: uuid.UUID = Depends(toplevel_collection
               It serves as an overall filter for materials in both cases.
     - mode: Defines the mode of the quality matrix, i.e. whether to compute the collection ("collections") or
           replication source ("replication-source").
+
+    The quality matrices of the top level collections are precomputed in background every
+    QUALITY_MATRIX_REFRESH_INTERVAL seconds, the Last-Modified header tells when the computation of the returned matrix
+    started. Use `fresh=true` to compute the matrix live.
+
+    With `groups` and/or `columns`, only the respective columns are returned (and computed, if computed live).
+
+    The response carries an ETag, requests with a matching If-None-Match header are answered with 304 Not Modified.
+    """
+
+    selected = select_columns(groups=groups, columns=columns)
+
+    def version(computed_at: datetime.datetime) -> str:
+        return etag(
+            "quality-matrix", node_id, mode, computed_at.isoformat(), None if selected is None else sorted(selected)
+        )
+
+    # precomputed matrices are versioned by the start of their computation, which is checked before any work is done
+    if not fresh and (computed_at := quality_matrix_cache.computed_at(node_id, mode)) is not None:
+        if (response := not_modified(request, version(computed_at))) is not None:
+            response.headers["Last-Modified"] = format_datetime(computed_at, usegmt=True)
+            return response
+
+    root = await tree(node_id)
+    matrix, computed_at = await quality_matrix_cache.get(root, mode=mode, fresh=fresh, columns=selected)
+    # matrices that were computed live (and not cached) have no version, their ETag is the hash of the content
+    cached = computed_at == quality_matrix_cache.computed_at(node_id, mode)
+    response = conditional_response(request, matrix, tag=version(computed_at) if cached else None)
+    response.headers["Last-Modified"] = format_datetime(computed_at, usegmt=True)
+    return response
+
+
+@router.get(
+    "/collections/{node_id}/quality-matrix/{mode}/series",
+    status_code=HTTP_200_OK,
+    response_model=QualityMatrixSeries,
+    tags=["Collections"],
+    summary="Get the evolution of the quality matrix over the stored historic quality matrices",
+)
+async def get_quality_matrix_series(
+    *,
+    node_id: uuid.UUID = Depends(toplevel_collections),
+    mode: QualityMatrixMode,
+    start: Optional[int] = Query(default=None, description="Earliest timestamp in seconds since epoch (inclusive)."),
+    end: Optional[int] = Query(default=None, description="Latest timestamp in seconds since epoch (inclusive)."),
+    rows: Optional[list[str]] = Query(
+        default=None, description="Only return these rows, i.e. collection ids or replication sources."
+    ),
+    groups: Optional[list[str]] = Query(
+        default=None,
+        description="Only return the columns of these groups of the metadata hierarchy, e.g. `Beschreibendes`.",
+    ),
+    columns: Optional[list[str]] = Query(
+        default=None,
+        description="Only return these columns (in addition to the ones of `groups`), e.g. `title`.",
+    ),
+    session: Session = Depends(get_session),
+):
     """
+    Return the stored quality matrices between `start` and `end` as one array per row and column.
 
-    root = tree(node_id)
-    return quality_matrix(collection=root, mode=mode)
+    The i-th entry of each array belongs to the i-th of the returned `timestamps`, it is null if the respective
+    snapshot does not contain the row or column. This allows to plot the completeness over time with a single request
+    instead of fetching each historic quality matrix separately.
+
+    Parameters:
+      - node_id: The toplevel collection for which the quality matrices were stored.
+      - mode: The desired mode of quality.
+      - start, end: The range of timestamps, unbounded if omitted.
+      - rows: Only return these rows (ids of the row headers).
+      - groups, columns: Only return these columns, as for the current quality matrix.
+    """
+    selected = select_columns(groups=groups, columns=columns)
+    return await run_in_threadpool(
+        quality_matrix_series,
+        session=session,
+        mode=mode,
+        collection_id=node_id,
+        start=start,
+        end=end,
+        rows=rows,
+        columns=selected,
+    )
 
 
 @router.get(
@@ -153,7 +403,7 @@ async def get_quality_matrix_timestamps(
     tags=["Collections"],
     summary="The average ratio of non-empty properties for the chosen collection",
 )
-async def get_score(*, node_id: uuid.UUID = Depends(toplevel_collections)):
+async def get_score(*, node_id: uuid.UUID = Depends(toplevel_collections), request: Request):
     """
     Validate attributes of sub-collections and materials of the given collection grouped by OER and non-OER content.
 
@@ -190,23 +440,54 @@ async def get_score(*, node_id: uuid.UUID = Depends(toplevel_collections)):
 
     **fixme: Improve documentation of overall score, or eventually completely refactor it (separate collection and
              materials)**
+
+    The response carries an ETag, requests with a matching If-None-Match header are answered with 304 Not Modified.
     """
-    return await score(node_id)
+    return conditional_response(request, await score(node_id))
 
 
 @router.get(
     "/collections/{node_id}/tree",
-    response_model=Tree,
+    response_model=TreeSlice,
     status_code=HTTP_200_OK,
     responses={HTTP_404_NOT_FOUND: {"description": "Collection not found"}},
     tags=["Collections"],
     summary="Provide the sub-tree of the collection hierarchy starting at given node",
 )
-async def get_tree(*, node_id: uuid.UUID = Depends(toplevel_collections)):
+async def get_tree(
+    *,
+    node_id: uuid.UUID = Depends(toplevel_collections),
+    depth: Optional[int] = Query(
+        default=None,
+        ge=0,
+        description="Only return the nodes up to this many levels below the requested node (0 only returns the node "
+        "itself). Nodes whose children were cut off are marked with `truncated: true`.",
+    ),
+    fields: Optional[list[TreeField]] = Query(
+        default=None,
+        description="Only return these attributes of the nodes. The children are always returned.",
+    ),
+    request: Request,
+):
     """
     Returns the collection tree starting at the provided parent node (`node_id` path parameter).
+
+    Any collection of the hierarchy can be requested, hence large trees can be fetched level by level via `depth=1`,
+    expanding the nodes marked as `truncated` with further requests.
+
+    Without `depth` and `fields`, the nodes hold all attributes. Otherwise, the nodes only hold the requested attributes
+    and their children, and the nodes whose children were cut off additionally have `truncated: true`.
+
+    The ETag of the response is derived from the version of the cached collection hierarchy. Requests with a matching
+    If-None-Match header are answered with 304 Not Modified without serializing the tree.
     """
-    return tree(node_id)
+    collection_tree = await tree(node_id)
+    if (version := tree_cache.version()) is None:
+        return conditional_response(request, tree_slice(collection_tree, depth=depth, fields=fields))
+    tag = etag("tree", version, node_id, depth, None if fields is None else sorted(field.value for field in fields))
+    if (response := not_modified(request, tag)) is not None:
+        return response
+    return conditional_response(request, tree_slice(collection_tree, depth=depth, fields=fields), tag=tag)
 
 
 @router.get(
@@ -258,6 +539,9 @@ async def get_pending_collections(
             ]
         },
     ),
+    pagination: Optional[Pagination] = Depends(pagination_params),
+    stream: bool = Depends(stream_params),
+    response: Response,
 ):
     """
     Provides a list of missing entries for different types of materials by sub-collection.
@@ -265,6 +549,11 @@ async def get_pending_collections(
     Searches for entries with one of the following properties being empty or missing:
       - keywords (cclom:general_keyword)
       - description (cclom:general_description)
+
+    The list can be fetched page by page via the `limit` and `cursor` query parameters. The cursor of the next page is
+    returned in the X-Next-Cursor header, which is missing on the last page.
+
+    With `Accept: application/x-ndjson` (or `stream=true`) all entries are streamed as newline delimited JSON instead.
     <b>
     TODO:
       - why do we use cclom:general_description? Isn't this an attribute of a material?
@@ -278,6 +567,11 @@ async def get_pending_collections(
         missing_attribute = ElasticResourceAttribute.COLLECTION_DESCRIPTION
     else:
         raise HTTPException(status_code=400, detail=f"Invalid collection attribute: {missing_attribute}")
+    search = pending_collections_search(node_id, missing=missing_attribute)
+    if stream:
+        return await stream_ndjson(search, build_pending_collections, pending_collections_filter_path)
+    if pagination is not None:
+        return await paginate(search, build_pending_collections, pending_collections_filter_path, pagination, response)
     return await pending_collections(node_id, missing=missing_attribute)
 
 
@@ -292,6 +586,9 @@ async def get_pending_materials(
     *,
     node_id: uuid.UUID = Depends(toplevel_collections),
     missing_attr_filter: MissingAttributeFilter = Depends(materials_filter_params),
+    pagination: Optional[Pagination] = Depends(pagination_params),
+    stream: bool = Depends(stream_params),
+    response: Response,
 ):
     """
     A list of missing entries for different types of materials belonging to the collection and its sub-collections
@@ -313,6 +610,11 @@ async def get_pending_materials(
     - type (type)
     - keywords (properties.cclom:general_keyword)
 
+    The list can be fetched page by page via the `limit` and `cursor` query parameters. The cursor of the next page is
+    returned in the X-Next-Cursor header, which is missing on the last page.
+
+    With `Accept: application/x-ndjson` (or `stream=true`) all entries are streamed as newline delimited JSON instead.
+
     <b>
     TODO:
       - align implementation of pending-materials and pending-collection endpoints
@@ -327,11 +629,14 @@ async def get_pending_materials(
       -
     </b>
     """
-    return await pending_materials(
-        collection_id=node_id,
-        # fixme: resolve the whole attribute identification mess
-        missing=getattr(ElasticResourceAttribute, str(missing_attr_filter.attr.name)),
-    )
+    # fixme: resolve the whole attribute identification mess
+    missing = getattr(ElasticResourceAttribute, str(missing_attr_filter.attr.name))
+    search = pending_materials_search(collection_id=node_id, missing=missing)
+    if stream:
+        return await stream_ndjson(search, build_pending_materials, pending_materials_filter_path)
+    if pagination is not None:
+        return await paginate(search, build_pending_materials, pending_materials_filter_path, pagination, response)
+    return await pending_materials(collection_id=node_id, missing=missing)
 
 
 @router.get(
@@ -342,12 +647,14 @@ async def get_pending_materials(
     tags=["Collections"],
     summary="Provide the total number of materials per collection",
 )
-async def get_material_counts(*, node_id: uuid.UUID = Depends(toplevel_collections)):
+async def get_material_counts(*, node_id: uuid.UUID = Depends(toplevel_collections), request: Request):
     """
     Returns the number of materials connected to all collections below this 'node_id' as a flat list.
+
+    The response carries an ETag, requests with a matching If-None-Match header are answered with 304 Not Modified.
     """
-    collection = tree(node_id=node_id)
-    return await material_counts(collection=collection)
+    collection = await tree(node_id=node_id)
+    return conditional_response(request, await material_counts(collection=collection))
 
 
 @router.get(
@@ -379,12 +686,27 @@ async def get_statistics(
 async def get_collection_validation(
     *,
     node_id: uuid.UUID = Depends(toplevel_collections),
+    pagination: Optional[Pagination] = Depends(pagination_params),
+    stream: bool = Depends(stream_params),
+    response: Response,
 ):
     """
     Returns a list of child collections of the given parent collection where
     `title`, `description`, `keywords`, or `edu_context` are missing.
+
+    The list can be fetched page by page via the `limit` and `cursor` query parameters. The cursor of the next page is
+    returned in the X-Next-Cursor header, which is missing on the last page.
+
+    With `Accept: application/x-ndjson` (or `stream=true`) all entries are streamed as newline delimited JSON instead.
     """
-    return collection_validation(node_id)
+    search = collection_validation_search(node_id)
+    if stream:
+        return await stream_ndjson(search, build_collection_validation, collection_validation_filter_path)
+    if pagination is not None:
+        return await paginate(
+            search, build_collection_validation, collection_validation_filter_path, pagination, response
+        )
+    return await collection_validation(node_id)
 
 
 @router.get(
@@ -411,7 +733,7 @@ async def get_material_validation(
     """
     try:
         if False:  # Fixme: if possible optimize the query and return real time data
-            return material_validation(collection_id=node_id)  # noqa
+            return await material_validation(collection_id=node_id)  # noqa
         return material_validation_cache[node_id]
     except KeyError:
         raise HTTPException(
@@ -437,3 +759,39 @@ async def ping_api():
     Ping function for automatic health check.
     """
     return {"status": "ok"}
+
+
+@router.get(
+    "/_stats/elastic-connections",
+    response_model=list[ConnectionPoolStats],
+    tags=["Healthcheck"],
+)
+async def elastic_connection_stats():
+    """
+    Utilisation of the connection pool to elasticsearch (one entry per elasticsearch host).
+    """
+    return connection_pool_stats(get_connection())
+
+
+@router.get(
+    "/_stats/search-cache",
+    response_model=SearchCacheStats,
+    tags=["Healthcheck"],
+)
+async def search_cache_stats():
+    """
+    Hit, miss and eviction counters of the cache for elasticsearch responses.
+    """
+    return search_cache.stats()
+
+
+@router.get(
+    "/_stats/tree-cache",
+    response_model=TreeCacheStats,
+    tags=["Healthcheck"],
+)
+async def tree_cache_stats():
+    """
+    Age, build duration and hit counters of the cached collection trees.
+    """
+    return tree_cache.stats()
@@ -5,8 +5,9 @@ from fastapi import HTTPException
 from pydantic import BaseModel
 
 from app.core.config import ELASTIC_TOTAL_SIZE
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import CollectionSearch
+from app.elastic.search import CollectionSearch, hits, success
 
 
 class OehValidationError(str, Enum):
@@ -23,20 +24,8 @@ class CollectionValidation(BaseModel):
     edu_context: list[OehValidationError]
 
 
-def collection_validation(collection_id: uuid.UUID) -> list[CollectionValidation]:
-    """
-    Get a list of collections (part of the sub-tree defined by given collection id, including the root of the subtree)
-    where one of the following attributes is missing:
-
-    - title # fixme: can a title be empty @tsimon
-    - description
-    - keywords
-    - edu_context # fixme: does this even make sense?
-
-    TODO: Eventually align the return data structure with PendingMaterialsResponse as we do the same thing for
-          collections that is done for materials with PendingMaterialsResponse.
-    """
-    search = (
+def collection_validation_search(collection_id: uuid.UUID) -> CollectionSearch:
+    return (
         CollectionSearch()
         .collection_filter(collection_id=collection_id)
         .missing_attribute_filter(
@@ -48,21 +37,42 @@ def collection_validation(collection_id: uuid.UUID) -> list[CollectionValidation
         .source(
             includes=["nodeRef.id", "properties.cm:title"]  # title is nice for debugging but actually not needed here
         )
-        .extra(size=ELASTIC_TOTAL_SIZE, from_=0)
     )
 
-    result = search.execute()
 
-    if not result.success():
+# the parts of the (plain) search response needed to build the collection validation
+collection_validation_filter_path = ["hits.hits._source.nodeRef.id", "hits.hits.matched_queries"]
+
+
+def build_collection_validation(result: dict) -> list[CollectionValidation]:
+    if not success(result):
         raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
 
     return [
         CollectionValidation(
-            node_id=uuid.UUID(hit["nodeRef"]["id"]),
-            title=[OehValidationError.MISSING] if "title" in hit.meta.matched_queries else [],
-            description=[OehValidationError.MISSING] if "description" in hit.meta.matched_queries else [],
-            keywords=[OehValidationError.MISSING] if "keywords" in hit.meta.matched_queries else [],
-            edu_context=[OehValidationError.MISSING] if "edu_context" in hit.meta.matched_queries else [],
+            node_id=uuid.UUID(hit["_source"]["nodeRef"]["id"]),
+            title=[OehValidationError.MISSING] if "title" in hit["matched_queries"] else [],
+            description=[OehValidationError.MISSING] if "description" in hit["matched_queries"] else [],
+            keywords=[OehValidationError.MISSING] if "keywords" in hit["matched_queries"] else [],
+            edu_context=[OehValidationError.MISSING] if "edu_context" in hit["matched_queries"] else [],
         )
-        for hit in result.hits
+        for hit in hits(result)
     ]
+
+
+@single_flight(key=lambda collection_id: collection_id)
+async def collection_validation(collection_id: uuid.UUID) -> list[CollectionValidation]:
+    """
+    Get a list of collections (part of the sub-tree defined by given collection id, including the root of the subtree)
+    where one of the following attributes is missing:
+
+    - title # fixme: can a title be empty @tsimon
+    - description
+    - keywords
+    - edu_context # fixme: does this even make sense?
+
+    TODO: Eventually align the return data structure with PendingMaterialsResponse as we do the same thing for
+          collections that is done for materials with PendingMaterialsResponse.
+    """
+    search = collection_validation_search(collection_id).extra(size=ELASTIC_TOTAL_SIZE, from_=0)
+    return build_collection_validation(await search.execute_raw(filter_path=collection_validation_filter_path))
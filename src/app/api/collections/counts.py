@@ -6,7 +6,8 @@ from elasticsearch_dsl import A
 from pydantic import BaseModel
 
 from app.core.config import ELASTIC_TOTAL_SIZE
-from app.elastic.search import MaterialSearch
+from app.core.single_flight import single_flight
+from app.elastic.search import MaterialSearch, execute_many
 
 
 class Counts(BaseModel):
@@ -34,9 +35,16 @@ class AggregationMappings(str, Enum):
     license = ("properties.ccm:commonlicense_key.keyword",)
 
 
+@single_flight(key=lambda node_id, facet: (node_id, facet))
 async def counts(node_id: uuid.UUID, facet: AggregationMappings) -> Optional[list[Counts]]:
-    counts = await _collection_counts(node_id=node_id, facet=facet, oer_only=False)
-    oer_counts = await _collection_counts(node_id=node_id, facet=facet, oer_only=True)
+    # send both searches within a single multi search request
+    counts, oer_counts = [
+        _build_counts(response) if response.success() else None
+        for response in await execute_many(
+            _collection_counts_search(node_id=node_id, facet=facet, oer_only=False),
+            _collection_counts_search(node_id=node_id, facet=facet, oer_only=True),
+        )
+    ]
 
     if counts and oer_counts:
         # merge counts and oer_counts
@@ -64,14 +72,6 @@ def _collection_counts_search(node_id: uuid.UUID, facet: AggregationMappings, oe
     return search.extra(size=0)
 
 
-async def _collection_counts(
-    node_id: uuid.UUID, facet: AggregationMappings, oer_only: bool = False
-) -> Optional[list[Counts]]:
-    response = _collection_counts_search(node_id, facet, oer_only).execute()
-    if response.success():
-        return _build_counts(response)
-
-
 def _build_counts(response) -> list[Counts]:
     return [
         Counts(
@@ -1,11 +1,13 @@
 import uuid
+from array import array
 
 from elasticsearch_dsl.aggs import A
 from elasticsearch_dsl.response import Response
 from fastapi import HTTPException
 from pydantic import BaseModel
 
-from app.api.collections.tree import Tree
+from app.api.collections.tree import Tree, tree_index
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute
 from app.elastic.search import MaterialSearch
 
@@ -16,6 +18,7 @@ class MaterialCounts(BaseModel):
     materials_count: int
 
 
+@single_flight(key=lambda collection: collection.node_id)
 async def material_counts(collection: Tree) -> list[MaterialCounts]:
     """
     Compute the number of materials for every node of the given collection tree.
@@ -45,21 +48,24 @@ async def material_counts(collection: Tree) -> list[MaterialCounts]:
         A("terms", field=ElasticResourceAttribute.COLLECTION_NODEREF_ID.keyword, size=65536),
     )
 
-    response: Response = search.execute()
+    response: Response = await search.execute()
 
     if not response.success():
         raise HTTPException(status_code=502, detail="Failed to fetch data from elasticsearch")
 
-    # the collections where the count is larger than zero
-    counts: dict[uuid.UUID, int] = {
-        uuid.UUID(bucket["key"]): bucket["doc_count"] for bucket in response.aggregations["collections"]["buckets"]
-    }
+    # the counts by position in the collection forest, collections where the count is zero have no bucket
+    index, root = tree_index(collection)
+    nodes = index.preorder(root)
+    counts = array("q", [0]) * len(nodes)
+    for bucket in response.aggregations["collections"]["buckets"]:
+        if (i := index.position.get(uuid.UUID(bucket["key"]))) is not None and index.is_ancestor(root, i):
+            counts[i - root] = bucket["doc_count"]
 
     # fixme: eventually sort in the frontend and document in the API that the order of elements is unspecified?
     return sorted(
         [
-            MaterialCounts(node_id=node.node_id, title=node.title, materials_count=counts.get(node.node_id, 0))
-            for node in collection.flatten(root=True)
+            MaterialCounts(node_id=index.ids[i], title=index.titles[i], materials_count=count)
+            for i, count in zip(nodes, counts)
         ],
         key=lambda c: c.materials_count,
     )
@@ -8,7 +8,7 @@ from app.core.config import ELASTIC_TOTAL_SIZE, BACKGROUND_TASK_TIME_INTERVAL
 from app.core.constants import COLLECTION_NAME_TO_ID
 from app.core.logging import logger
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import MaterialSearch
+from app.elastic.search import MaterialSearch, hits
 
 
 class MaterialValidation(BaseModel):
@@ -33,7 +33,7 @@ class MaterialValidation(BaseModel):
     intended_end_user_role: list[uuid.UUID]
 
 
-def _get_material_validation_single_collection(collection_id: uuid.UUID, title: str) -> MaterialValidation:
+async def _get_material_validation_single_collection(collection_id: uuid.UUID, title: str) -> MaterialValidation:
     """
     Build the stats object holding material count statistics for a singular collection.
 
@@ -75,36 +75,40 @@ def _get_material_validation_single_collection(collection_id: uuid.UUID, title:
         .missing_attribute_filter(**relevant_attributes)
         .extra(size=ELASTIC_TOTAL_SIZE, from_=0)
         .source(includes=["nodeRef.id"])
+        # the response holds all materials of the collection and is only needed by the background job, caching it
+        # would evict the responses of the dashboard searches
+        .cache(ttl=0)
     )
 
-    hits = search.execute().hits
+    response = await search.execute_raw(filter_path=["hits.hits._source.nodeRef.id", "hits.hits.matched_queries"])
 
     # now we loop over the results a single time and append to the respective list where appropriate
-    for hit in hits:
-        node_id = uuid.UUID(hit["nodeRef"]["id"])
+    for hit in hits(response):
+        node_id = uuid.UUID(hit["_source"]["nodeRef"]["id"])
+        matched_queries = hit.get("matched_queries", [])
 
         assert (
-            len(hit.meta.matched_queries) > 0
+            len(matched_queries) > 0
         ), f"Found 'matched_queries' of length 0 which should never happen. nodeRef.id: {node_id}"
 
-        for match in hit.meta.matched_queries:
+        for match in matched_queries:
             # we need to strip the "missing_" prefix from the matched query name :-/
             getattr(materials, match).append(node_id)
 
     return materials
 
 
-def material_validation(collection_id: uuid.UUID) -> list[MaterialValidation]:
+async def material_validation(collection_id: uuid.UUID) -> list[MaterialValidation]:
     """
     Build the response for the /material-validation endpoint.
 
     :param collection_id: The id of top level collection
     """
-    collection_tree = tree(node_id=collection_id)
+    collection_tree = await tree(node_id=collection_id)
     logger.info(f"Working on {collection_tree.title} ({collection_id})")
 
     return [
-        _get_material_validation_single_collection(node.node_id, title=node.title)
+        await _get_material_validation_single_collection(node.node_id, title=node.title)
         for node in collection_tree.flatten(root=True)
     ]
 
@@ -114,12 +118,12 @@ material_validation_cache: dict[uuid.UUID, list[MaterialValidation]] = {}
 
 
 @repeat_every(seconds=BACKGROUND_TASK_TIME_INTERVAL, logger=logger)
-def background_task():
+async def background_task():
     logger.info(f"Updating material validation cache. Length: {len(COLLECTION_NAME_TO_ID)}")
 
     for counter, (title, collection) in enumerate(COLLECTION_NAME_TO_ID.items()):
         collection = uuid.UUID(collection)
-        material_validation_cache[collection] = material_validation(collection_id=collection)
+        material_validation_cache[collection] = await material_validation(collection_id=collection)
 
     logger.info("Storing in cache.")
     logger.info("Background task done")
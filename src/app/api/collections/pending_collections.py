@@ -8,8 +8,9 @@ from pydantic import BaseModel
 from app.api.collections.tree import Tree
 from app.core.config import ELASTIC_TOTAL_SIZE
 from app.core.logging import logger
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import CollectionSearch
+from app.elastic.search import CollectionSearch, hits, success
 
 
 class PendingCollection(BaseModel):
@@ -26,29 +27,7 @@ class PendingCollection(BaseModel):
     name: str
 
 
-async def pending_collections(
-    collection_id: uuid.UUID, missing: ElasticResourceAttribute
-) -> list[PendingCollection]:
-    """
-    Note: the returned list will be a flat list of nodes which are not organized in a tree structure and have no
-    relations between each other.
-    # fixme: this is still terribly messy, we actually want a list of collections returned here...
-    #        Eventually, we should separate into something like this:
-
-    class Collection:
-        title: str
-        description: Optional[str]
-        id: UUID
-        keywords: list[str]
-
-    class CollectionTreeNode:
-        collection: Collection
-        children: list[CollectionTreeNode]
-        # optionally parent: Optional[CollectionTreeNode]
-
-    this way, we do not mix the hierarchical data structure with the actual collection entity.
-    """
-
+def pending_collections_search(collection_id: uuid.UUID, missing: ElasticResourceAttribute) -> CollectionSearch:
     source: list = [
         ElasticResourceAttribute.NODE_ID,
         ElasticResourceAttribute.COLLECTION_TITLE,
@@ -56,16 +35,20 @@ async def pending_collections(
         ElasticResourceAttribute.COLLECTION_DESCRIPTION,
     ]
 
-    search = (
+    return (
         CollectionSearch()
         .collection_filter(collection_id=collection_id)
         .missing_attribute_filter(missing=missing)
         .source(include=[attr.path for attr in source])
-        .extra(size=ELASTIC_TOTAL_SIZE, from_=0)
     )
 
-    response = search.execute()
-    if not response.success():
+
+# the parts of the (plain) search response needed to build the pending collections
+pending_collections_filter_path = ["hits.hits._source"]
+
+
+def build_pending_collections(response: dict) -> list[PendingCollection]:
+    if not success(response):
         raise HTTPException(status_code=502, detail="Failed to query elastic search")
 
     missing_attributes_spec = {
@@ -77,9 +60,9 @@ async def pending_collections(
         "description": Coalesce(ElasticResourceAttribute.COLLECTION_DESCRIPTION.path, default=None),
     }
 
-    def try_collection(hit) -> Optional[PendingCollection]:
+    def try_collection(hit: dict) -> Optional[PendingCollection]:
         try:
-            kwargs = glom(hit.to_dict(), missing_attributes_spec)
+            kwargs = glom(hit, missing_attributes_spec)
             description = kwargs.pop("description")
             title = kwargs.pop("title")
             return PendingCollection(
@@ -94,8 +77,33 @@ async def pending_collections(
                 **kwargs,
             )
         except Exception as e:
-            logger.warning(
-                f"Failed to instantiate CollectionNode object from elastic search hit: {e}, hit:{hit.to_dict()}"
-            )
+            logger.warning(f"Failed to instantiate CollectionNode object from elastic search hit: {e}, hit:{hit}")
+
+    return [node for hit in hits(response) if (node := try_collection(hit["_source"])) is not None]
 
-    return [node for hit in response.hits if (node := try_collection(hit)) is not None]
+
+@single_flight(key=lambda collection_id, missing: (collection_id, missing))
+async def pending_collections(
+    collection_id: uuid.UUID, missing: ElasticResourceAttribute
+) -> list[PendingCollection]:
+    """
+    Note: the returned list will be a flat list of nodes which are not organized in a tree structure and have no
+    relations between each other.
+    # fixme: this is still terribly messy, we actually want a list of collections returned here...
+    #        Eventually, we should separate into something like this:
+
+    class Collection:
+        title: str
+        description: Optional[str]
+        id: UUID
+        keywords: list[str]
+
+    class CollectionTreeNode:
+        collection: Collection
+        children: list[CollectionTreeNode]
+        # optionally parent: Optional[CollectionTreeNode]
+
+    this way, we do not mix the hierarchical data structure with the actual collection entity.
+    """
+    search = pending_collections_search(collection_id, missing).extra(size=ELASTIC_TOTAL_SIZE, from_=0)
+    return build_pending_collections(await search.execute_raw(filter_path=pending_collections_filter_path))
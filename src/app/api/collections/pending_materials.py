@@ -8,8 +8,9 @@ from pydantic import BaseModel
 
 from app.core.config import ELASTIC_TOTAL_SIZE
 from app.core.logging import logger
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute, ElasticField
-from app.elastic.search import MaterialSearch
+from app.elastic.search import MaterialSearch, hits, success
 
 
 class PendingMaterial(BaseModel):
@@ -63,11 +64,7 @@ def materials_filter_params(*, missing_attr: MissingMaterialField = Path(...)) -
     return MissingAttributeFilter(attr=missing_attr)
 
 
-async def pending_materials(
-    collection_id: uuid.UUID,
-    missing: ElasticResourceAttribute,
-) -> list[PendingMaterial]:
-
+def pending_materials_search(collection_id: uuid.UUID, missing: ElasticResourceAttribute) -> MaterialSearch:
     source = [
         ElasticResourceAttribute.NODE_ID,
         ElasticResourceAttribute.TITLE,
@@ -84,16 +81,20 @@ async def pending_materials(
         # ElasticResourceAttribute.EDU_ENDUSERROLE,
     ]
 
-    search = (
+    return (
         MaterialSearch()
         .collection_filter(collection_id=collection_id, transitive=True)
         .missing_attribute_filter(missing=missing)
         .source(includes=[attr.path for attr in source])
-        .extra(size=ELASTIC_TOTAL_SIZE, from_=0)
     )
 
-    response = search.execute()
-    if not response.success():
+
+# the parts of the (plain) search response needed to build the pending materials
+pending_materials_filter_path = ["hits.hits._source"]
+
+
+def build_pending_materials(response: dict) -> list[PendingMaterial]:
+    if not success(response):
         raise HTTPException(status_code=502, detail="Failed to query elasticsearch")
 
     missing_materials_spec = {
@@ -124,9 +125,9 @@ async def pending_materials(
         ),
     }
 
-    def try_material(hit) -> Optional[PendingMaterial]:
+    def try_material(hit: dict) -> Optional[PendingMaterial]:
         try:
-            kwargs = glom(hit.to_dict(), missing_materials_spec)
+            kwargs = glom(hit, missing_materials_spec)
             licenses: str = kwargs.pop("licenses")
             description: str = kwargs.pop("description")
             return PendingMaterial(
@@ -139,7 +140,16 @@ async def pending_materials(
                 **kwargs,
             )
         except Exception as e:
-            logger.warning(f"Failed to instantiate LearningMaterial from search hit: {e}. hit: {hit.to_dict()}")
+            logger.warning(f"Failed to instantiate LearningMaterial from search hit: {e}. hit: {hit}")
             return None
 
-    return [material for hit in response if (material := try_material(hit)) is not None]
+    return [material for hit in hits(response) if (material := try_material(hit["_source"])) is not None]
+
+
+@single_flight(key=lambda collection_id, missing: (collection_id, missing))
+async def pending_materials(
+    collection_id: uuid.UUID,
+    missing: ElasticResourceAttribute,
+) -> list[PendingMaterial]:
+    search = pending_materials_search(collection_id, missing).extra(size=ELASTIC_TOTAL_SIZE, from_=0)
+    return build_pending_materials(await search.execute_raw(filter_path=pending_materials_filter_path))
@@ -1,25 +1,42 @@
 import datetime
+import itertools
 import json
+import time
 import uuid
+from array import array
 from asyncio import ensure_future
 from functools import cache
-from typing import Iterable, Literal, Optional, Iterator, Any, Tuple
+from operator import sub
+from typing import Literal, Optional, Iterable, Iterator, Any, Awaitable, Callable, get_args
 
 import aiocron
 from elasticsearch_dsl import A
+from elasticsearch_dsl.query import Bool
 from fastapi import HTTPException
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel, Field
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-
-from app.api.collections.tree import Tree, tree
-from app.core.config import QUALITY_MATRIX_BACKUP_SCHEDULE, ELASTIC_TOTAL_SIZE
+from starlette.concurrency import run_in_threadpool
+
+from app.api.collections.tree import Tree, tree, tree_index
+from app.api.collections.tree_index import TreeIndex
+from app.core.config import (
+    ELASTIC_TOTAL_SIZE,
+    QUALITY_MATRIX_BACKUP_CONCURRENCY,
+    QUALITY_MATRIX_BACKUP_SCHEDULE,
+    QUALITY_MATRIX_COLUMN_SHARD_SIZE,
+    QUALITY_MATRIX_REFRESH_INTERVAL,
+)
 from app.core.constants import COLLECTION_NAME_TO_ID
 from app.core.logging import logger
 from app.core.meta_hierarchy import METADATA_HIERARCHY, load_metadataset
+from app.core.single_flight import single_flight
 from app.db.tasks import Timeline, session_maker
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import MaterialSearch
+from app.elastic.search import MaterialSearch, material_collection_query, success
+from app.elastic.template import search_template
+from app.elastic.utils import gather
 
 QualityMatrixMode = Literal["replication-source", "collection"]
 
@@ -45,24 +62,223 @@ class QualityMatrix(BaseModel):
     rows: list[QualityMatrixRow]
 
 
-def quality_matrix(collection: Tree, mode: QualityMatrixMode) -> QualityMatrix:
+@single_flight(key=lambda collection, mode, columns=None: (collection.node_id, mode, columns))
+async def quality_matrix(
+    collection: Tree, mode: QualityMatrixMode, columns: Optional[frozenset[str]] = None
+) -> QualityMatrix:
+    """
+    :param columns: Only compute these columns (see `select_columns`), all columns if None.
+    """
     if mode == "replication-source":
-        return _replication_source_quality_matrix(collection)
+        return await _replication_source_quality_matrix(collection, columns=columns)
     elif mode == "collection":
-        return _collection_quality_matrix(collection)
+        return await _collection_quality_matrix(collection, columns=columns)
     else:
         raise RuntimeError(f"Unsupported quality matrix mode: {mode}")
 
 
-def _flat_hierarchy() -> Iterator[tuple[int, str, Optional[ElasticResourceAttribute]]]:
+def select_columns(
+    groups: Optional[Iterable[str]] = None, columns: Optional[Iterable[str]] = None
+) -> Optional[frozenset[str]]:
+    """
+    The names of the columns of the given groups (the keys of METADATA_HIERARCHY) and the given individual columns.
+
+    :return: None (i.e. all columns) if neither groups nor columns are given.
+    """
+    if groups is None and columns is None:
+        return None
+    names = {name for _, name in itertools.chain.from_iterable(METADATA_HIERARCHY.values())}
+    unknown = [group for group in groups or [] if group not in METADATA_HIERARCHY]
+    unknown += [column for column in columns or [] if column not in names]
+    if len(unknown) != 0:
+        raise HTTPException(status_code=400, detail=f"Unknown quality matrix column groups or columns: {unknown}")
+    selected = set(columns or [])
+    for group in groups or []:
+        selected.update(name for _, name in METADATA_HIERARCHY[group])
+    return frozenset(selected)
+
+
+def _select(matrix: QualityMatrix, columns: Optional[frozenset[str]]) -> QualityMatrix:
+    """Reduce the matrix to the given columns."""
+    if columns is None:
+        return matrix
+    names = _attribute_columns(columns)[0]
+    return QualityMatrix.construct(
+        rows=[
+            QualityMatrixRow.construct(
+                meta=row.meta, counts={name: row.counts[name] for name in names}, total=row.total
+            )
+            for row in matrix.rows
+        ],
+        columns=_quality_matrix_columns(columns),
+    )
+
+
+class QualityMatrixCache:
+    """
+    The quality matrices of all top level collections (COLLECTION_NAME_TO_ID) in all modes, precomputed in background.
+
+    The matrices are recomputed by `refresh` (periodically called via `quality_matrix_refresh_job`), while the previous
+    versions are served. Matrices of other collections are not cached but computed live. The job waits one interval
+    before its first refresh, such that it does not add to the load at startup. Until then, the first request for a
+    matrix computes and caches it.
+    """
+
+    def __init__(self):
+        self._entries: dict[tuple[uuid.UUID, QualityMatrixMode], tuple[QualityMatrix, datetime.datetime]] = {}
+
+    async def get(
+        self,
+        collection: Tree,
+        mode: QualityMatrixMode,
+        fresh: bool = False,
+        columns: Optional[frozenset[str]] = None,
+    ) -> tuple[QualityMatrix, datetime.datetime]:
+        """
+        Return the quality matrix and the time when its computation started.
+
+        :param fresh: If true, the matrix is computed live (and cached for subsequent calls).
+        :param columns: Only return these columns (see `select_columns`). Cached matrices are reduced to the columns,
+                        live computations only query the columns (and are not cached).
+        """
+        key = (collection.node_id, mode)
+        if not fresh and (entry := self._entries.get(key)) is not None:
+            matrix, computed_at = entry
+            return _select(matrix, columns), computed_at
+        started = datetime.datetime.now(datetime.timezone.utc)
+        entry = (await quality_matrix(collection, mode=mode, columns=columns), started)
+        if columns is None and str(collection.node_id) in COLLECTION_NAME_TO_ID.values():
+            self._entries[key] = entry
+        return entry
+
+    def computed_at(self, node_id: uuid.UUID, mode: QualityMatrixMode) -> Optional[datetime.datetime]:
+        """The version of the cached matrix, i.e. the time its computation started, or None if it is not cached."""
+        entry = self._entries.get((node_id, mode))
+        return None if entry is None else entry[1]
+
+    async def refresh_all(
+        self, mode: QualityMatrixMode, max_age: Optional[float] = None
+    ) -> dict[uuid.UUID, QualityMatrix]:
+        """
+        Recompute and cache the matrices of all top level collections in the given mode.
+
+        The replication source matrices of all collections are computed within a single aggregation, the collection
+        matrices concurrently (at most QUALITY_MATRIX_BACKUP_CONCURRENCY at once). Collections whose matrix could not
+        be computed are logged and left out of the result.
+
+        :param max_age: If given, cached matrices whose computation started at most this many seconds ago are returned
+                        as they are, only the missing and older ones are recomputed.
+        """
+        started = datetime.datetime.now(datetime.timezone.utc)
+        collection_ids = [uuid.UUID(node_id) for node_id in COLLECTION_NAME_TO_ID.values()]
+
+        recent = {}
+        if max_age is not None:
+            for node_id in collection_ids:
+                entry = self._entries.get((node_id, mode))
+                if entry is not None and (started - entry[1]).total_seconds() <= max_age:
+                    recent[node_id] = entry[0]
+            collection_ids = [node_id for node_id in collection_ids if node_id not in recent]
+            logger.debug(f"Reusing {len(recent)} cached '{mode}' quality matrices, computing {len(collection_ids)}")
+            if len(collection_ids) == 0:
+                return recent
+
+        if mode == "replication-source":
+            pass_started = time.monotonic()
+            matrices = await replication_source_quality_matrices(collection_ids)
+            duration = time.monotonic() - pass_started
+            logger.debug(f"Computed {len(matrices)} '{mode}' quality matrices in a single pass in {duration:.2f}s")
+        else:
+
+            async def compute(node_id: uuid.UUID) -> Optional[QualityMatrix]:
+                item_started = time.monotonic()
+                try:
+                    root = await tree(node_id=node_id)
+                    matrix = await quality_matrix(root, mode=mode)
+                except Exception as e:
+                    logger.warning(f"Failed to compute '{mode}' quality matrix of {node_id}: {e}")
+                    return None
+                duration = time.monotonic() - item_started
+                logger.debug(f"Computed '{mode}' quality matrix for '{root.title} ({node_id})' in {duration:.2f}s")
+                return matrix
+
+            results = await gather(*map(compute, collection_ids), limit=QUALITY_MATRIX_BACKUP_CONCURRENCY)
+            matrices = {node_id: matrix for node_id, matrix in zip(collection_ids, results) if matrix is not None}
+
+        for node_id, matrix in matrices.items():
+            self._entries[(node_id, mode)] = (matrix, started)
+        return {**recent, **matrices}
+
+    async def refresh(self):
+        for mode in get_args(QualityMatrixMode):
+            try:
+                await self.refresh_all(mode)
+            except Exception as e:
+                logger.warning(f"Failed to refresh '{mode}' quality matrices, keeping previous: {e}")
+
+    def clear(self):
+        self._entries.clear()
+
+
+quality_matrix_cache = QualityMatrixCache()
+
+
+@repeat_every(seconds=QUALITY_MATRIX_REFRESH_INTERVAL, wait_first=True, logger=logger)
+async def quality_matrix_refresh_job():
+    logger.info("Refreshing quality matrix cache")
+    await quality_matrix_cache.refresh()
+    logger.info("Quality matrix cache refreshed")
+
+
+def _flat_hierarchy(
+    columns: Optional[frozenset[str]] = None,
+) -> Iterator[tuple[int, str, Optional[ElasticResourceAttribute]]]:
+    """
+    :param columns: Only yield these columns and the groups they belong to, all columns if None.
+    """
     for key, value in METADATA_HIERARCHY.items():
+        value = [(attribute, name) for attribute, name in value if columns is None or name in columns]
+        if len(value) == 0:
+            continue
         yield 0, key, None
         for attribute, name in value:
             yield 1, name, attribute
 
 
+def _attribute_columns(
+    columns: Optional[frozenset[str]] = None,
+) -> tuple[list[str], list[ElasticResourceAttribute]]:
+    """The names and attributes of the columns of the quality matrix that hold counts (i.e. without the groups)."""
+    names, attributes = _all_attribute_columns()
+    if columns is None:
+        return names, attributes
+    # selections are filtered from the cached columns, caching them would let clients grow the cache without bound
+    selected = [(name, attribute) for name, attribute in zip(names, attributes) if name in columns]
+    return [name for name, _ in selected], [attribute for _, attribute in selected]
+
+
+@cache
+def _all_attribute_columns() -> tuple[list[str], list[ElasticResourceAttribute]]:
+    columns = [(name, attribute) for _, name, attribute in _flat_hierarchy() if attribute is not None]
+    return [name for name, _ in columns], [attribute for _, attribute in columns]
+
+
+def _missing_aggregations(columns: Optional[frozenset[str]] = None) -> dict[str, dict]:
+    """Count the materials missing the attribute of each column."""
+    return {attribute.path: {"missing": {"field": attribute.keyword}} for attribute in _attribute_columns(columns)[1]}
+
+
+def _quality_matrix_columns(columns: Optional[frozenset[str]] = None) -> list[QualityMatrixHeader]:
+    """The column descriptors of the given columns (see `_flat_hierarchy`), filtered from the cached ones."""
+    headers = _all_quality_matrix_columns()
+    if columns is None:
+        return headers
+    selected = {(level, name) for level, name, _ in _flat_hierarchy(columns)}
+    return [header for header in headers if (header.level, header.id) in selected]
+
+
 @cache
-def _quality_matrix_columns() -> list[QualityMatrixHeader]:
+def _all_quality_matrix_columns() -> list[QualityMatrixHeader]:
     """
     Extracts the human readable names of the metadata fields from the metadataset provided by EDU-sharing and build the
     column descriptors.
@@ -123,11 +339,9 @@ def _replication_source_row_headers() -> dict[str, QualityMatrixHeader]:
         return {}
 
 
-def _collection_quality_matrix(collection: Tree) -> QualityMatrix:
-    """
-    The collection quality matrix has the collections as rows and the attribute hierarchy as columns.
-    """
-    search = MaterialSearch().collection_filter(collection_id=collection.node_id, transitive=True).extra(size=0)
+@search_template("columns")
+def _collection_quality_matrix_search(collection_id: uuid.UUID, columns: Optional[frozenset[str]]) -> MaterialSearch:
+    search = MaterialSearch().collection_filter(collection_id=collection_id, transitive=True).extra(size=0)
 
     search.aggs.bucket(
         "collection",
@@ -135,20 +349,25 @@ def _collection_quality_matrix(collection: Tree) -> QualityMatrix:
             "terms",
             field="collections.nodeRef.id.keyword",
             size=ELASTIC_TOTAL_SIZE,
-            aggs={
-                attribute.path: {"missing": {"field": attribute.keyword}}
-                for _, _, attribute in _flat_hierarchy()
-                if attribute is not None
-            },
+            aggs=_missing_aggregations(columns),
         ),
     )
+    return search
 
-    response = search.execute()
-    if not response.success():
-        raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
 
-    # transform the response aggregation which looks as follows into a nested dictionary which will allow to build the
-    # desired QualityMatrix response. Sample response:
+async def _collection_quality_matrix(collection: Tree, columns: Optional[frozenset[str]] = None) -> QualityMatrix:
+    """
+    The collection quality matrix has the collections as rows and the attribute hierarchy as columns.
+    """
+
+    async def query(shard: Optional[frozenset[str]]) -> list[dict[str, Any]]:
+        search = _collection_quality_matrix_search(collection.node_id, columns=shard)
+        response = await search.execute_raw(filter_path=["aggregations"])
+        if not success(response):
+            raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
+        return response.get("aggregations", {}).get("collection", {}).get("buckets", [])
+
+    # Sample response:
     # ...
     #   "aggregations" : {
     #     "collection" : {
@@ -172,70 +391,90 @@ def _collection_quality_matrix(collection: Tree) -> QualityMatrix:
     #                ...
     #              ]
     #         ...
+    buckets = await _query_column_shards(query, columns)
+    index, root = tree_index(collection)
+    return _build_collection_quality_matrix(index, buckets, columns=columns, root=root)
 
-    CollectionID = uuid.UUID  # noqa
-    Attribute = str  # noqa
-
-    # initialize empty dictionaries
-    data: dict[(CollectionID, Attribute), int] = {}
-    totals: dict[CollectionID, int] = {}
 
-    # loop over result and fill dictionaries
-    for bucket in response.aggregations["collection"]["buckets"]:
-        collection_id = uuid.UUID(bucket["key"])
-        totals[collection_id] = bucket["doc_count"]
-        for _, name, attribute in _flat_hierarchy():
-            if attribute is not None:
-                data[(collection_id, name)] = bucket[attribute.path]["doc_count"]
-
-    def bft_with_level(node: Tree, level=0) -> Iterable[tuple[Tree, int]]:
-        yield node, level
-        for child in node.children:
-            yield from bft_with_level(child, level=level + 1)
+def _build_collection_quality_matrix(
+    index: TreeIndex, buckets: list[dict[str, Any]], columns: Optional[frozenset[str]] = None, root: int = 0
+) -> QualityMatrix:
+    """
+    Build the matrix from the buckets of the collection aggregation, with one row per node of the subtree of the index
+    at position `root`.
 
-    return QualityMatrix(
+    The counts are gathered column by column into dense arrays (rows in depth-first pre-order of the index), such that
+    the number of materials having an attribute is a single element wise subtraction per column. Buckets of
+    collections outside the subtree (materials may be part of several collections) are ignored.
+    """
+    names, attributes = _attribute_columns(columns)
+    nodes = index.preorder(root)
+    n = len(nodes)
+    position = {str(index.ids[i]): i - root for i in nodes}
+
+    totals = array("q", [0]) * n
+    missing = [array("q", [0]) * n for _ in attributes]
+    for bucket in buckets:
+        if (i := position.get(bucket["key"])) is None:
+            continue
+        totals[i] = bucket["doc_count"]
+        for column, attribute in zip(missing, attributes):
+            column[i] = bucket[attribute.path]["doc_count"]
+
+    # the number of materials where the meta data field is __NOT__ missing.
+    present = [array("q", map(sub, totals, column)) for column in missing]
+
+    # the values are typed already, hence the validation of pydantic can be skipped
+    subtree, root_level = slice(nodes.start, nodes.stop), index.level[root]
+    return QualityMatrix.construct(
         rows=[
-            QualityMatrixRow(
-                meta=QualityMatrixHeader(
-                    id=str(node.node_id), label=node.title, alt_label=str(node.node_id), level=level
+            QualityMatrixRow.construct(
+                meta=QualityMatrixHeader.construct(
+                    id=str(node_id), label=title, alt_label=str(node_id), level=level - root_level
                 ),
-                counts={
-                    # return the number of materials where the meta data field is __NOT__ missing.
-                    name: totals.get(node.node_id, 0) - data.get((node.node_id, name), 0)
-                    for _, name, attribute in _flat_hierarchy()
-                    if attribute is not None
-                },
-                total=totals.get(node.node_id, 0),
+                counts=dict(zip(names, counts)),
+                total=total,
+            )
+            for node_id, title, level, total, counts in zip(
+                index.ids[subtree], index.titles[subtree], index.level[subtree], totals, zip(*present)
             )
-            for node, level in bft_with_level(collection)
         ],
-        columns=_quality_matrix_columns(),
+        columns=_quality_matrix_columns(columns),
+    )
+
+
+def _replication_source_aggregation(columns: Optional[frozenset[str]] = None) -> A:
+    """Count the materials and the materials missing each attribute of the hierarchy per replication source."""
+    return A(
+        "terms",
+        field=ElasticResourceAttribute.REPLICATION_SOURCE.keyword,
+        size=ELASTIC_TOTAL_SIZE,
+        aggs=_missing_aggregations(columns),
     )
 
 
-def _replication_source_quality_matrix(collection: Tree) -> QualityMatrix:
+@search_template("columns")
+def _replication_source_quality_matrix_search(
+    collection_id: uuid.UUID, columns: Optional[frozenset[str]]
+) -> MaterialSearch:
+    search = MaterialSearch().collection_filter(collection_id=collection_id, transitive=True).extra(size=0)
+    search.aggs.bucket("replication_source", _replication_source_aggregation(columns))
+    return search
+
+
+async def _replication_source_quality_matrix(
+    collection: Tree, columns: Optional[frozenset[str]] = None
+) -> QualityMatrix:
     """
     The replication source quality matrix has the replication source as rows, and the attribute hierarchy as columns.
     """
-    search = MaterialSearch().collection_filter(collection_id=collection.node_id, transitive=True).extra(size=0)
-
-    search.aggs.bucket(
-        "replication_source",
-        A(
-            "terms",
-            field=ElasticResourceAttribute.REPLICATION_SOURCE.keyword,
-            size=ELASTIC_TOTAL_SIZE,
-            aggs={
-                attribute.path: {"missing": {"field": attribute.keyword}}
-                for _, name, attribute in _flat_hierarchy()
-                if attribute is not None
-            },
-        ),
-    )
 
-    response = search.execute()
-    if not response.success():
-        raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
+    async def query(shard: Optional[frozenset[str]]) -> list[dict[str, Any]]:
+        search = _replication_source_quality_matrix_search(collection.node_id, columns=shard)
+        response = await search.execute_raw(filter_path=["aggregations"])
+        if not success(response):
+            raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
+        return response.get("aggregations", {}).get("replication_source", {}).get("buckets", [])
 
     # transform the response aggregation which looks as follows into a nested dictionary which will allow to build the
     # desired QualityMatrix response. Sample response:
@@ -260,7 +499,67 @@ def _replication_source_quality_matrix(collection: Tree) -> QualityMatrix:
     #           "metadatacontributer_creator" : { "doc_count" : 55 }
     #         },
     #         ...
+    return _build_replication_source_quality_matrix(await _query_column_shards(query, columns), columns=columns)
+
+
+async def _query_column_shards(
+    query: Callable[[Optional[frozenset[str]]], Awaitable[list[dict[str, Any]]]], columns: Optional[frozenset[str]]
+) -> list[dict[str, Any]]:
+    """
+    Run the aggregation `query` for the given columns, split into shards of QUALITY_MATRIX_COLUMN_SHARD_SIZE columns.
+
+    The shards are queried concurrently and their buckets are merged by key. As every shard buckets the same
+    materials, the merged buckets (and their order) are identical to the ones of a single query for all columns, but
+    elasticsearch computes fewer sub-aggregations per search.
+
+    :param query: Returns the buckets (with the counts of the missing attributes) for the given columns.
+    """
+    names = _attribute_columns(columns)[0]
+    size = QUALITY_MATRIX_COLUMN_SHARD_SIZE
+    if size <= 0 or len(names) <= size:
+        return await query(columns)
+
+    shards = [frozenset(names[i : i + size]) for i in range(0, len(names), size)]
+    merged: dict[str, dict[str, Any]] = {}
+    for buckets in await gather(*map(query, shards)):
+        for bucket in buckets:
+            merged.setdefault(bucket["key"], {}).update(bucket)
+    return list(merged.values())
+
+
+@single_flight(key=lambda collection_ids: tuple(collection_ids))
+async def replication_source_quality_matrices(collection_ids: list[uuid.UUID]) -> dict[uuid.UUID, QualityMatrix]:
+    """
+    Compute the replication source quality matrices of several collections within a single aggregation.
+
+    The materials are bucketed per collection (`filters` aggregation) and then per replication source, i.e. all
+    matrices are computed in one pass over the materials instead of one search per collection. The matrices are equal
+    to the ones of `_replication_source_quality_matrix`.
+    """
+    filters = {str(node_id): material_collection_query(node_id, transitive=True) for node_id in collection_ids}
+    search = MaterialSearch().filter(Bool(should=list(filters.values()), minimum_should_match=1)).extra(size=0)
+    search.aggs.bucket("collection", "filters", filters=filters).bucket(
+        "replication_source", _replication_source_aggregation()
+    )
+
+    response = await search.execute_raw(filter_path=["aggregations"])
+    if not success(response):
+        raise HTTPException(status_code=502, detail="Failed to run elastic search query.")
+
+    # "aggregations": {"collection": {"buckets": {"<collection id>": {"doc_count": 42, "replication_source": {...}}}}}
+    buckets = response.get("aggregations", {}).get("collection", {}).get("buckets", {})
+    return {
+        node_id: _build_replication_source_quality_matrix(
+            buckets.get(str(node_id), {}).get("replication_source", {}).get("buckets", [])
+        )
+        for node_id in collection_ids
+    }
 
+
+def _build_replication_source_quality_matrix(
+    buckets: list[dict[str, Any]], columns: Optional[frozenset[str]] = None
+) -> QualityMatrix:
+    """Build the matrix from the buckets of the `_replication_source_aggregation`."""
     row_headers = _replication_source_row_headers()
 
     Bucket = dict[str, Any]
@@ -269,13 +568,13 @@ def _replication_source_quality_matrix(collection: Tree) -> QualityMatrix:
         """Returns None for buckets that are not part of the elastic query result."""
         # first loop over all replication sources and insert empty rows in case we did not find anything
         # See: https://github.com/openeduhub/metaqs-main/issues/121
-        buckets = {bucket["key"]: bucket for bucket in response.aggregations["replication_source"]["buckets"]}
+        remaining = {bucket["key"]: bucket for bucket in buckets}
         for key, header in row_headers.items():
             # remove bucket from dictionary to check what is left after this loop
-            yield header, buckets.pop(key, None)
+            yield header, remaining.pop(key, None)
         # now, check if there are any buckets left (in case the set of
         # replication sources from edusharing is not complete)
-        for key, bucket in buckets.items():
+        for key, bucket in remaining.items():
             # use defaults for the rows as we have no alternative...
             yield QualityMatrixHeader(id=bucket["key"], label=bucket["key"], alt_label=bucket["key"], level=0), bucket
 
@@ -286,14 +585,13 @@ def _replication_source_quality_matrix(collection: Tree) -> QualityMatrix:
                 counts={
                     # return the number of materials where the meta data field is __NOT__ missing.
                     name: 0 if bucket is None else (bucket["doc_count"] - bucket[attribute.path]["doc_count"])
-                    for _, name, attribute in _flat_hierarchy()
-                    if attribute is not None
+                    for name, attribute in zip(*_attribute_columns(columns))
                 },
                 total=0 if bucket is None else bucket["doc_count"],
             )
             for header, bucket in rows()
         ],
-        columns=_quality_matrix_columns(),
+        columns=_quality_matrix_columns(columns),
     )
 
 
@@ -325,7 +623,97 @@ def past_quality_matrix(
     return QualityMatrix.parse_obj(json.loads(result[0].quality_matrix))
 
 
-def quality_backup(session: Session, timestamp: datetime.datetime):
+class QualityMatrixSeriesRow(BaseModel):
+    meta: QualityMatrixHeader = Field(description="The header of the row in the latest snapshot containing it")
+    counts: dict[str, list[Optional[int]]] = Field(
+        description="Per column, the counts at the respective timestamps. Keys are the IDs of the columns, null where "
+        "the snapshot lacks the row or column."
+    )
+    total: list[Optional[int]] = Field(description="The totals of the row at the respective timestamps")
+
+
+class QualityMatrixSeries(BaseModel):
+    timestamps: list[int] = Field(description="The timestamps of the snapshots in seconds since epoch, ascending")
+    columns: list[QualityMatrixHeader] = Field(description="Defines the columns of the series")
+    rows: list[QualityMatrixSeriesRow]
+
+
+def _set(values: list[Optional[int]], i: int, value: int):
+    """Set the i-th value of an array that is only ever written in ascending order, padding gaps with None."""
+    values.extend([None] * (i - len(values)))
+    values.append(value)
+
+
+def quality_matrix_series(
+    session: Session,
+    mode: QualityMatrixMode,
+    collection_id: uuid.UUID,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    rows: Optional[Iterable[str]] = None,
+    columns: Optional[frozenset[str]] = None,
+) -> QualityMatrixSeries:
+    """
+    Collect the stored quality matrices between start and end (inclusive) into one array per row and column.
+
+    The snapshots are loaded with a single query and reduced to the given rows and columns while streaming, without
+    parsing them into `QualityMatrix` models.
+
+    :param rows: Only include rows with these ids, all rows if None.
+    :param columns: Only include these columns (see `select_columns`), all columns if None.
+    """
+    query = (
+        session.query(Timeline.timestamp, Timeline.quality_matrix)
+        .where(Timeline.mode == mode)
+        .where(Timeline.node_id == str(collection_id))
+    )
+    if start is not None:
+        query = query.where(Timeline.timestamp >= start)
+    if end is not None:
+        query = query.where(Timeline.timestamp <= end)
+    rows = None if rows is None else frozenset(rows)
+
+    stamps: list[int] = []
+    column_headers: dict[str, dict] = {}
+    row_headers: dict[str, dict] = {}
+    totals: dict[str, list[Optional[int]]] = {}
+    counts: dict[str, dict[str, list[Optional[int]]]] = {}
+    for i, (timestamp, stored) in enumerate(query.order_by(Timeline.timestamp).yield_per(64)):
+        snapshot = json.loads(stored)
+        stamps.append(timestamp)
+        for header in snapshot["columns"]:
+            if columns is None or header["id"] in columns:
+                column_headers.setdefault(header["id"], header)
+        for row in snapshot["rows"]:
+            row_id = row["meta"]["id"]
+            if rows is not None and row_id not in rows:
+                continue
+            row_headers[row_id] = row["meta"]
+            _set(totals.setdefault(row_id, []), i, row["total"])
+            row_counts = counts.setdefault(row_id, {})
+            for name, count in row["counts"].items():
+                if columns is None or name in columns:
+                    _set(row_counts.setdefault(name, []), i, count)
+
+    def padded(values: list[Optional[int]]) -> list[Optional[int]]:
+        values.extend([None] * (len(stamps) - len(values)))
+        return values
+
+    return QualityMatrixSeries.construct(
+        timestamps=stamps,
+        columns=[QualityMatrixHeader.construct(**header) for header in column_headers.values()],
+        rows=[
+            QualityMatrixSeriesRow.construct(
+                meta=QualityMatrixHeader.construct(**meta),
+                counts={name: padded(values) for name, values in counts[row_id].items()},
+                total=padded(totals[row_id]),
+            )
+            for row_id, meta in row_headers.items()
+        ],
+    )
+
+
+async def quality_backup(session: Session, timestamp: datetime.datetime):
     """
     Note: If multiple instances of the app are running (e.g. via
     multiple gunicorn workers), we should not store the quality
@@ -334,27 +722,54 @@ def quality_backup(session: Session, timestamp: datetime.datetime):
     Hence, we pass in the timestamp of the scheduled save and use
     it as part of the primary key. The database will then make sure
     we cannot write duplicate instances.
+
+    The matrices of all top level collections are taken from the `quality_matrix_cache` if they were computed within
+    the last QUALITY_MATRIX_REFRESH_INTERVAL, the missing or older ones are recomputed (and cached) via
+    `QualityMatrixCache.refresh_all`. Serializing and writing them happens in a single transaction in a worker thread,
+    such that the event loop keeps serving requests.
     """
     logger.info(f"Storing quality matrices in database for {timestamp}")
+    started = time.monotonic()
+
+    matrices = []
+    for mode in get_args(QualityMatrixMode):
+        try:
+            computed = await quality_matrix_cache.refresh_all(mode, max_age=QUALITY_MATRIX_REFRESH_INTERVAL)
+        except Exception as e:
+            logger.warning(f"Failed to compute '{mode}' quality matrices for backup: {e}")
+            continue
+        matrices.extend((str(node_id), mode, matrix) for node_id, matrix in computed.items())
+
+    stored = await run_in_threadpool(_store_quality_matrices, session, timestamp, matrices)
+    logger.info(
+        f"Stored {stored} of {len(matrices)} quality matrices for {timestamp} in {time.monotonic() - started:.1f}s"
+    )
 
-    modes: Tuple[QualityMatrixMode, ...] = ("replication-source", "collection")
 
-    for node_id in COLLECTION_NAME_TO_ID.values():
-        root = tree(node_id=uuid.UUID(node_id))
-        for mode in modes:
-            try:
-                logger.debug(f"Storing '{mode}' quality matrix for: '{root.title} ({root.node_id})'")
-                with session.begin():
-                    session.add(
-                        Timeline(
-                            timestamp=timestamp.timestamp(),
-                            mode=mode,
-                            node_id=str(node_id),
-                            quality_matrix=quality_matrix(root, mode=mode).json(),
-                        )
-                    )
-            except IntegrityError as e:
-                logger.debug(f"'{mode}' quality matrix already stored ('{root.title} / {root.node_id})': {e}")
+def _store_quality_matrices(
+    session: Session, timestamp: datetime.datetime, matrices: list[tuple[str, QualityMatrixMode, QualityMatrix]]
+) -> int:
+    """
+    Write the quality matrices in a single transaction, skipping those that are already stored for this timestamp.
+
+    :return: The number of written matrices.
+    """
+    try:
+        with session.begin():
+            stored = set(
+                session.query(Timeline.node_id, Timeline.mode).where(Timeline.timestamp == timestamp.timestamp()).all()
+            )
+            rows = [
+                Timeline(timestamp=timestamp.timestamp(), mode=mode, node_id=node_id, quality_matrix=matrix.json())
+                for node_id, mode, matrix in matrices
+                if (node_id, mode) not in stored
+            ]
+            session.add_all(rows)
+        return len(rows)
+    except IntegrityError as e:
+        # another instance stored the same backup concurrently
+        logger.debug(f"Quality matrices for {timestamp} already stored: {e}")
+        return 0
 
 
 def quality_matrix_backup_job():
@@ -371,7 +786,11 @@ def quality_matrix_backup_job():
             logger.info("waiting for next schedule of quality matrix backup")
             await cron.next()  # yields control and waits until the next write is scheduled
             logger.info(f"Backing up quality matrices for {cron.croniter.get_current(ret_type=datetime.datetime)}")
-            with session_maker().context_session() as session:
-                quality_backup(session, timestamp=cron.croniter.get_current(ret_type=datetime.datetime))
+            try:
+                with session_maker().context_session() as session:
+                    await quality_backup(session, timestamp=cron.croniter.get_current(ret_type=datetime.datetime))
+            except Exception as e:
+                # keep the schedule running, the next backup may succeed
+                logger.exception(f"Failed to back up quality matrices: {e}")
 
     ensure_future(loop())
@@ -1,14 +1,17 @@
 import uuid
+from typing import Optional
 
 from elasticsearch_dsl import Q, A
 from elasticsearch_dsl.query import Query, Bool, Terms, Exists
 from elasticsearch_dsl.response import Response
 from pydantic import BaseModel, Field
 
-from app.api.collections.utils import oer_ratio
+from app.api.collections.utils import build_oer_ratio, oer_ratio_search
 from app.core.constants import FORBIDDEN_LICENSES
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import CollectionSearch, MaterialSearch
+from app.elastic.search import CollectionSearch, MaterialSearch, execute_many
+from app.elastic.template import search_template
 
 material_terms_relevant_for_score = [
     "missing_title",
@@ -107,7 +110,13 @@ def map_response_to_output(response: Response) -> dict:
     }
 
 
-def collection_search_score(collection_id: uuid.UUID) -> dict:
+def _build_output(response: Response) -> Optional[dict]:
+    if response.success():
+        return map_response_to_output(response)
+
+
+@search_template()
+def _collection_search_score_search(collection_id: uuid.UUID) -> CollectionSearch:
     search = CollectionSearch().collection_filter(collection_id).extra(size=0, from_=0)
     aggregations = {
         "missing_title": A("missing", field=ElasticResourceAttribute.COLLECTION_TITLE.keyword),
@@ -121,14 +130,15 @@ def collection_search_score(collection_id: uuid.UUID) -> dict:
 
     for name, agg in aggregations.items():
         search.aggs.bucket(name, agg)
+    return search
 
-    response: Response = search.execute()
 
-    if response.success():
-        return map_response_to_output(response)
+async def collection_search_score(collection_id: uuid.UUID) -> dict:
+    return _build_output(await _collection_search_score_search(collection_id).execute())
 
 
-def material_search_score(collection_id: uuid.UUID) -> dict:
+@search_template()
+def _material_search_score_search(collection_id: uuid.UUID) -> MaterialSearch:
     search = MaterialSearch().collection_filter(collection_id, transitive=True).extra(size=0, from_=0)
 
     aggregations = {
@@ -145,24 +155,30 @@ def material_search_score(collection_id: uuid.UUID) -> dict:
 
     for name, agg in aggregations.items():
         search.aggs.bucket(name, agg)
+    return search
 
-    response: Response = search.execute()
 
-    if response.success():
-        return map_response_to_output(response)
+async def material_search_score(collection_id: uuid.UUID) -> dict:
+    return _build_output(await _material_search_score_search(collection_id).execute())
 
 
+@single_flight(key=lambda node_id: node_id)
 async def score(node_id: uuid.UUID) -> Score:
-    collection_stats = collection_search_score(collection_id=node_id)
-    collection_scores = calc_scores(stats=collection_stats)
+    # the three queries are independent of each other, hence send them within a single multi search request
+    collection_response, material_response, oer_response = await execute_many(
+        _collection_search_score_search(collection_id=node_id),
+        _material_search_score_search(collection_id=node_id),
+        oer_ratio_search(collection_id=node_id),
+    )
+    collection_stats = _build_output(collection_response)
+    material_stats = _build_output(material_response)
+    oer = build_oer_ratio(oer_response)
 
-    material_stats = material_search_score(collection_id=node_id)
+    collection_scores = calc_scores(stats=collection_stats)
     material_scores = calc_scores(stats=material_stats)
 
     score_ = calc_weighted_score(collection_scores=collection_scores, material_scores=material_scores)
 
-    oer = oer_ratio(node_id)
-
     collections = MissingCollectionProperties(total=collection_stats["total"], **collection_scores)
     materials = MissingMaterialProperties(total=material_stats["total"], **material_scores)
     return Score(score=score_, collections=collections, materials=materials, oer_ratio=oer)
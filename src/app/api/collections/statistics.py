@@ -8,9 +8,11 @@ from fastapi import HTTPException
 from pydantic import BaseModel, Field
 
 from app.api.collections.tree import tree, Tree
-from app.api.collections.utils import oer_ratio
+from app.api.collections.utils import build_oer_ratio, oer_ratio_search
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute, ElasticField
-from app.elastic.search import MaterialSearch
+from app.elastic.search import MaterialSearch, execute_many
+from app.elastic.utils import gather
 
 
 CountStatistics = dict[str, int]
@@ -95,7 +97,7 @@ class Statistics(BaseModel):
     oer_ratio: int = Field(default=0)
 
 
-def materials_by_collection_title(nodes: list[Tree], oer_only: bool) -> dict[UUID, CountStatistics]:
+async def materials_by_collection_title(nodes: list[Tree], oer_only: bool) -> dict[UUID, CountStatistics]:
     """
     Fuzzy-Search for materials that have description, title, etc. similar to the titles of given collection nodes.
 
@@ -105,7 +107,11 @@ def materials_by_collection_title(nodes: list[Tree], oer_only: bool) -> dict[UUI
 
     :return: A dictionary mapping from the collection IDs to counts per material type.
     """
+    response = await _materials_by_collection_title_search(nodes=nodes, oer_only=oer_only).execute()
+    return _build_materials_by_collection_title(nodes=nodes, response=response)
 
+
+def _materials_by_collection_title_search(nodes: list[Tree], oer_only: bool) -> MaterialSearch:
     if oer_only:
         search = MaterialSearch().oer_filter()
     else:
@@ -134,8 +140,10 @@ def materials_by_collection_title(nodes: list[Tree], oer_only: bool) -> dict[UUI
             },
         },
     )
-    response: Response = search.extra(size=0, from_=0).execute()
+    return search.extra(size=0, from_=0)
+
 
+def _build_materials_by_collection_title(nodes: list[Tree], response: Response) -> dict[UUID, CountStatistics]:
     if not response.success():
         raise HTTPException(status_code=502, detail="Failed to query elastic search")
 
@@ -149,11 +157,16 @@ def materials_by_collection_title(nodes: list[Tree], oer_only: bool) -> dict[UUI
     }
 
 
-def materials_by_collection_id(collection_id: UUID, oer_only: bool) -> dict[UUID, CountStatistics]:
+async def materials_by_collection_id(collection_id: UUID, oer_only: bool) -> dict[UUID, CountStatistics]:
     """
     Query the number of materials per (collection_id, material_type) combination for all collections
     of given parent collection (including the parent).
     """
+    response = await _materials_by_collection_id_search(collection_id=collection_id, oer_only=oer_only).execute()
+    return _build_materials_by_collection_id(response)
+
+
+def _materials_by_collection_id_search(collection_id: UUID, oer_only: bool) -> MaterialSearch:
     if oer_only:
         search = MaterialSearch().oer_filter()
     else:
@@ -191,7 +204,10 @@ def materials_by_collection_id(collection_id: UUID, oer_only: bool) -> dict[UUID
         },
     )
 
-    response = search.execute()
+    return search
+
+
+def _build_materials_by_collection_id(response: Response) -> dict[UUID, CountStatistics]:
     if not response.success():
         raise HTTPException(status_code=502, detail="Failed to query elastics search")
 
@@ -207,17 +223,40 @@ def materials_by_collection_id(collection_id: UUID, oer_only: bool) -> dict[UUID
     return result
 
 
+@single_flight(key=lambda node_id: node_id)
 async def statistics(node_id: uuid.UUID) -> Statistics:
     """
     See API /collections/{node_id}/statistics doc-string.
     """
-    nodes = {node.node_id: node for node in tree(node_id=node_id).flatten(root=True)}
 
-    total_by_title = materials_by_collection_title(nodes=list(nodes.values()), oer_only=False)
-    oer_by_title = materials_by_collection_title(nodes=list(nodes.values()), oer_only=True)
+    async def by_title_statistics() -> tuple[dict[UUID, CountStatistics], dict[UUID, CountStatistics]]:
+        """The title searches need the collection tree, all other queries can run right away."""
+        nodes = list({node.node_id: node for node in (await tree(node_id=node_id)).flatten(root=True)}.values())
+        total, oer_only = await execute_many(
+            _materials_by_collection_title_search(nodes=nodes, oer_only=False),
+            _materials_by_collection_title_search(nodes=nodes, oer_only=True),
+        )
+        return (
+            _build_materials_by_collection_title(nodes=nodes, response=total),
+            _build_materials_by_collection_title(nodes=nodes, response=oer_only),
+        )
+
+    async def by_collection_statistics() -> tuple[dict[UUID, CountStatistics], dict[UUID, CountStatistics], int]:
+        total, oer_only, oer_ratio_ = await execute_many(
+            _materials_by_collection_id_search(collection_id=node_id, oer_only=False),
+            _materials_by_collection_id_search(collection_id=node_id, oer_only=True),
+            oer_ratio_search(collection_id=node_id),
+        )
+        return (
+            _build_materials_by_collection_id(total),
+            _build_materials_by_collection_id(oer_only),
+            build_oer_ratio(oer_ratio_),
+        )
 
-    total_by_collection = materials_by_collection_id(collection_id=node_id, oer_only=False)
-    oer_by_collection = materials_by_collection_id(collection_id=node_id, oer_only=True)
+    (total_by_title, oer_by_title), (total_by_collection, oer_by_collection, oer) = await gather(
+        by_title_statistics(),
+        by_collection_statistics(),
+    )
 
     def transform(by_collection, by_title) -> dict[UUID, SearchAndTotalStats]:
         collection_ids = set(by_collection.keys()) | set(by_title.keys())
@@ -239,5 +278,5 @@ async def statistics(node_id: uuid.UUID) -> Statistics:
         derived_at=datetime.datetime.now(),
         total_stats=transform(total_by_collection, total_by_title),
         oer_stats=transform(oer_by_collection, oer_by_title),
-        oer_ratio=oer_ratio(collection_id=node_id),
+        oer_ratio=oer,
     )
@@ -2,20 +2,28 @@ from __future__ import (  # Needed for recursive type annotation, can be dropped
     annotations,
 )
 
+import time
 import uuid
-from typing import Optional, Iterable
+from enum import Enum
+from typing import Any, Iterable, Optional
 
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.query import Bool, Term
-from elasticsearch_dsl.response import Response
+from elasticsearch_dsl.query import Range
 from fastapi import HTTPException
-from pydantic import BaseModel
+from fastapi_utils.tasks import repeat_every
+from pydantic import BaseModel, Field
 
-from app.core.config import ELASTIC_TOTAL_SIZE
-from app.core.constants import COLLECTION_NAME_TO_ID
+from app.api.collections.tree_index import TreeIndex
+from app.core.config import (
+    ELASTIC_MAX_PAGE_SIZE,
+    TREE_CACHE_REBUILD_INTERVAL,
+    TREE_CACHE_REFRESH_INTERVAL,
+)
+from app.core.constants import COLLECTION_NAME_TO_ID, COLLECTION_ROOT_ID
 from app.core.logging import logger
+from app.core.single_flight import single_flight
 from app.elastic.attributes import ElasticResourceAttribute
-from app.elastic.search import CollectionSearch
+from app.elastic.pagination import iterate_pages
+from app.elastic.search import CollectionSearch, hits, success
 
 
 class Tree(BaseModel):
@@ -30,113 +38,433 @@ class Tree(BaseModel):
         A generator that will iterate through all nodes of the tree in unspecified order.
         :param root: If true, the root node (self) will be included, if false, it will be skipped.
         """
-        if root:
-            yield self
-        for child in self.children:
-            yield from child.flatten(root=True)
+        # explicit stack instead of recursion: constant overhead per node and no recursion limit for deep trees
+        stack = [self] if root else list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def bft(self, root: bool = True) -> Iterable[Tree]:
         """Traverse the tree in breadth-first order."""
         if root:
             yield self
-        for child in self.children:
-            yield child
-        for child in self.children:
-            yield from child.bft(root=False)
+        # the children of a node are followed by the (expanded) children of each of them in turn
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield from node.children
+            stack.extend(reversed(node.children))
+
+
+class TreeField(str, Enum):
+    """The attributes of the nodes of a `Tree` that can be selected via `tree_slice`."""
+
+    node_id = "node_id"
+    title = "title"
+    level = "level"
+    parent_id = "parent_id"
+
+
+class TreeSlice(BaseModel):
+    """
+    The shape of a (partial) tree as serialized by `tree_slice`.
+
+    Only the selected fields of the nodes are present, the children are always present.
+    """
+
+    node_id: Optional[uuid.UUID]
+    level: Optional[int]
+    title: Optional[str]
+    parent_id: Optional[uuid.UUID]
+    children: list[TreeSlice]
+    truncated: Optional[bool] = Field(
+        default=None,
+        description="Present (and true) if the children of the node were cut off by the depth limit",
+    )
+
+
+def tree_slice(tree: Tree, depth: Optional[int] = None, fields: Optional[Iterable[TreeField]] = None) -> dict:
+    """
+    Serialize the top levels of a tree into a json compatible dictionary, skipping the validation of pydantic.
+
+    Nodes whose children were cut off by the depth limit have an empty list of children and `"truncated": true`, such
+    that they can be expanded by requesting the tree of the respective node.
+
+    :param depth: Only include nodes up to this many levels below the given node (0 only includes the node itself).
+    :param fields: Only include these attributes of the nodes (the children are always included).
+    """
+    fields = list(TreeField) if fields is None else list(dict.fromkeys(fields))
+
+    def node(t: Tree) -> dict[str, Any]:
+        result = {}
+        for field in fields:
+            value = getattr(t, field.value)
+            result[field.value] = str(value) if isinstance(value, uuid.UUID) else value
+        return result
+
+    root = node(tree)
+    stack = [(tree, root, 0)]
+    while stack:
+        t, result, level = stack.pop()
+        if depth is not None and level >= depth:
+            result["children"] = []
+            if len(t.children) != 0:
+                result["truncated"] = True
+            continue
+        result["children"] = [node(child) for child in t.children]
+        stack.extend((child, r, level + 1) for child, r in zip(t.children, result["children"]))
+    return root
 
 
-def tree_search(node_id: uuid.UUID) -> Search:
+def forest_search() -> CollectionSearch:
     """
-    Build an elastic search query that will return all nodes of the collection subtree defined by given collection id.
-    Note: The result will _not_ include the actual root node of the queried subtree.
-    :param node_id: The root node of the subtree for which to build the search.
+    Build an elastic search query that will return all collections below (and including) the COLLECTION_ROOT_ID.
     """
     return (
         CollectionSearch()
-        .collection_filter(collection_id=node_id)
+        .collection_filter(collection_id=uuid.UUID(COLLECTION_ROOT_ID))
         .source(
             [
                 ElasticResourceAttribute.NODE_ID.path,
                 ElasticResourceAttribute.COLLECTION_TITLE.path,
-                ElasticResourceAttribute.COLLECTION_PATH.path,
                 ElasticResourceAttribute.PARENT_ID.path,
+                ElasticResourceAttribute.MODIFIED.path,
             ]
         )
-        .sort(ElasticResourceAttribute.FULLPATH.path)
-        .extra(size=ELASTIC_TOTAL_SIZE, from_=0)
     )
 
 
-def tree(node_id: uuid.UUID) -> Tree:
+class Forest:
     """
-    Build the collection tree for given top level collection_id.
+    All collections below the COLLECTION_ROOT_ID linked into trees, with O(1) access to the subtree of any node.
 
-    All direct and indirect child nodes of given node_id will be queried,
-    and the received list will be transformed in the subtree defined by the input node_id.
+    The levels of the nodes are relative to the top level collections (e.g. Chemie, Deutsch,...), i.e. top level
+    collections have level 0, their children level 1 and so on. The root node has level -1.
 
-    :param node_id: The toplevel collection that defines the subtree
-    :return: The generated tree starting with the root node defined by the node_id argument.
+    Computations work on the array backed `index`, the pydantic trees served by the API are only materialized (once)
+    for the subtrees that are requested.
     """
-    response: Response = tree_search(node_id).execute()
 
-    if not response.success():
-        raise HTTPException(
-            status_code=502,
-            detail="Could not query elastic search to fetch collection tree.",
-        )
+    def __init__(
+        self,
+        index: TreeIndex,
+        links: Optional[dict[uuid.UUID, tuple[uuid.UUID, str]]] = None,
+        found: frozenset[uuid.UUID] = frozenset(),
+        modified: Optional[str] = None,
+    ):
+        """
+        :param links: The parent id and title of every node the forest was linked from (see `build_forest`).
+        :param found: The ids of all collections that were found in elastic.
+        :param modified: The most recent modification date (cm:modified) of all collections that were found.
+        """
+        self.index = index
+        self.links = {} if links is None else links
+        self.found = found
+        self.modified = modified
+        # the materialized trees by position, linked to their parents
+        self._trees: dict[int, Tree] = {}
+        # the trees returned by `subtree` by position, i.e. without parent
+        self._subtrees: dict[int, Tree] = {}
 
-    id_to_name = {id: name for name, id in COLLECTION_NAME_TO_ID.items()}
+    def __len__(self) -> int:
+        return len(self.index)
 
-    # note the "root" here is actually a toplevel collection (e.g. Chemie, Deutsch,...)
-    # i.e. it is the root of the returned subtree.
-    root = Tree(
-        node_id=node_id,
-        level=0,
-        title=id_to_name[str(node_id)],
-        children=[],  # will be filled in below
-        parent_id=None,
-    )
+    @property
+    def root(self) -> Tree:
+        return self._materialize(0)
 
-    def try_node(hit, level) -> Optional[Tree]:
+    @property
+    def version(self) -> str:
         """
-        Some hits from elasticsearch may be incomplete (e.g. missing title).
-        For those hits this function can return None to skip them, or fill in the UUID as title if desired.
+        Identifies the state of the collections in elastic the forest was built from.
+
+        Any modification of a collection raises `modified`, deletions change the number of collections found. The
+        version does not depend on the process, hence all instances of the service agree on it.
         """
+        return f"{self.modified}/{len(self.found)}"
+
+    def position(self, node_id: uuid.UUID) -> int:
+        """The position of the node in the `index`, its subtree are the positions `index.preorder(position)`."""
         try:
-            return Tree(
-                node_id=uuid.UUID(hit["nodeRef"]["id"]),
-                title=hit["properties"]["cm:title"],
-                children=[],  # noqa will be appended upon in recursion below
-                level=level,
-                parent_id=uuid.UUID(hit["parentRef"]["id"]),
+            return self.index.position[node_id]
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Could not find collection with node id {node_id}")
+
+    def subtree(self, node_id: uuid.UUID) -> Tree:
+        """
+        The tree of the given node. Like the trees of top level collections always did, its root has no parent
+        (`parent_id` is None), while the parents of all other nodes are set.
+        """
+        i = self.position(node_id)
+        if (tree := self._subtrees.get(i)) is None:
+            tree = self._materialize(i)
+            # shallow copy, the children are shared with the linked tree
+            tree = self._subtrees[i] = tree if tree.parent_id is None else tree.copy(update={"parent_id": None})
+        return tree
+
+    def _materialize(self, i: int) -> Tree:
+        """
+        Build the pydantic tree of the subtree at position `i`.
+
+        Every node is only materialized once, subtrees that were materialized before are linked in as they are. Hence
+        the trees of a forest are shared.
+        """
+        if (tree := self._trees.get(i)) is not None:
+            return tree
+        index, trees = self.index, self._trees
+        j, end = i, index.end[i]
+        while j < end:
+            if (tree := trees.get(j)) is not None:
+                trees[index.parent[j]].children.append(tree)
+                j = index.end[j]
+                continue
+            # the values of the index are already typed, hence the validation of pydantic can be skipped
+            trees[j] = Tree.construct(
+                node_id=index.ids[j],
+                title=index.titles[j],
+                level=index.level[j],
+                parent_id=None if (p := index.parent[j]) < 0 else index.ids[p],
+                children=[],
             )
+            # appending in pre-order keeps the order of the children
+            if j != i:
+                trees[p].children.append(trees[j])
+            j += 1
+        return trees[i]
+
+
+def build_forest(sources: Iterable[dict], base: Optional[Forest] = None) -> Forest:
+    """
+    Link the collection nodes (the `_source` of the hits of the `forest_search`) into a forest.
+
+    The top level collections of COLLECTION_NAME_TO_ID are always part of the forest and keep their names as title.
+    Children are ordered by node id (see `TreeIndex.from_parents`).
+
+    :param base: If given, the nodes are spliced into this forest instead of building a new one, i.e. nodes that are
+                 already part of it are moved to their new parent and retitled. The base forest is not modified.
+    """
+    root_id = uuid.UUID(COLLECTION_ROOT_ID)
+    top_level = {uuid.UUID(node_id): name for name, node_id in COLLECTION_NAME_TO_ID.items()}
+    if base is None:
+        root_title = "Alle Fachportale"
+        # node id -> (parent id, title)
+        nodes: dict[uuid.UUID, tuple[uuid.UUID, str]] = {
+            node_id: (root_id, name) for node_id, name in top_level.items()
+        }
+        found, modified = set(), None
+    else:
+        root_title = base.index.titles[0]
+        nodes, found, modified = dict(base.links), set(base.found), base.modified
+
+    # every node id also occurs as parent id of its children, parse each of them only once
+    uuids: dict[str, uuid.UUID] = {}
+
+    def parse(value: str) -> uuid.UUID:
+        if (parsed := uuids.get(value)) is None:
+            parsed = uuids[value] = uuid.UUID(value)
+        return parsed
+
+    for hit in sources:
+        # Some hits from elasticsearch may be incomplete (e.g. missing title), those are skipped (with their subtrees)
+        try:
+            node_id = parse(hit["nodeRef"]["id"])
+            # skipped collections are counted as well, as they are part of the total used by `fetch_forest_changes`
+            found.add(node_id)
+            # ISO 8601 dates of the same format compare chronologically as strings
+            if (m := hit.get("properties", {}).get("cm:modified")) is not None and (modified is None or m > modified):
+                modified = m
+            if node_id == root_id:
+                root_title = hit["properties"]["cm:title"]
+            elif node_id not in top_level:  # top level collections keep their configured names
+                nodes[node_id] = (parse(hit["parentRef"]["id"]), hit["properties"]["cm:title"])
         except KeyError as e:
-            node_id = hit["nodeRef"]["id"]
-            logger.warning(f"Collection node {node_id} will be skipped. Missing attribute: {e} ")
+            logger.warning(f"Collection node {hit.get('nodeRef')} will be skipped. Missing attribute: {e}")
+
+    index = TreeIndex.from_parents(
+        root_id=root_id,
+        root_title=root_title,
+        nodes=((node_id, parent_id, title) for node_id, (parent_id, title) in nodes.items()),
+        root_level=-1,
+    )
+    orphans = [node_id for node_id in nodes if node_id not in index.position]
+    if len(orphans) != 0:
+        logger.warning(f"Not all nodes could be arranged in the tree. Left over: {orphans}")
+
+    return Forest(index, links=nodes, found=frozenset(found), modified=modified)
+
+
+async def _fetch_sources(search: CollectionSearch) -> list[dict]:
+    sources = []
+    async for page in iterate_pages(search, page_size=ELASTIC_MAX_PAGE_SIZE, filter_path=["hits.hits._source"]):
+        if not success(page):
+            raise HTTPException(status_code=502, detail="Could not query elastic search to fetch collection tree.")
+        sources.extend(hit["_source"] for hit in hits(page))
+    return sources
+
+
+@single_flight(key=lambda: None)
+async def fetch_forest() -> Forest:
+    """Query all collections below the COLLECTION_ROOT_ID page by page and build the forest."""
+    return build_forest(await _fetch_sources(forest_search()))
+
+
+async def fetch_forest_changes(forest: Forest) -> Optional[Forest]:
+    """
+    Query the collections modified since the given forest was built and splice them into (a copy of) it.
+
+    Moved and retitled collections are handled by the splice. Deleted collections (or collections moved out of the
+    COLLECTION_ROOT_ID) cannot be found by their modification date. Instead, they are detected by comparing the total
+    number of collections in elastic with the number of collections in the forest.
+
+    :return: The updated forest, or None if the forest is not consistent with elastic and has to be rebuilt.
+    """
+    if forest.modified is None:
+        return None
+    # cm:modified is mapped as text, hence compare the keyword, the ISO 8601 UTC timestamps in elastic (and in
+    # forest.modified) share the same format and therefore sort lexicographically in chronological order.
+    # inclusive, as further collections may have been modified within the same millisecond
+    changed = forest_search().filter(Range(**{ElasticResourceAttribute.MODIFIED.keyword: {"gte": forest.modified}}))
+    sources = await _fetch_sources(changed)
+    updated = build_forest(sources, base=forest) if len(sources) != 0 else forest
+
+    response = await (
+        forest_search().extra(size=0, track_total_hits=True).execute_raw(filter_path=["hits.total"], ignore_cache=True)
+    )
+    if not success(response):
+        raise HTTPException(status_code=502, detail="Could not query elastic search to count collections.")
+    total = response["hits"]["total"]["value"]
+    if total != len(updated.found):
+        logger.info(f"Collection forest is out of date ({len(updated.found)} of {total} collections), rebuilding.")
+        return None
+    logger.debug(f"Spliced {len(sources)} modified collections into the collection forest.")
+    return updated
+
+
+async def tree(node_id: uuid.UUID) -> Tree:
+    """
+    Return the collection tree starting at given node.
+
+    Trees are sliced from the collection forest held by the process wide `tree_cache`, only the first call waits for
+    the forest to be built. Note that the returned tree is shared and must not be modified.
+
+    :param node_id: The node that defines the subtree, usually a toplevel collection.
+    :return: The tree starting with the node defined by the node_id argument.
+    """
+    return await tree_cache.get(node_id)
+
+
+def tree_index(collection: Tree) -> tuple[TreeIndex, int]:
+    """
+    The array backed index of the given tree and the position of its root, i.e. its nodes are `index.preorder(i)`.
+
+    Trees returned by `tree` are served directly from the index of the cached forest. Other trees (e.g. of a forest
+    that has been replaced by a refresh in the meantime) are indexed on the fly.
+    """
+    if (located := tree_cache.locate(collection)) is not None:
+        return located
+    return TreeIndex.from_tree(collection), 0
+
+
+class TreeCacheStats(BaseModel):
+    hits: int
+    misses: int
+    refreshes: int
+    updates: int = Field(description="Number of refreshes that only spliced in the modified collections")
+    failed_refreshes: int
+    nodes: int = Field(description="Number of collections in the cached forest")
+    age: Optional[float] = Field(description="Seconds since the forest was built from scratch")
+    build_duration: Optional[float] = Field(description="Seconds it took to build the forest from scratch")
+
+
+class TreeCache:
+    """
+    Process wide cache of the collection forest from which all collection trees are sliced.
+
+    The forest is replaced by `refresh` (periodically called via `tree_cache_refresh_job`), which usually only splices
+    in the collections modified since the previous refresh. A full rebuild runs every TREE_CACHE_REBUILD_INTERVAL
+    seconds as consistency check. While the forest is refreshed, the previous version is served. If the refresh fails,
+    the previous version is kept.
+    """
+
+    def __init__(self):
+        self._forest: Optional[Forest] = None
+        self._built_at: Optional[float] = None
+        self._build_duration: Optional[float] = None
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._updates = 0
+        self._failed_refreshes = 0
+
+    async def get(self, node_id: uuid.UUID) -> Tree:
+        if self._forest is not None:
+            self._hits += 1
+            return self._forest.subtree(node_id)
+        self._misses += 1
+        return (await self._build()).subtree(node_id)
+
+    def locate(self, collection: Tree) -> Optional[tuple[TreeIndex, int]]:
+        """The index of the cached forest and the position of the tree in it, None if it was not sliced from it."""
+        forest = self._forest
+        if forest is None or (i := forest.index.position.get(collection.node_id)) is None:
             return None
+        return (forest.index, i) if forest.subtree(collection.node_id) is collection else None
 
-    # gather all nodes in a set to track if the tree building covers all nodes
-    node_ids = {uuid.UUID(hit["nodeRef"]["id"]) for hit in response.hits}
+    async def refresh(self, rebuild_after: Optional[float] = None):
+        """
+        Update the forest to the current elastic state.
 
-    # gather all (valid) nodes in a dictionary by their parent id.
-    hits_by_parent_id: dict[uuid.UUID, list[dict]] = {}
-    for hit in response.hits:
-        parent_id = uuid.UUID(hit["parentRef"]["id"])
-        if parent_id not in hits_by_parent_id:
-            hits_by_parent_id[parent_id] = []
-        hits_by_parent_id[parent_id].append(hit)
+        :param rebuild_after: If given, only the collections modified since the last refresh are spliced into the
+                              forest, unless it was built from scratch more than `rebuild_after` seconds ago. The
+                              forest is also rebuilt if collections were deleted (see `fetch_forest_changes`).
+        """
+        try:
+            forest = self._forest
+            if rebuild_after is not None and forest is not None and time.monotonic() - self._built_at < rebuild_after:
+                if (updated := await fetch_forest_changes(forest)) is not None:
+                    # a concurrent rebuild wins over the update
+                    if self._forest is forest:
+                        self._forest = updated
+                    self._updates += 1
+                    return
+            await self._build()
+            self._refreshes += 1
+        except Exception as e:
+            self._failed_refreshes += 1
+            logger.warning(f"Failed to refresh collection forest, keeping previous version: {e}")
 
-    # build up tree
-    def recurse(parent: Tree):
-        for hit in hits_by_parent_id.get(parent.node_id, []):
-            if (node := try_node(hit, level=parent.level + 1)) is not None:
-                parent.children.append(node)
-                node_ids.remove(node.node_id)
-                recurse(node)
+    async def _build(self) -> Forest:
+        started = time.monotonic()
+        forest = await fetch_forest()
+        self._forest, self._built_at, self._build_duration = forest, time.monotonic(), time.monotonic() - started
+        return forest
 
-    recurse(root)  # actually initiate the recursion :)
+    def version(self) -> Optional[str]:
+        """The version of the cached forest (see `Forest.version`), None if the forest was not built yet."""
+        return None if self._forest is None else self._forest.version
 
-    if len(node_ids) != 0:
-        logger.warning(f"Not all nodes could be arranged in the tree. Left over: {node_ids}")
+    def clear(self):
+        self._forest = self._built_at = self._build_duration = None
+        self._hits = self._misses = self._refreshes = self._updates = self._failed_refreshes = 0
 
-    return root
+    def stats(self) -> TreeCacheStats:
+        return TreeCacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            refreshes=self._refreshes,
+            updates=self._updates,
+            failed_refreshes=self._failed_refreshes,
+            nodes=0 if self._forest is None else len(self._forest),
+            age=None if self._built_at is None else time.monotonic() - self._built_at,
+            build_duration=self._build_duration,
+        )
+
+
+tree_cache = TreeCache()
+
+
+@repeat_every(seconds=TREE_CACHE_REFRESH_INTERVAL, wait_first=True, logger=logger)
+async def tree_cache_refresh_job():
+    logger.info("Refreshing collection tree cache")
+    await tree_cache.refresh(rebuild_after=TREE_CACHE_REBUILD_INTERVAL)
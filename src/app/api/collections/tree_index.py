@@ -0,0 +1,120 @@
+from __future__ import (  # Needed for recursive type annotation, can be dropped with Python>3.10
+    annotations,
+)
+
+import uuid
+from array import array
+from typing import TYPE_CHECKING, Iterable, Iterator, Sequence
+
+if TYPE_CHECKING:
+    from app.api.collections.tree import Tree
+
+
+class TreeIndex:
+    """
+    Compact representation of a collection tree backed by flat arrays.
+
+    The nodes are interned to ints (positions) in depth-first pre-order, hence the positions double as the enter times
+    of an Euler tour: The subtree of the node at position `i` consists of exactly the positions `i <= j < end[i]`.
+    Subtree membership and ancestor checks are therefore O(1), and the rows of a subtree are a contiguous slice of
+    per-node arrays. The pydantic `Tree` is only produced at the API boundary (see `Forest.subtree`).
+
+    Arrays (indexed by position, -1 denotes "none"):
+      - parent: The position of the parent node.
+      - level: The level of the node (as given for the root node, increasing by one per generation).
+      - first_child/next_sibling: The children of a node in order.
+      - end: The position after the last node of the subtree (the exit time of the Euler tour).
+    """
+
+    def __init__(self, ids: list[uuid.UUID], titles: list[str], parent: Sequence[int], level: Sequence[int]):
+        """
+        :param ids: The node ids in depth-first pre-order, starting with the root node.
+        :param titles: The titles of the nodes.
+        :param parent: The position of the parent of each node (-1 for the root node).
+        :param level: The level of each node.
+        """
+        n = len(ids)
+        self.ids = ids
+        self.titles = titles
+        self.position: dict[uuid.UUID, int] = {node_id: i for i, node_id in enumerate(ids)}
+        self.parent = array("i", parent)
+        self.level = array("i", level)
+        self.first_child = array("i", [-1]) * n
+        self.next_sibling = array("i", [-1]) * n
+        self.end = array("i", range(1, n + 1))
+
+        # a reverse pass over the pre-order visits every node after all of its descendants and its later siblings
+        for i in range(n - 1, 0, -1):
+            p = self.parent[i]
+            self.next_sibling[i] = self.first_child[p]
+            self.first_child[p] = i
+            if self.end[i] > self.end[p]:
+                self.end[p] = self.end[i]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_parents(
+        cls,
+        root_id: uuid.UUID,
+        root_title: str,
+        nodes: Iterable[tuple[uuid.UUID, uuid.UUID, str]],
+        root_level: int = 0,
+    ) -> TreeIndex:
+        """
+        Link nodes given by their parent into an index.
+
+        Children are ordered by their node id, which is the order of the former `fullpath` sort of the collections: the
+        full path of a collection is the path of node ids leading to it.
+
+        Nodes that are not connected to the root are not part of the index.
+
+        :param nodes: Tuples of node id, parent id and title.
+        """
+        children: dict[uuid.UUID, list[tuple[str, uuid.UUID, str]]] = {}
+        for node_id, parent_id, title in nodes:
+            children.setdefault(parent_id, []).append((str(node_id), node_id, title))
+
+        ids, titles, parent, level = [], [], [], []
+        stack = [(root_id, root_title, -1, root_level)]
+        while stack:
+            node_id, title, p, lvl = stack.pop()
+            i = len(ids)
+            ids.append(node_id)
+            titles.append(title)
+            parent.append(p)
+            level.append(lvl)
+            # push in reverse, such that the first child is visited next
+            for _, child_id, child_title in sorted(children.get(node_id, []), reverse=True):
+                stack.append((child_id, child_title, i, lvl + 1))
+        return cls(ids=ids, titles=titles, parent=parent, level=level)
+
+    @classmethod
+    def from_tree(cls, tree: Tree) -> TreeIndex:
+        """Build the index of a `Tree` keeping the order of its children."""
+        ids, titles, parent, level = [], [], [], []
+        stack: list[tuple[Tree, int]] = [(tree, -1)]
+        while stack:
+            node, p = stack.pop()
+            i = len(ids)
+            ids.append(node.node_id)
+            titles.append(node.title)
+            parent.append(p)
+            level.append(node.level)
+            stack.extend((child, i) for child in reversed(node.children))
+        return cls(ids=ids, titles=titles, parent=parent, level=level)
+
+    def preorder(self, i: int = 0) -> range:
+        """The positions of the subtree of node `i` in depth-first pre-order."""
+        return range(i, self.end[i])
+
+    def children(self, i: int) -> Iterator[int]:
+        child = self.first_child[i]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def is_ancestor(self, i: int, j: int) -> bool:
+        """Whether node `i` is an ancestor of node `j` (or `j` itself)."""
+        return i <= j < self.end[i]
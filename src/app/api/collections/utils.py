@@ -6,17 +6,25 @@ import uuid
 from fastapi import HTTPException
 
 from elasticsearch_dsl import A
+from elasticsearch_dsl.response import Response
 
 from app.core.config import ELASTIC_TOTAL_SIZE
 from app.core.constants import OER_LICENSES
 from app.elastic.attributes import ElasticResourceAttribute
 from app.elastic.search import MaterialSearch
+from app.elastic.template import search_template
 
 
-def oer_ratio(collection_id: uuid.UUID) -> int:
+async def oer_ratio(collection_id: uuid.UUID) -> int:
     """
     Query the percentage of OER materials of given collection from elasticsearch.
     """
+    return build_oer_ratio(await oer_ratio_search(collection_id=collection_id).execute())
+
+
+@search_template()
+def oer_ratio_search(collection_id: uuid.UUID) -> MaterialSearch:
+    """Build the search for the license distribution of the materials of given collection."""
     # Note:
     # It is important to not group by collection here, as materials can be in multiple collections
     # and hence some materials would be counted multiple times into OER vs Non-OER if we would first
@@ -34,7 +42,11 @@ def oer_ratio(collection_id: uuid.UUID) -> int:
         A("terms", field=ElasticResourceAttribute.LICENSES.keyword, size=ELASTIC_TOTAL_SIZE, missing="N/A"),
     )
 
-    response = search.execute()
+    return search
+
+
+def build_oer_ratio(response: Response) -> int:
+    """Compute the percentage of OER materials from the result of the `oer_ratio_search`."""
     if not response.success():
         raise HTTPException(status_code=502, detail="Failed to query elasticsearch")
 
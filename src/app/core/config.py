@@ -16,21 +16,49 @@ LOG_LEVEL = int(os.getenv("LOG_LEVEL", logging.INFO))
 
 ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL")
 
+# Size of the connection pool to elasticsearch (per host), MIN_CONNECTIONS_COUNT connections are opened at startup
 MAX_CONNECTIONS_COUNT = int(os.getenv("MAX_CONNECTIONS_COUNT", 10))
 MIN_CONNECTIONS_COUNT = int(os.getenv("MIN_CONNECTIONS_COUNT", 10))
 
 ELASTIC_INDEX = "workspace"
 ELASTIC_TOTAL_SIZE = 500_000  # Maximum number of entries elasticsearch queries, very large to query all entries
+# Memory budget (in bytes) of the search response cache and the time in seconds a response is reused.
+ELASTIC_CACHE_MAX_BYTES = int(os.getenv("ELASTIC_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+ELASTIC_CACHE_TTL_COLLECTIONS = int(os.getenv("ELASTIC_CACHE_TTL_COLLECTIONS", 15 * 60))
+ELASTIC_CACHE_TTL_MATERIALS = int(os.getenv("ELASTIC_CACHE_TTL_MATERIALS", 5 * 60))
+# Default and maximum number of hits per page of paginated endpoints, and how long a point in time is kept open
+# between the requests of consecutive pages
+ELASTIC_PAGE_SIZE = int(os.getenv("ELASTIC_PAGE_SIZE", 1_000))
+ELASTIC_MAX_PAGE_SIZE = 10_000
+ELASTIC_PIT_KEEP_ALIVE = os.getenv("ELASTIC_PIT_KEEP_ALIVE", "1m")
 ELASTICSEARCH_TIMEOUT = int(os.getenv("ELASTICSEARCH_TIMEOUT", 20))
+# Seconds an idle connection to elasticsearch is kept open for reuse
+ELASTICSEARCH_KEEPALIVE_TIMEOUT = int(os.getenv("ELASTICSEARCH_KEEPALIVE_TIMEOUT", 60))
+ELASTICSEARCH_HTTP_COMPRESS = os.getenv("ELASTICSEARCH_HTTP_COMPRESS", "False").strip().lower() == "true"
+# Allow to profile the elasticsearch searches of a request via `X-Profile: true` header or `profile=true` parameter
+ELASTIC_PROFILING = os.getenv("ELASTIC_PROFILING", str(API_DEBUG)).strip().lower() == "true"
+# Maximum number of searches a single request may have in flight concurrently
+ELASTICSEARCH_MAX_CONCURRENT_SEARCHES = int(os.getenv("ELASTICSEARCH_MAX_CONCURRENT_SEARCHES", 4))
 
 
 BACKGROUND_TASK_TIME_INTERVAL = int(os.getenv("BACKGROUND_TASK_TIME_INTERVAL", 10 * 60))
+# Seconds between the background refreshes of the cached collection trees. A refresh only fetches the collections
+# modified since the previous one, the trees are rebuilt from scratch at most every TREE_CACHE_REBUILD_INTERVAL seconds
+TREE_CACHE_REFRESH_INTERVAL = int(os.getenv("TREE_CACHE_REFRESH_INTERVAL", 10 * 60))
+TREE_CACHE_REBUILD_INTERVAL = int(os.getenv("TREE_CACHE_REBUILD_INTERVAL", 6 * 60 * 60))
+# Seconds between the background recomputations of the quality matrices of the top level collections
+QUALITY_MATRIX_REFRESH_INTERVAL = int(os.getenv("QUALITY_MATRIX_REFRESH_INTERVAL", 15 * 60))
+# Split the aggregations of quality matrices into concurrent searches of at most this many columns (0 disables it)
+QUALITY_MATRIX_COLUMN_SHARD_SIZE = int(os.getenv("QUALITY_MATRIX_COLUMN_SHARD_SIZE", 0))
 # Cron like schedule when quality matrix should be stored. Default to every 6 hours
 # see https://crontab.guru/#0_0,6,12,18_*_*_*
 QUALITY_MATRIX_BACKUP_SCHEDULE = os.getenv(
     "QUALITY_MATRIX_BACKUP_SCHEDULE", "0 0,6,12,18 * * *"
 )
 
+# Maximum number of quality matrices computed concurrently for a backup
+QUALITY_MATRIX_BACKUP_CONCURRENCY = int(os.getenv("QUALITY_MATRIX_BACKUP_CONCURRENCY", 4))
+
 # The Database URL to use for storing historic quality matrix information
 DATABASE_URL = os.getenv("DATABASE_URL", None)
 
@@ -0,0 +1,61 @@
+"""
+Coalescing of concurrent identical computations ("single flight").
+"""
+
+import asyncio
+import functools
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+def single_flight(key: Callable[..., Hashable]):
+    """
+    Decorate a coroutine function such that concurrent calls with the same key share a single computation.
+
+    The first caller (the leader) starts the computation, every caller that arrives while it is still running (a
+    follower) awaits the result of the leader instead of starting its own computation. Results and exceptions are
+    passed on to all callers alike. Once the computation finished, the next call starts a new one, i.e. results are
+    not cached.
+
+    Cancelling a caller does not affect the other callers of the same computation. The computation itself is only
+    cancelled, if all of its callers were cancelled.
+
+    :param key: Computes the key from the arguments of the decorated function. Calls with equal keys are coalesced.
+    """
+
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        in_flight: dict[Hashable, _Flight] = {}
+
+        def done(k: Hashable, flight: _Flight):
+            if in_flight.get(k) is flight:
+                del in_flight[k]
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs) -> T:
+            k = key(*args, **kwargs)
+            flight = in_flight.get(k)
+            if flight is None:
+                flight = in_flight[k] = _Flight(asyncio.ensure_future(fn(*args, **kwargs)))
+                flight.task.add_done_callback(lambda _: done(k, flight))
+
+            flight.waiters += 1
+            try:
+                # shield the computation, so cancelling this caller does not cancel the computation of the others
+                return await asyncio.shield(flight.task)
+            finally:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.task.done():
+                    # nobody is interested in the result anymore
+                    done(k, flight)
+                    flight.task.cancel()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,120 @@
+"""
+A process wide cache for the (raw) responses of elasticsearch searches.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.config import ELASTIC_CACHE_MAX_BYTES
+
+# number of hits whose serialization is measured to extrapolate the size of a response with many hits
+_HIT_SAMPLE_SIZE = 32
+
+
+@dataclass
+class _Entry:
+    response: dict
+    size: int
+    expires_at: float
+
+
+class SearchCacheStats(BaseModel):
+    hits: int = Field(description="Number of searches answered from the cache")
+    misses: int = Field(description="Number of searches that had to be sent to elasticsearch")
+    evictions: int = Field(description="Number of entries removed to stay within the memory budget")
+    entries: int = Field(description="Number of currently cached responses")
+    size: int = Field(description="Approximate size of the cached responses in bytes")
+    max_size: int = Field(description="Memory budget of the cache in bytes")
+
+
+class SearchCache:
+    """
+    An approximately size bounded LRU cache of search responses with a time-to-live per entry.
+
+    The entries are content addressed, i.e. two searches share an entry if they target the same index with the same
+    request body and parameters. The size of an entry is approximated by the length of its JSON serialization, which is
+    extrapolated from a sample for responses with many hits (see `estimate_size`). It is not the size on the heap.
+
+    Cached responses are returned by reference (copying them would cost as much as the requests they save), i.e. all
+    responses returned by `get` are shared and must be treated as read-only.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(index: Any, body: dict, params: dict) -> str:
+        canonical = json.dumps({"index": index, "body": body, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @staticmethod
+    def estimate_size(response: dict) -> int:
+        """
+        The approximate length of the JSON serialization of the response.
+
+        Only the first `_HIT_SAMPLE_SIZE` hits are serialized, the size of the remaining ones is extrapolated from them,
+        such that sizing a response with hundreds of thousands of hits does not cost a full serialization.
+        """
+        hits = response.get("hits")
+        if not isinstance(hits, dict) or len(hits.get("hits", ())) <= _HIT_SAMPLE_SIZE:
+            return len(json.dumps(response))
+        count = len(hits["hits"])
+        sample = len(json.dumps(hits["hits"][:_HIT_SAMPLE_SIZE]))
+        return len(json.dumps({**response, "hits": {**hits, "hits": []}})) + sample * count // _HIT_SAMPLE_SIZE
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.response
+
+    def put(self, key: str, response: dict, ttl: float):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        size = self.estimate_size(response)
+        if size > self.max_size:
+            return
+        if key in self._entries:
+            self._remove(key)
+        while self._size + size > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[key] = _Entry(response=response, size=size, expires_at=time.monotonic() + ttl)
+        self._size += size
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> SearchCacheStats:
+        return SearchCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            size=self._size,
+            max_size=self.max_size,
+        )
+
+    def _remove(self, key: str):
+        self._size -= self._entries.pop(key).size
+
+
+search_cache = SearchCache(max_size=ELASTIC_CACHE_MAX_BYTES)
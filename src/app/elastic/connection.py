@@ -0,0 +1,67 @@
+"""
+Connection handling for the `AsyncElasticsearch` client.
+"""
+
+from typing import Optional
+
+import aiohttp
+from elasticsearch import AsyncElasticsearch
+from elasticsearch._async.http_aiohttp import AIOHttpConnection, ESClientResponse
+from pydantic import BaseModel, Field
+
+from app.core.config import ELASTICSEARCH_KEEPALIVE_TIMEOUT
+
+
+class PooledConnection(AIOHttpConnection):
+    """
+    An `AIOHttpConnection` that keeps up to `MAX_CONNECTIONS_COUNT` keep-alive connections per elasticsearch host.
+
+    The default connection only honours `maxsize` as the overall limit of the pool and closes idle connections
+    after aiohttp's default of 15 seconds, which leads to frequent TCP/TLS handshakes when the service is polled
+    in bursts.
+
+    elasticsearch-py offers no public way to pass a connector, hence this overrides the private
+    `_create_aiohttp_session` and reads the private `_limit` and `_ssl_context` of the 7.17 `AIOHttpConnection`.
+    The dependency is pinned to 7.17.x in pyproject.toml accordingly, re-check this class when upgrading it.
+    """
+
+    async def _create_aiohttp_session(self):
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            skip_auto_headers=("accept", "accept-encoding", "user-agent"),
+            auto_decompress=True,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            response_class=ESClientResponse,
+            connector=aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit,
+                keepalive_timeout=ELASTICSEARCH_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                enable_cleanup_closed=True,
+                ssl=self._ssl_context,
+            ),
+        )
+
+
+class ConnectionPoolStats(BaseModel):
+    host: str
+    max_connections: int = Field(description="Maximum number of connections to the host")
+    in_use: int = Field(description="Number of connections currently used by a request")
+    idle: int = Field(description="Number of open keep-alive connections ready for the next request")
+
+
+def connection_pool_stats(es: AsyncElasticsearch) -> list[ConnectionPoolStats]:
+    """Report the utilisation of the connection pool(s) of the given client, one entry per elasticsearch host."""
+
+    def stats(connection: AIOHttpConnection) -> ConnectionPoolStats:
+        session: Optional[aiohttp.ClientSession] = connection.session
+        # the session (and with it the connector) is created lazily upon the first request
+        connector = session.connector if session is not None and not session.closed else None
+        return ConnectionPoolStats(
+            host=connection.host,
+            max_connections=connection._limit,
+            in_use=len(getattr(connector, "_acquired", ())),
+            idle=sum(len(idle) for idle in getattr(connector, "_conns", {}).values()),
+        )
+
+    return [stats(connection) for connection in es.transport.connection_pool.connections]
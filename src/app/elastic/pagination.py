@@ -0,0 +1,126 @@
+"""
+Cursor based pagination of elasticsearch searches via point in time (PIT) and `search_after`.
+
+See https://www.elastic.co/guide/en/elasticsearch/reference/7.17/paginate-search-results.html#search-after
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, AsyncIterator, Optional
+
+from elasticsearch import NotFoundError
+from elasticsearch_dsl.connections import get_connection
+from fastapi import HTTPException
+
+from app.core.config import ELASTIC_PAGE_SIZE, ELASTIC_PIT_KEEP_ALIVE
+from app.elastic.attributes import ElasticResourceAttribute
+from app.elastic.cache import search_cache
+from app.elastic.profile import active_profile
+from app.elastic.search import _Search, _success_paths, hits
+
+# The sort order has to be total for search_after to neither skip nor repeat hits between pages. The node id is unique
+# per document, further elasticsearch adds the implicit `_shard_doc` tiebreaker for searches on a point in time.
+_sort = [{ElasticResourceAttribute.NODE_ID.keyword: "asc"}]
+
+
+def _query_id(search: _Search) -> str:
+    """Identifies the query of a search independent of the page, such that cursors cannot be mixed between queries."""
+    return search_cache.key(search._index, search.to_dict(), search._params)[:16]
+
+
+def encode_cursor(search: _Search, pit_id: str, search_after: list[Any]) -> str:
+    data = {"query": _query_id(search), "pit": pit_id, "after": search_after}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(search: _Search, cursor: str) -> tuple[str, list[Any]]:
+    """Return the point in time id and the sort values of the last hit of the previous page."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        pit_id, search_after, query_id = data["pit"], data["after"], data["query"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if query_id != _query_id(search):
+        raise HTTPException(status_code=400, detail="Cursor does not belong to this query.")
+    return pit_id, search_after
+
+
+async def search_page(
+    search: _Search,
+    limit: int,
+    cursor: Optional[str] = None,
+    filter_path: Optional[list[str]] = None,
+    using: str = "default",
+) -> tuple[dict, Optional[str]]:
+    """
+    Execute the search for a single page of at most `limit` hits and return the plain response body (see
+    `_Search.execute_raw`).
+
+    The first page (no cursor) opens a point in time, such that all pages see the same consistent snapshot of the
+    index, the following pages continue after the last hit of the previous page. Any `size`, `from` or `sort` of the
+    given search is replaced.
+
+    Responses of pages are not cached, as they are bound to the point in time.
+
+    :param filter_path: Only return these parts of the response (see `_Search.execute_raw`).
+    :returns: The response of the page and the cursor of the next page. The cursor is None for the last page.
+    """
+    es = get_connection(using)
+    if cursor is None:
+        pit = await es.open_point_in_time(index=search._index, keep_alive=ELASTIC_PIT_KEEP_ALIVE)
+        pit_id, search_after = pit["id"], None
+    else:
+        pit_id, search_after = decode_cursor(search, cursor)
+
+    body = {
+        **search.to_dict(),
+        "size": limit,
+        "sort": _sort,
+        "pit": {"id": pit_id, "keep_alive": ELASTIC_PIT_KEEP_ALIVE},
+    }
+    body.pop("from", None)
+    if search_after is not None:
+        body["search_after"] = search_after
+    if (profile := active_profile()) is not None:
+        body["profile"] = True
+
+    params = dict(search._params)
+    if filter_path is not None:
+        params["filter_path"] = ",".join([*_success_paths, "pit_id", "hits.hits.sort", *filter_path])
+
+    try:
+        # the index is defined by the point in time and must not be part of the request
+        response = await es.search(body=body, **params)
+    except NotFoundError:
+        raise HTTPException(status_code=410, detail="Cursor expired, please restart from the first page.")
+
+    if profile is not None:
+        profile.record(search._index, response)
+
+    # the point in time id may change between requests, always continue with the most recent one
+    pit_id = response.get("pit_id", pit_id)
+    page = hits(response)
+    if len(page) < limit:
+        await es.close_point_in_time(body={"id": pit_id})
+        next_cursor = None
+    else:
+        next_cursor = encode_cursor(search, pit_id, page[-1]["sort"])
+
+    return response, next_cursor
+
+
+async def iterate_pages(
+    search: _Search, page_size: int = ELASTIC_PAGE_SIZE, filter_path: Optional[list[str]] = None
+) -> AsyncIterator[dict]:
+    """
+    Iterate over all hits of the search page by page, such that only a single page has to be kept in memory.
+
+    If the iteration is not exhausted, the point in time is left open until it expires after ELASTIC_PIT_KEEP_ALIVE.
+    """
+    cursor = None
+    while True:
+        page, cursor = await search_page(search, limit=page_size, cursor=cursor, filter_path=filter_path)
+        yield page
+        if cursor is None:
+            return
@@ -0,0 +1,99 @@
+"""
+Opt-in profiling of the elasticsearch searches of a request (debugging only).
+
+If ELASTIC_PROFILING is enabled (default in debug mode), a request with the `X-Profile: true` header or the
+`profile=true` query parameter will run all its searches with `"profile": true`. The timing breakdown per query and
+aggregation reported by elasticsearch is written to the `meta.profile` log, and the response carries a
+`Server-Timing` header with the time spent in elasticsearch versus the total time of the request. The response body
+is not changed.
+
+Profiled searches bypass the search cache. Note that a profiled request that joins an identical computation already
+in flight (see `app.core.single_flight`) will not run any searches of its own.
+
+See https://www.elastic.co/guide/en/elasticsearch/reference/7.17/search-profile.html
+"""
+
+import logging
+import time
+from collections import defaultdict
+from typing import Optional, Union
+
+from starlette.requests import HTTPConnection, Request
+from starlette.responses import Response
+from starlette.types import Message
+from starlette_context import context
+from starlette_context.plugins import Plugin
+
+from app.core.config import ELASTIC_PROFILING
+
+profile_logger = logging.getLogger("meta.profile")
+
+# the (truncated) descriptions of queries can be huge, e.g. for the collection filters.
+_MAX_DESCRIPTION_LENGTH = 100
+
+
+class RequestProfile:
+    """Collects the profiles of all searches issued while handling a single request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.searches: list[tuple[str, float]] = []
+
+    def record(self, index, response: dict):
+        """Log the timing breakdown of a search response that was requested with `"profile": true`."""
+        index = ",".join(index) if isinstance(index, list) else str(index)
+        took = response.get("took", 0)
+        self.searches.append((index, took))
+        lines = [
+            f"{'  ' * (len(path) - 1)}{kind}: {path[-1]} {ms:.1f}ms"
+            for (kind, path), ms in summarize(response.get("profile", {})).items()
+        ]
+        profile_logger.info("\n".join([f"Profile of search on {index} (took {took}ms):", *lines]))
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        searches = [f'es;desc="{index} #{i}";dur={took}' for i, (index, took) in enumerate(self.searches)]
+        return ", ".join([*searches, f"total;dur={total:.1f}"])
+
+
+def summarize(profile: dict) -> dict[tuple[str, tuple[str, ...]], float]:
+    """
+    Sum up the times of all queries and aggregations of a search profile over all shards.
+
+    :return: The time in milliseconds keyed by the kind ("query", "aggregation") and the path of the node in the
+             query/aggregation tree. Child nodes follow their parent.
+    """
+    timings: dict[tuple[str, tuple[str, ...]], float] = defaultdict(float)
+
+    def visit(kind: str, nodes: list[dict], parent: tuple[str, ...]):
+        for node in nodes:
+            path = (*parent, f"{node['type']} [{node['description'][:_MAX_DESCRIPTION_LENGTH]}]")
+            timings[(kind, path)] += node["time_in_nanos"] / 1e6
+            visit(kind, node.get("children", []), path)
+
+    for shard in profile.get("shards", []):
+        for search in shard.get("searches", []):
+            visit("query", search.get("query", []), ())
+        visit("aggregation", shard.get("aggregations", []), ())
+    return timings
+
+
+def active_profile() -> Optional[RequestProfile]:
+    """Return the profile of the current request, or None if the searches should not be profiled."""
+    return context.get(ProfilePlugin.key) if context.exists() else None
+
+
+class ProfilePlugin(Plugin):
+    """Enables profiling for the request if requested via header or query parameter, see module docstring."""
+
+    key = "X-Profile"
+
+    async def process_request(self, request: Union[Request, HTTPConnection]) -> Optional[RequestProfile]:
+        if not ELASTIC_PROFILING:
+            return None
+        flag = request.headers.get(self.key) or request.query_params.get("profile") or ""
+        return RequestProfile() if flag.strip().lower() == "true" else None
+
+    async def enrich_response(self, arg: Union[Response, Message]) -> None:
+        if isinstance(arg, dict) and arg["type"] == "http.response.start" and (profile := active_profile()):
+            arg["headers"] = [*arg.get("headers", []), (b"server-timing", profile.server_timing().encode())]
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+from typing import Optional
 from uuid import UUID
 
 import elasticsearch_dsl
+from elasticsearch_dsl.connections import get_connection
 from elasticsearch_dsl.query import Q, Term, Bool, Terms, Match, Query, Wildcard
+from elasticsearch_dsl.response import Response
 
-from app.core.config import ELASTIC_INDEX
+from app.core.config import ELASTIC_CACHE_TTL_COLLECTIONS, ELASTIC_CACHE_TTL_MATERIALS, ELASTIC_INDEX
 from app.core.constants import OER_LICENSES
+from app.core.logging import logger
 from app.elastic.attributes import ElasticResourceAttribute
+from app.elastic.cache import search_cache
+from app.elastic.profile import active_profile
 
 
 _base_filters = [
@@ -18,6 +24,83 @@ _base_filters = [
 
 
 class _Search(elasticsearch_dsl.Search):
+    # Number of seconds the response of this kind of search is reused from the search_cache (0 disables caching).
+    cache_ttl: int = 0
+    # The request body of searches instantiated from a template (see `app.elastic.template`), replaces `to_dict`.
+    _body: Optional[dict] = None
+
+    def _clone(self):
+        if self._body is not None:
+            raise RuntimeError("Searches instantiated from a template cannot be modified, change the template instead.")
+        s = super()._clone()
+        s.cache_ttl = self.cache_ttl
+        return s
+
+    def to_dict(self, count=False, **kwargs) -> dict:
+        if self._body is not None and not count and len(kwargs) == 0:
+            return self._body
+        return super().to_dict(count=count, **kwargs)
+
+    def cache(self, ttl: int) -> _Search:
+        """Return a new search whose response will be reused from the search cache for `ttl` seconds."""
+        s = self._clone()
+        s.cache_ttl = ttl
+        return s
+
+    async def execute(self, ignore_cache=False) -> Response:
+        """
+        Execute the search via the registered `AsyncElasticsearch` client and return an instance of `Response`
+        wrapping all the data.
+
+        This shadows the synchronous `elasticsearch_dsl.Search.execute`, hence every call has to be awaited. The
+        event loop is free to serve other requests while waiting for elasticsearch.
+
+        Responses are shared via the process wide `search_cache` for `cache_ttl` seconds between all searches with an
+        identical request body, hence the response must not be modified.
+
+        :param ignore_cache: If set to `True`, the search will hit elasticsearch, while responses cached on this search
+                             instance or in the search cache will be ignored.
+        """
+        if ignore_cache or not hasattr(self, "_response"):
+            self._response = self._response_class(self, await self._search(ignore_cache=ignore_cache))
+        return self._response
+
+    async def execute_raw(self, filter_path: Optional[list[str]] = None, ignore_cache=False) -> dict:
+        """
+        Execute the search and return the plain response body as received from elasticsearch.
+
+        Other than `execute` this does not wrap the response and every hit into `AttrDict` instances, which is
+        considerably faster for searches with many hits. Use `hits(response)` to access the hits and
+        `success(response)` to check whether the search succeeded. The response may be shared via the `search_cache`
+        (see `execute`) and must not be modified.
+
+        :param filter_path: Only return these parts of the response, e.g. `["hits.hits._source"]`. The information
+                            needed by `success` is always included. See
+            https://www.elastic.co/guide/en/elasticsearch/reference/7.17/common-options.html#common-options-response-filtering
+        :param ignore_cache: If set to `True`, the search will hit elasticsearch and ignore the search cache.
+        """
+        if filter_path is None:
+            return await self._search(ignore_cache=ignore_cache)
+        return await self._search(ignore_cache=ignore_cache, filter_path=",".join([*_success_paths, *filter_path]))
+
+    async def _search(self, ignore_cache: bool, **params) -> dict:
+        body = self.to_dict()
+        params = {**self._params, **params}
+        if (profile := active_profile()) is not None:
+            # cached responses carry no profile
+            es = get_connection(self._using)
+            response = await es.search(index=self._index, body={**body, "profile": True}, **params)
+            profile.record(self._index, response)
+            return response
+
+        key = search_cache.key(self._index, body, params)
+        response = None if ignore_cache or self.cache_ttl <= 0 else search_cache.get(key)
+        if response is None:
+            es = get_connection(self._using)
+            response = await es.search(index=self._index, body=body, **params)
+            search_cache.put(key, response, ttl=self.cache_ttl)
+        return response
+
     def missing_attribute_filter(self, **attributes: ElasticResourceAttribute) -> MaterialSearch:
         """
         Only return documents where at least one of the provided attributes is missing, empty or "invalid".
@@ -36,7 +119,7 @@ class _Search(elasticsearch_dsl.Search):
         Example for checking the names queries:
 
         ```python
-        hits = search.missing_attribute_filter(licence=ElasticResourceAttribute.LICENSE).execute().hits
+        hits = (await search.missing_attribute_filter(licence=ElasticResourceAttribute.LICENSE).execute()).hits
         for hit in hits:
             for matched_query in hit.meta.matched_queries:
                 print(matched_query) # a string with the name of the matched query ("licence" in this case)
@@ -78,7 +161,81 @@ class _Search(elasticsearch_dsl.Search):
         )
 
 
+async def execute_many(*searches: _Search, using: str = "default") -> list[Response]:
+    """
+    Execute the given searches within a single `_msearch` request and return one `Response` per search (in the same
+    order as the searches were passed in).
+
+    This saves the per request overhead (connection, TLS, coordinating node) for endpoints that issue several
+    independent queries. Failures are reported per search: If elasticsearch could not run one of the searches, the
+    respective response will yield `response.success() == False` - exactly as for a failed `search.execute()` - and
+    carry the error reported by elasticsearch in `response.error`.
+    """
+    profile = active_profile()
+    bodies = [search.to_dict() for search in searches]
+    keys = [search_cache.key(search._index, body, search._params) for search, body in zip(searches, bodies)]
+    responses = [
+        search_cache.get(key) if search.cache_ttl > 0 and profile is None else None
+        for search, key in zip(searches, keys)
+    ]
+
+    # only send the searches that could not be answered from the cache
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if len(pending) > 0:
+        body = []
+        for i in pending:
+            body.append({"index": searches[i]._index, **searches[i]._params})
+            body.append(bodies[i] if profile is None else {**bodies[i], "profile": True})
+
+        es = get_connection(using)
+        raw = await es.msearch(body=body)
+
+        for i, response in zip(pending, raw["responses"]):
+            if "error" in response:
+                logger.warning(f"Search of multi search request failed: {response['error']}")
+                response = _failed_response(response["error"])
+            elif profile is not None:
+                profile.record(searches[i]._index, response)
+            else:
+                search_cache.put(keys[i], response, ttl=searches[i].cache_ttl)
+            responses[i] = response
+
+    for search, response in zip(searches, responses):
+        search._response = search._response_class(search, response)
+    return [search._response for search in searches]
+
+
+# parts of the response body that are needed to determine whether a search was successful
+_success_paths = ["_shards", "timed_out"]
+
+
+def success(response: dict) -> bool:
+    """The equivalent of `Response.success()` for plain responses as returned by `_Search.execute_raw`."""
+    return response["_shards"]["total"] == response["_shards"]["successful"] and not response["timed_out"]
+
+
+def hits(response: dict) -> list[dict]:
+    """
+    Return the hits of a plain response as returned by `_Search.execute_raw`.
+
+    Elasticsearch drops empty objects from filtered responses, i.e. if nothing was found, there are no hits at all.
+    """
+    return response.get("hits", {}).get("hits", [])
+
+
+def _failed_response(error: dict) -> dict:
+    """Build a response body for a failed search of a multi search request where `response.success()` is False."""
+    return {
+        "error": error,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 0, "skipped": 0, "failed": 1},
+        "hits": {"total": {"value": 0, "relation": "eq"}, "max_score": None, "hits": []},
+    }
+
+
 class CollectionSearch(_Search):
+    cache_ttl = ELASTIC_CACHE_TTL_COLLECTIONS
+
     def __init__(self, index=ELASTIC_INDEX, **kwargs):
         super().__init__(index=index, **kwargs)
         self.query = Bool(
@@ -101,6 +258,8 @@ class CollectionSearch(_Search):
 
 
 class MaterialSearch(_Search):
+    cache_ttl = ELASTIC_CACHE_TTL_MATERIALS
+
     def __init__(self, index=ELASTIC_INDEX, **kwargs):
         super().__init__(index=index, **kwargs)
         self.query = Bool(
@@ -122,21 +281,7 @@ class MaterialSearch(_Search):
         :param transitive: Whether to include materials that are not directly in given collection, but in any of the
                            collection-nodes of the subtree defined by the collection.
         """
-        collection_id = str(collection_id)
-        # fixme: See https://issues.edu-sharing.net/jira/browse/KBMBF-577
-        #        We would need some nested filters here to make sure that:
-        #          - the material is not only (transitively) within the respective collection
-        #          - but also, that the collection via which it (transitively) belongs to the base collection
-        #            complies with all the base filters.
-        #          - further, the relation of the collection and the material must not be something like "proposed for"
-        #            but the material must really be within that collection.
-        #            See https://github.com/openeduhub/metaqs-main/issues/100
-        exact_collection = Term(**{ElasticResourceAttribute.COLLECTION_NODEREF_ID.keyword: collection_id})
-        if transitive:
-            collection_subtree = Match(**{ElasticResourceAttribute.COLLECTION_PATH.keyword: collection_id})
-            return self.filter(exact_collection | collection_subtree)
-        else:
-            return self.filter(exact_collection)
+        return self.filter(material_collection_query(collection_id, transitive=transitive))
 
     # def source(self, *attributes: ElasticResourceAttribute) -> MaterialSearch:
     #     """Only return the specified attributes for the matched search results."""
@@ -150,3 +295,24 @@ class MaterialSearch(_Search):
     #     # for attr in attributes:
     #     #     assert attr in material_attributes, f"{attr} is non a valid material attribute"
     #     return super().source(fields=[attr.path for attr in attributes])
+
+
+def material_collection_query(collection_id: UUID, transitive: bool) -> Query:
+    """
+    The query that matches the materials of given collection (see `MaterialSearch.collection_filter`).
+    """
+    collection_id = str(collection_id)
+    # fixme: See https://issues.edu-sharing.net/jira/browse/KBMBF-577
+    #        We would need some nested filters here to make sure that:
+    #          - the material is not only (transitively) within the respective collection
+    #          - but also, that the collection via which it (transitively) belongs to the base collection
+    #            complies with all the base filters.
+    #          - further, the relation of the collection and the material must not be something like "proposed for"
+    #            but the material must really be within that collection.
+    #            See https://github.com/openeduhub/metaqs-main/issues/100
+    exact_collection = Term(**{ElasticResourceAttribute.COLLECTION_NODEREF_ID.keyword: collection_id})
+    if transitive:
+        collection_subtree = Match(**{ElasticResourceAttribute.COLLECTION_PATH.keyword: collection_id})
+        return exact_collection | collection_subtree
+    else:
+        return exact_collection
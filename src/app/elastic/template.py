@@ -0,0 +1,95 @@
+"""
+Compiled request bodies for searches whose shape does not change between requests.
+
+Many endpoints build the same search over and over again, only the collection id differs. Building the
+elasticsearch_dsl object graph and serializing it via `to_dict` on every request is wasted work. A function decorated
+with `search_template` builds its search only once (per shape) with placeholders for its parameters. The serialized
+body is kept together with the positions of the placeholders (the slots). Subsequent calls only fill the slots of a
+copy of the body.
+"""
+
+import functools
+import inspect
+import json
+from typing import Any, Callable, Hashable, TypeVar, Union
+
+from app.elastic.search import _Search
+
+S = TypeVar("S", bound=_Search)
+
+# the number of compiled templates kept per decorated function, shapes are picked by clients (e.g. column selections)
+_MAX_SHAPES = 64
+
+# nested keys (or list indices) leading to the slots of a body, the leaves are the names of the parameters
+_Skeleton = dict[Union[str, int], Union["_Skeleton", str]]
+
+
+def _placeholder(name: str) -> str:
+    return f"\x00{name}\x00"
+
+
+def _skeleton(node: Any, placeholders: dict[str, str]) -> _Skeleton:
+    """Find the slots of the body, i.e. all values that are equal to one of the placeholders."""
+    skeleton: _Skeleton = {}
+    for key, value in node.items() if isinstance(node, dict) else enumerate(node):
+        if isinstance(value, str) and value in placeholders:
+            skeleton[key] = placeholders[value]
+        elif isinstance(value, (dict, list)) and len(sub := _skeleton(value, placeholders)) != 0:
+            skeleton[key] = sub
+    return skeleton
+
+
+def _count(skeleton: _Skeleton) -> int:
+    return sum(1 if isinstance(sub, str) else _count(sub) for sub in skeleton.values())
+
+
+def _fill(node: Any, skeleton: _Skeleton, values: dict[str, str]) -> Any:
+    """Copy the containers along the paths to the slots and fill in the values, everything else is shared."""
+    node = dict(node) if isinstance(node, dict) else list(node)
+    for key, sub in skeleton.items():
+        node[key] = values[sub] if isinstance(sub, str) else _fill(node[key], sub, values)
+    return node
+
+
+def search_template(*shape: str) -> Callable[[Callable[..., S]], Callable[..., S]]:
+    """
+    Decorate a function that builds a search, such that the search is built and serialized only once per shape.
+
+    All parameters of the function except the ones named in `shape` are slots: The function is called with a string
+    placeholder for them, and they must only be used as plain (string) values within the search (e.g. a collection id
+    passed to `collection_filter`). The arguments are filled in as `str(argument)`. The parameters named in `shape`
+    change the structure of the search (e.g. the columns of a quality matrix) and must be hashable, a template is
+    compiled for each of their values. Only the templates of the `_MAX_SHAPES` most recently used shapes are kept.
+
+    The returned searches behave like the searches built by the function, but cannot be modified any further.
+    """
+
+    def decorator(build: Callable[..., S]) -> Callable[..., S]:
+        signature = inspect.signature(build)
+        slots = [name for name in signature.parameters if name not in shape]
+        placeholders = {name: _placeholder(name) for name in slots}
+
+        @functools.lru_cache(maxsize=_MAX_SHAPES)
+        def compiled(shape_arguments: tuple[tuple[str, Hashable], ...]) -> tuple[S, dict, _Skeleton]:
+            search = build(**placeholders, **dict(shape_arguments))
+            body = search.to_dict()
+            skeleton = _skeleton(body, {placeholder: name for name, placeholder in placeholders.items()})
+            # placeholders that are embedded into other strings (or dictionary keys) cannot be filled in
+            serialized = json.dumps(body)
+            occurrences = sum(serialized.count(json.dumps(placeholder)[1:-1]) for placeholder in placeholders.values())
+            if occurrences != _count(skeleton):
+                raise ValueError(f"Search template {build.__qualname__} does not use {slots} as plain values")
+            return search, body, skeleton
+
+        @functools.wraps(build)
+        def instantiate(*args, **kwargs) -> S:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            search, body, skeleton = compiled(tuple((name, bound.arguments[name]) for name in shape))
+            instance = search._clone()
+            instance._body = _fill(body, skeleton, {name: str(bound.arguments[name]) for name in slots})
+            return instance
+
+        return instantiate
+
+    return decorator
@@ -1,9 +1,76 @@
+import asyncio
+from typing import Awaitable, TypeVar
+
+from elasticsearch import AsyncElasticsearch
 from elasticsearch_dsl import connections
+from elasticsearch_dsl.serializer import serializer
 
-from app.core.config import ELASTICSEARCH_TIMEOUT, ELASTICSEARCH_URL
+from app.core.config import (
+    ELASTICSEARCH_HTTP_COMPRESS,
+    ELASTICSEARCH_MAX_CONCURRENT_SEARCHES,
+    ELASTICSEARCH_TIMEOUT,
+    ELASTICSEARCH_URL,
+    MAX_CONNECTIONS_COUNT,
+    MIN_CONNECTIONS_COUNT,
+)
 from app.core.logging import logger
+from app.elastic.connection import PooledConnection
+
+T = TypeVar("T")
+
 
+async def connect_to_elastic():
+    """
+    Register an `AsyncElasticsearch` client as the default elasticsearch-dsl connection.
 
-def connect_to_elastic():
+    All searches (see `app.elastic.search`) await their requests through this client, i.e. they do not block the
+    event loop. The client keeps a pool of up to MAX_CONNECTIONS_COUNT keep-alive connections, of which
+    MIN_CONNECTIONS_COUNT are opened right away, such that the first requests do not pay for the handshakes.
+    """
     logger.debug(f"Attempt to open connection: {ELASTICSEARCH_URL}")
-    connections.create_connection(hosts=[ELASTICSEARCH_URL], timeout=ELASTICSEARCH_TIMEOUT)
+    es = AsyncElasticsearch(
+        hosts=[ELASTICSEARCH_URL],
+        timeout=ELASTICSEARCH_TIMEOUT,
+        serializer=serializer,
+        connection_class=PooledConnection,
+        maxsize=MAX_CONNECTIONS_COUNT,
+        http_compress=ELASTICSEARCH_HTTP_COMPRESS,
+    )
+    connections.add_connection("default", es)
+
+    # concurrent requests cannot share a connection, hence every ping opens (and then keeps) a connection
+    warmup = min(MIN_CONNECTIONS_COUNT, MAX_CONNECTIONS_COUNT)
+    if warmup > 0:
+        reachable = await gather(*(es.ping() for _ in range(warmup)), limit=warmup)
+        if not all(reachable):
+            logger.warning(f"Failed to open {warmup} connections to elasticsearch: {ELASTICSEARCH_URL}")
+
+
+async def close_elastic_connection():
+    logger.debug(f"Closing connection: {ELASTICSEARCH_URL}")
+    await connections.get_connection().close()
+    connections.remove_connection("default")
+
+
+async def gather(*aws: Awaitable[T], limit: int = ELASTICSEARCH_MAX_CONCURRENT_SEARCHES) -> list[T]:
+    """
+    Run the given awaitables (usually independent elasticsearch queries) concurrently and return their results in
+    the order they were passed in.
+
+    At most `limit` of the awaitables will be in flight at the same time, so a single request cannot flood the
+    cluster with searches. If one of the awaitables fails, the remaining ones are cancelled and the exception is
+    propagated.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    tasks = [asyncio.ensure_future(bounded(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -7,7 +7,8 @@ from starlette_context.middleware import RawContextMiddleware
 
 from app.api.collections.material_validation import background_task
 from app.api.api import router
-from app.api.collections.quality_matrix import quality_matrix_backup_job
+from app.api.collections.quality_matrix import quality_matrix_backup_job, quality_matrix_refresh_job
+from app.api.collections.tree import tree_cache_refresh_job
 from app.core.config import (
     ALLOWED_HOSTS,
     API_DEBUG,
@@ -19,7 +20,8 @@ from app.core.constants import OPEN_API_VERSION
 from app.core.errors import http_422_error_handler, http_error_handler
 from app.core.logging import logger
 from app.core.meta_hierarchy import load_metadataset
-from app.elastic.utils import connect_to_elastic
+from app.elastic.profile import ProfilePlugin
+from app.elastic.utils import close_elastic_connection, connect_to_elastic
 
 
 def api() -> FastAPI:
@@ -37,13 +39,16 @@ def api() -> FastAPI:
         if isinstance(route, APIRoute):
             route.operation_id = route.name
 
-    _api.add_middleware(RawContextMiddleware)
+    _api.add_middleware(RawContextMiddleware, plugins=(ProfilePlugin(),))
 
     _api.add_event_handler("startup", connect_to_elastic)
     _api.add_event_handler("startup", background_task)
+    _api.add_event_handler("startup", tree_cache_refresh_job)
+    _api.add_event_handler("startup", quality_matrix_refresh_job)
     _api.add_event_handler("startup", quality_matrix_backup_job)
     # warmup cache and fail early in case we cannot reach edusharing
     _api.add_event_handler("startup", load_metadataset)
+    _api.add_event_handler("shutdown", close_elastic_connection)
 
     _api.add_exception_handler(HTTPException, http_error_handler)
     _api.add_exception_handler(HTTP_422_UNPROCESSABLE_ENTITY, http_422_error_handler)
@@ -57,7 +62,7 @@ app = CORSMiddleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Total-Count"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag", "Last-Modified"],
 )
 
 if __name__ == "__main__":
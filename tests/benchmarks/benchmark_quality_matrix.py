@@ -0,0 +1,104 @@
+"""
+Measure the assembly of the collection quality matrix from the aggregation response for large collection trees.
+
+For every node of synthetic trees, a bucket with a count for each column of the current metadata hierarchy is generated.
+The columnar assembly (`_build_collection_quality_matrix`) is checked against and compared with the former assembly via
+a dictionary keyed by (collection id, attribute name) tuples.
+
+Run from the repository root via:
+
+    PYTHONPATH=src python tests/benchmarks/benchmark_quality_matrix.py [number of collections]
+"""
+import json
+import sys
+import timeit
+import uuid
+from pathlib import Path
+from unittest import mock
+
+from app.api.collections.quality_matrix import (
+    QualityMatrix,
+    QualityMatrixHeader,
+    QualityMatrixRow,
+    _attribute_columns,
+    _build_collection_quality_matrix,
+    _flat_hierarchy,
+    _quality_matrix_columns,
+)
+from app.api.collections.tree_index import TreeIndex
+
+resources = Path(__file__).parent.parent / "resources"
+
+
+def buckets(index: TreeIndex) -> list[dict]:
+    """One bucket per node with a missing count for every column of the current metadata hierarchy."""
+    attributes = _attribute_columns()[1]
+    return [
+        {
+            "key": str(node_id),
+            "doc_count": 100 + i % 1000,
+            **{attribute.path: {"doc_count": (i * (j + 1)) % 100} for j, attribute in enumerate(attributes)},
+        }
+        for i, node_id in enumerate(index.ids)
+    ]
+
+
+def dictionary_assembly(index: TreeIndex, buckets: list[dict]) -> QualityMatrix:
+    data: dict[tuple[uuid.UUID, str], int] = {}
+    totals: dict[uuid.UUID, int] = {}
+    for bucket in buckets:
+        collection_id = uuid.UUID(bucket["key"])
+        totals[collection_id] = bucket["doc_count"]
+        for _, name, attribute in _flat_hierarchy():
+            if attribute is not None:
+                data[(collection_id, name)] = bucket[attribute.path]["doc_count"]
+
+    return QualityMatrix(
+        rows=[
+            QualityMatrixRow(
+                meta=QualityMatrixHeader(
+                    id=str(node_id),
+                    label=index.titles[i],
+                    alt_label=str(node_id),
+                    level=index.level[i] - index.level[0],
+                ),
+                counts={
+                    name: totals.get(node_id, 0) - data.get((node_id, name), 0)
+                    for _, name, attribute in _flat_hierarchy()
+                    if attribute is not None
+                },
+                total=totals.get(node_id, 0),
+            )
+            for i, node_id in enumerate(index.ids)
+        ],
+        columns=_quality_matrix_columns(),
+    )
+
+
+def main(size: int = 10_000, repeat: int = 3):
+    with open(resources / "edu-sharing-metadataset.json") as f:
+        mds = json.load(f)
+
+    with mock.patch("app.api.collections.quality_matrix.load_metadataset", lambda: mds):
+        for name, fan_out in [("fan-out 4", 4), ("fan-out 32", 32), ("flat", size)]:
+            ids = [uuid.uuid4() for _ in range(size)]
+            index = TreeIndex.from_parents(
+                root_id=ids[0],
+                root_title="Collection 0",
+                nodes=((ids[i], ids[(i - 1) // fan_out], f"Collection {i}") for i in range(1, size)),
+            )
+            data = buckets(index)
+
+            assert _build_collection_quality_matrix(index, data) == dictionary_assembly(index, data)
+
+            print(f"{name} ({size} collections)")
+            for label, fn in {
+                "columnar": lambda: _build_collection_quality_matrix(index, data),
+                "dictionary": lambda: dictionary_assembly(index, data),
+            }.items():
+                best = min(timeit.repeat(fn, number=1, repeat=repeat))
+                print(f"{label:>12}: {best * 1000:8.1f} ms total, {best / size * 1e6:6.2f} µs per row")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,61 @@
+"""
+Compare the per hit overhead of wrapping search responses into elasticsearch_dsl objects (`_Search.execute`) with
+working on the plain response body (`_Search.execute_raw`).
+
+Run from the repository root via:
+
+    PYTHONPATH=src python tests/benchmarks/benchmark_raw_hits.py [number of hits]
+"""
+import sys
+import timeit
+import uuid
+
+from app.elastic.search import MaterialSearch, hits
+
+
+def response(size: int) -> dict:
+    return {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": size, "relation": "eq"},
+            "max_score": 1.0,
+            "hits": [
+                {
+                    "_index": "workspace",
+                    "_type": "_doc",
+                    "_id": str(i),
+                    "_score": 1.0,
+                    "_source": {
+                        "nodeRef": {"id": str(uuid.uuid4())},
+                        "properties": {"cclom:title": f"Material {i}", "cclom:general_keyword": ["a", "b", "c"]},
+                    },
+                    "matched_queries": ["description"],
+                }
+                for i in range(size)
+            ],
+        },
+    }
+
+
+def wrapped(body: dict) -> list[str]:
+    search = MaterialSearch()
+    result = search._response_class(search, body)
+    return [hit.to_dict()["nodeRef"]["id"] for hit in result if "description" in hit.meta.matched_queries]
+
+
+def raw(body: dict) -> list[str]:
+    return [hit["_source"]["nodeRef"]["id"] for hit in hits(body) if "description" in hit["matched_queries"]]
+
+
+def main(size: int = 100_000, repeat: int = 5):
+    body = response(size)
+    assert wrapped(body) == raw(body)
+    for name, fn in [("AttrDict response", wrapped), ("plain response", raw)]:
+        best = min(timeit.repeat(lambda: fn(body), number=1, repeat=repeat))
+        print(f"{name:>20}: {best * 1000:8.1f} ms total, {best / size * 1e6:6.2f} µs per hit ({size} hits)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
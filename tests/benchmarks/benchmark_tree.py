@@ -0,0 +1,74 @@
+"""
+Measure the construction and traversal of collection trees with 100k nodes of varying depth and fan-out.
+
+Besides the timings of the iterative implementations, the traversals are checked against the former recursive
+implementations, which are measured as well as long as the tree is shallow enough for the recursion limit.
+
+Run from the repository root via:
+
+    PYTHONPATH=src python tests/benchmarks/benchmark_tree.py [number of nodes]
+"""
+import sys
+import timeit
+import uuid
+from typing import Iterable
+
+from app.api.collections.tree import Tree, build_forest
+from app.api.collections.tree_index import TreeIndex
+from app.core.constants import COLLECTION_ROOT_ID
+
+
+def sources(size: int, fan_out: int) -> list[dict]:
+    """Collection nodes (as `_source` of the forest search) of a complete tree with the given fan-out."""
+    ids = [COLLECTION_ROOT_ID] + [str(uuid.uuid4()) for _ in range(size)]
+    return [
+        {
+            "nodeRef": {"id": ids[i]},
+            "parentRef": {"id": ids[(i - 1) // fan_out]},
+            "properties": {"cm:title": f"Collection {i}"},
+        }
+        for i in range(1, size + 1)
+    ]
+
+
+def recursive_flatten(node: Tree) -> Iterable[Tree]:
+    yield node
+    for child in node.children:
+        yield from recursive_flatten(child)
+
+
+def recursive_bft(node: Tree, root: bool = True) -> Iterable[Tree]:
+    if root:
+        yield node
+    for child in node.children:
+        yield child
+    for child in node.children:
+        yield from recursive_bft(child, root=False)
+
+
+def main(size: int = 100_000, repeat: int = 3):
+    for name, fan_out in [("chain", 1), ("binary", 2), ("fan-out 16", 16), ("flat", size)]:
+        data = sources(size, fan_out)
+        forest = build_forest(data)
+        root = forest.root
+        depth = max(forest.index.level) - min(forest.index.level)
+        timings = {
+            "build_forest": lambda: build_forest(data),
+            "TreeIndex.from_tree": lambda: TreeIndex.from_tree(root),
+            "Tree.flatten": lambda: sum(1 for _ in root.flatten()),
+            "Tree.bft": lambda: sum(1 for _ in root.bft()),
+        }
+        if depth < sys.getrecursionlimit() - 100:
+            assert [n.node_id for n in root.flatten()] == [n.node_id for n in recursive_flatten(root)]
+            assert [n.node_id for n in root.bft()] == [n.node_id for n in recursive_bft(root)]
+            timings["recursive flatten"] = lambda: sum(1 for _ in recursive_flatten(root))
+            timings["recursive bft"] = lambda: sum(1 for _ in recursive_bft(root))
+
+        print(f"{name} ({len(forest)} nodes, depth {depth})")
+        for label, fn in timings.items():
+            best = min(timeit.repeat(fn, number=1, repeat=repeat))
+            print(f"{label:>22}: {best * 1000:8.1f} ms total, {best / len(forest) * 1e6:6.2f} µs per node")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
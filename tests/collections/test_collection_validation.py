@@ -11,7 +11,7 @@ from tests.conftest import elastic_search_mock
 async def test_collection_validation():
     biology = uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"])
     with elastic_search_mock("collection-validation"):
-        result = collection_validation(collection_id=biology)
+        result = await collection_validation(collection_id=biology)
 
     assert len(result) == 82
     assert all(r.title == [] for r in result), "Contradiction with response which indicated no missing titles"
@@ -8,15 +8,14 @@ from app.api.collections.material_counts import (
 )
 from app.api.collections.tree import tree
 from app.core.constants import COLLECTION_NAME_TO_ID
-from tests.conftest import elastic_search_mock
+from tests.conftest import elastic_search_mock, forest_mock
 
 
 @pytest.mark.asyncio
 async def test_get_material_counts():
     biology = uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"])
-    with elastic_search_mock(resource="tree"):
-        collection = tree(node_id=biology)
-    with elastic_search_mock(resource="material-counts"):
+    with forest_mock(resource="tree"), elastic_search_mock(resource="material-counts"):
+        collection = await tree(node_id=biology)
         result = await material_counts(collection=collection)
 
     counts_by_id = {item.node_id: item for item in result}
@@ -1,15 +1,18 @@
 from uuid import UUID
 
+import pytest
+
 from app.api.collections.material_validation import _get_material_validation_single_collection, MaterialValidation
 from app.core.constants import COLLECTION_NAME_TO_ID
 from tests.conftest import elastic_search_mock
 
 
-def test_get_material_validation_single_collection():
+@pytest.mark.asyncio
+async def test_get_material_validation_single_collection():
     chemie = UUID(COLLECTION_NAME_TO_ID["Chemie"])
 
     with elastic_search_mock(resource="material-validation-single-collection"):
-        response = _get_material_validation_single_collection(collection_id=chemie, title="Chemie")
+        response = await _get_material_validation_single_collection(collection_id=chemie, title="Chemie")
 
     assert response == MaterialValidation(
         collection_id=chemie,
@@ -5,7 +5,9 @@ import uuid
 import datetime
 from pathlib import Path
 from unittest import mock
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
 
 from app.api.collections.tree import Tree
 from app.api.collections.quality_matrix import (
@@ -14,11 +16,17 @@ from app.api.collections.quality_matrix import (
     QualityMatrixHeader,
     quality_backup,
     past_quality_matrix,
+    QualityMatrixCache,
+    quality_matrix_series,
+    select_columns,
 )
 from app.api.collections.quality_matrix import _replication_source_quality_matrix
+from app.api.collections.quality_matrix import replication_source_quality_matrices
 from app.api.collections.quality_matrix import _collection_quality_matrix
 from app.api.collections.quality_matrix import timestamps
 from app.core.constants import COLLECTION_NAME_TO_ID
+from fastapi import HTTPException
+
 from tests.conftest import elastic_search_mock
 
 
@@ -35,7 +43,8 @@ def edusharing_mock():
         yield
 
 
-def test_quality_matrix_history(tmpdir):
+@pytest.mark.asyncio
+async def test_quality_matrix_history(tmpdir):
     os.chdir(tmpdir)
     from app.db.tasks import (
         session_maker,
@@ -52,20 +61,26 @@ def test_quality_matrix_history(tmpdir):
         ],
     )
 
-    def mock_matrix(node, mode) -> QualityMatrix:
+    async def mock_matrix(node, mode) -> QualityMatrix:
         return matrix_mock
 
     node_id = uuid.UUID(COLLECTION_NAME_TO_ID["Chemie"])
     timestamp = datetime.datetime(year=2022, month=10, day=22, hour=10, minute=10, second=0)
     with (
         mock.patch("app.api.collections.quality_matrix.quality_matrix", mock_matrix),
-        mock.patch("app.api.collections.quality_matrix.tree", MagicMock(title="title", id=node_id)),
+        mock.patch(
+            "app.api.collections.quality_matrix.replication_source_quality_matrices",
+            AsyncMock(side_effect=lambda ids: {node_id: matrix_mock for node_id in ids}),
+        ),
+        mock.patch(
+            "app.api.collections.quality_matrix.tree", AsyncMock(return_value=MagicMock(title="title", id=node_id))
+        ),
         session_maker().context_session() as session,
     ):
         # save quality matrices for all collections and both modes
-        quality_backup(session, timestamp=timestamp)
+        await quality_backup(session, timestamp=timestamp)
         # saving the same quality matrix should be a noop, as the integrity error should be ignored.
-        quality_backup(session, timestamp=timestamp)
+        await quality_backup(session, timestamp=timestamp)
 
         # check that timestamps are loaded correctly
         timestamp, *other = timestamps(session, mode="replication-source", node_id=node_id)
@@ -81,7 +96,58 @@ def test_quality_matrix_history(tmpdir):
         assert matrix == matrix_mock
 
 
-def test_replication_source_quality_matrix():
+def test_quality_matrix_series(tmpdir):
+    os.chdir(tmpdir)
+    from app.db.tasks import Timeline, session_maker
+
+    def header(name: str) -> QualityMatrixHeader:
+        return QualityMatrixHeader(id=name, label=f"{name}-label", alt_label=None, level=1)
+
+    def snapshot(rows: dict[str, tuple[int, dict[str, int]]]) -> QualityMatrix:
+        return QualityMatrix(
+            columns=[header("title"), header("license")],
+            rows=[
+                QualityMatrixRow(meta=header(row_id), counts=counts, total=total)
+                for row_id, (total, counts) in rows.items()
+            ],
+        )
+
+    node_id = uuid.uuid4()
+    snapshots = {
+        100: snapshot({"a": (4, {"title": 1, "license": 2}), "b": (5, {"title": 3, "license": 4})}),
+        200: snapshot({"a": (6, {"title": 5, "license": 6})}),
+        300: snapshot({"a": (7, {"title": 7}), "b": (8, {"title": 8, "license": 9})}),
+        400: snapshot({"a": (9, {"title": 9, "license": 9})}),
+    }
+    with session_maker().context_session() as session:
+        session.add_all(
+            Timeline(timestamp=timestamp, mode="collection", node_id=str(node_id), quality_matrix=matrix.json())
+            for timestamp, matrix in snapshots.items()
+        )
+        session.commit()
+
+        series = quality_matrix_series(session, mode="collection", collection_id=node_id, start=100, end=300)
+        assert series.timestamps == [100, 200, 300]
+        assert [column.id for column in series.columns] == ["title", "license"]
+        assert [(row.meta.id, row.total, row.counts) for row in series.rows] == [
+            ("a", [4, 6, 7], {"title": [1, 5, 7], "license": [2, 6, None]}),
+            ("b", [5, None, 8], {"title": [3, None, 8], "license": [4, None, 9]}),
+        ]
+
+        series = quality_matrix_series(
+            session, mode="collection", collection_id=node_id, start=200, rows=["b"], columns=frozenset({"license"})
+        )
+        assert series.timestamps == [200, 300, 400]
+        assert [column.id for column in series.columns] == ["license"]
+        assert [(row.meta.id, row.total, row.counts) for row in series.rows] == [
+            ("b", [None, 8, None], {"license": [None, 9, None]}),
+        ]
+
+        assert quality_matrix_series(session, mode="replication-source", collection_id=node_id).rows == []
+
+
+@pytest.mark.asyncio
+async def test_replication_source_quality_matrix():
     collection = Tree(
         node_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"),
         title="root",
@@ -105,7 +171,7 @@ def test_replication_source_quality_matrix():
         ],
     )
     with elastic_search_mock("quality-matrix-replication-source"), edusharing_mock():
-        result = _replication_source_quality_matrix(collection=collection)
+        result = await _replication_source_quality_matrix(collection=collection)
         assert result == QualityMatrix(
             columns=[
                 QualityMatrixHeader(id="Beschreibendes", label="Beschreibendes", alt_label=None, level=0),
@@ -792,7 +858,8 @@ def test_replication_source_quality_matrix():
         )
 
 
-def test_collection_quality_matrix():
+@pytest.mark.asyncio
+async def test_collection_quality_matrix():
     collection = Tree(
         node_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"),
         title="root",
@@ -816,7 +883,7 @@ def test_collection_quality_matrix():
         ],
     )
     with elastic_search_mock("quality-matrix-collection"), edusharing_mock():
-        result = _collection_quality_matrix(collection=collection)
+        result = await _collection_quality_matrix(collection=collection)
         assert result == QualityMatrix(
             columns=[
                 QualityMatrixHeader(id="Beschreibendes", label="Beschreibendes", alt_label=None, level=0),
@@ -1293,3 +1360,175 @@ def test_collection_quality_matrix():
                 ),
             ],
         )
+
+
+@pytest.mark.asyncio
+async def test_quality_matrix_cache():
+    def collection(node_id: str) -> Tree:
+        return Tree(node_id=uuid.UUID(node_id), title="", level=0, parent_id=None, children=[])
+
+    biology = collection(COLLECTION_NAME_TO_ID["Biologie"])
+    subcollection = collection("220f48a8-4b53-4179-919d-7cd238ed567e")
+    compute = AsyncMock(side_effect=lambda c, mode, columns=None: QualityMatrix(rows=[], columns=[]))
+    cache = QualityMatrixCache()
+
+    with mock.patch("app.api.collections.quality_matrix.quality_matrix", compute):
+        matrix, computed_at = await cache.get(biology, mode="collection")
+        assert (await cache.get(biology, mode="collection")) == (matrix, computed_at)
+        assert compute.call_count == 1
+
+        # forced live computation replaces the cached matrix
+        _, fresh_at = await cache.get(biology, mode="collection", fresh=True)
+        assert compute.call_count == 2 and fresh_at >= computed_at
+        assert (await cache.get(biology, mode="collection"))[1] == fresh_at
+
+        # only top level collections are cached
+        await cache.get(subcollection, mode="collection")
+        await cache.get(subcollection, mode="collection")
+        assert compute.call_count == 4
+
+        # the previous matrices are kept if the refresh fails
+        with (
+            mock.patch("app.api.collections.quality_matrix.tree", AsyncMock(side_effect=RuntimeError)),
+            mock.patch(
+                "app.api.collections.quality_matrix.replication_source_quality_matrices",
+                AsyncMock(side_effect=RuntimeError),
+            ),
+        ):
+            await cache.refresh()
+        assert (await cache.get(biology, mode="collection"))[1] == fresh_at
+
+
+@pytest.mark.asyncio
+async def test_quality_matrix_cache_refresh_reuses_recent_matrices():
+    cached, computed = QualityMatrix(rows=[], columns=[]), QualityMatrix(rows=[], columns=[])
+    recent, old = (uuid.UUID(node_id) for node_id in list(COLLECTION_NAME_TO_ID.values())[:2])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cache = QualityMatrixCache()
+    cache._entries[(recent, "replication-source")] = (cached, now - datetime.timedelta(seconds=10))
+    cache._entries[(old, "replication-source")] = (cached, now - datetime.timedelta(hours=1))
+
+    compute = AsyncMock(side_effect=lambda ids: {node_id: computed for node_id in ids})
+    with mock.patch("app.api.collections.quality_matrix.replication_source_quality_matrices", compute):
+        matrices = await cache.refresh_all("replication-source", max_age=60)
+        assert len(matrices) == len(COLLECTION_NAME_TO_ID)
+        assert matrices[recent] is cached and matrices[old] is computed
+        assert recent not in compute.call_args.args[0] and old in compute.call_args.args[0]
+        assert cache.computed_at(recent, "replication-source") == now - datetime.timedelta(seconds=10)
+
+        # nothing is computed if all matrices are recent enough
+        compute.reset_mock()
+        assert (await cache.refresh_all("replication-source", max_age=60)).keys() == matrices.keys()
+        compute.assert_not_awaited()
+
+        # without max_age, all matrices are recomputed
+        assert (await cache.refresh_all("replication-source"))[recent] is computed
+
+
+@pytest.mark.asyncio
+async def test_replication_source_quality_matrices_in_single_pass():
+    collection = Tree(node_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"), title="root", level=0, children=[])
+    with elastic_search_mock("quality-matrix-replication-source"), edusharing_mock():
+        expected = await _replication_source_quality_matrix(collection=collection)
+
+    with open(Path(__file__).parent.parent / "resources" / "quality-matrix-replication-source-response.json") as f:
+        aggregation = json.load(f)["aggregations"]["replication_source"]
+    other = uuid.uuid4()
+    response = {
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "timed_out": False,
+        "aggregations": {"collection": {"buckets": {str(collection.node_id): {"replication_source": aggregation}}}},
+    }
+    execute_raw = AsyncMock(return_value=response)
+    with mock.patch("app.elastic.search._Search.execute_raw", execute_raw), edusharing_mock():
+        result = await replication_source_quality_matrices([collection.node_id, other])
+
+    assert execute_raw.call_count == 1
+    assert result[collection.node_id] == expected
+    # a collection without materials still has a row per known replication source
+    assert all(row.total == 0 for row in result[other].rows)
+
+
+def test_select_columns():
+    assert select_columns() is None
+    assert select_columns(columns=["title"]) == {"title"}
+    assert select_columns(groups=["Beschreibendes"], columns=["fsk"]) == {
+        "cover",
+        "short_title",
+        "title",
+        "description",
+        "status",
+        "url",
+        "language",
+        "fsk",
+    }
+    with pytest.raises(HTTPException) as error:
+        select_columns(groups=["unknown"])
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_quality_matrix_column_subset():
+    collection = Tree(node_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"), title="root", level=0, children=[])
+    with elastic_search_mock("quality-matrix-replication-source"), edusharing_mock():
+        full = await _replication_source_quality_matrix(collection=collection)
+
+        columns = select_columns(groups=["Typisierung"], columns=["title"])
+        search = AsyncMock(return_value=full)
+        cache = QualityMatrixCache()
+        with mock.patch("app.api.collections.quality_matrix._replication_source_quality_matrix", search):
+            cache._entries[(collection.node_id, "replication-source")] = (full, datetime.datetime.now())
+            subset, _ = await cache.get(collection, mode="replication-source", columns=columns)
+            assert search.call_count == 0  # reduced from the cached matrix
+
+            # only the groups with selected columns are part of the header
+            assert [column.id for column in subset.columns if column.level == 0] == ["Beschreibendes", "Typisierung"]
+            assert {column.id for column in subset.columns if column.level == 1} == columns
+            assert all(row.counts.keys() == columns for row in subset.rows)
+            assert [row.total for row in subset.rows] == [row.total for row in full.rows]
+
+            # live computations only query the selected columns
+            await cache.get(collection, mode="replication-source", columns=columns, fresh=True)
+            assert search.call_args.kwargs["columns"] == columns
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["collection", "replication-source"])
+async def test_column_sharded_quality_matrix(mode):
+    collection = Tree(
+        node_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"),
+        title="root",
+        level=0,
+        children=[
+            Tree(
+                node_id=uuid.UUID("481c9ce1-7f72-4598-a326-7dba785a065d"),
+                title="child1",
+                parent_id=uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629"),
+                children=[],
+                level=1,
+            ),
+        ],
+    )
+    compute = _collection_quality_matrix if mode == "collection" else _replication_source_quality_matrix
+    with elastic_search_mock(f"quality-matrix-{mode}"), edusharing_mock():
+        expected = await compute(collection)
+
+    with open(Path(__file__).parent.parent / "resources" / f"quality-matrix-{mode}-response.json") as f:
+        response = json.load(f)
+
+    requests = []
+
+    async def execute_raw(self, filter_path=None, ignore_cache=False):  # noqa
+        requests.append(self.to_dict())
+        return response
+
+    with (
+        mock.patch("app.elastic.search._Search.execute_raw", execute_raw),
+        mock.patch("app.api.collections.quality_matrix.QUALITY_MATRIX_COLUMN_SHARD_SIZE", 10),
+        edusharing_mock(),
+    ):
+        result = await compute(collection)
+
+    assert result == expected
+    shards = [len(next(iter(request["aggs"].values()))["aggs"]) for request in requests]
+    assert max(shards) == 10 and sum(shards) == sum(len(row.counts) for row in expected.rows[:1])
@@ -33,7 +33,7 @@ def test_score_empty_hits():
 async def test_collection_search_score():
     chemie = uuid.UUID(COLLECTION_NAME_TO_ID["Chemie"])
     with elastic_search_mock("collection-search-score"):
-        result = collection_search_score(chemie)
+        result = await collection_search_score(chemie)
     assert result == {
         "total": 209,
         "short_description": 0,
@@ -50,7 +50,7 @@ async def test_collection_search_score():
 async def test_material_search_score():
     chemie = uuid.UUID(COLLECTION_NAME_TO_ID["Chemie"])
     with elastic_search_mock("material-search-score"):
-        result = material_search_score(chemie)
+        result = await material_search_score(chemie)
     assert result == {
         "total": 2331,
         "missing_intended_end_user_role": 871,
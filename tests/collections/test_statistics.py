@@ -12,7 +12,7 @@ from tests.conftest import elastic_search_mock
 async def test_materials_by_collection_title():
     with elastic_search_mock(resource="materials-by-collection-title"):
         # fmt: off
-        result: dict[UUID, dict[str, int]] = materials_by_collection_title(
+        result: dict[UUID, dict[str, int]] = await materials_by_collection_title(
             nodes=[
                 Tree(
                     node_id=UUID(COLLECTION_NAME_TO_ID["Chemie"]), title="Chemie", children=[], parent_id=None, level=0
@@ -32,7 +32,7 @@ async def test_materials_by_collection_title():
 @pytest.mark.asyncio
 async def test_materials_by_collection_id():
     with elastic_search_mock(resource="materials-by-collection-id"):
-        result: dict[UUID, dict[str, int]] = materials_by_collection_id(
+        result: dict[UUID, dict[str, int]] = await materials_by_collection_id(
             collection_id=UUID(COLLECTION_NAME_TO_ID["Chemie"]),
             oer_only=True,
         )
@@ -1,12 +1,29 @@
+import asyncio
+import json
+import sys
 import uuid
+from pathlib import Path
+from unittest import mock
+from unittest.mock import AsyncMock
 
 import pytest
 from aiohttp import ClientSession
+from fastapi import HTTPException
 
-from app.api.collections.tree import Tree
+from app.api.collections.tree import (
+    Forest,
+    Tree,
+    TreeField,
+    build_forest,
+    fetch_forest,
+    fetch_forest_changes,
+)
 from app.api.collections.tree import tree as load_tree
+from app.api.collections.tree import tree_cache, tree_index, tree_slice
+from app.api.collections.tree_index import TreeIndex
+from app.core.constants import COLLECTION_NAME_TO_ID
 from app.core.vocabs import tree_from_vocabs
-from tests.conftest import elastic_search_mock
+from tests.conftest import forest_mock
 
 
 @pytest.mark.asyncio
@@ -19,10 +36,11 @@ async def test_collection_tree_vocabs():
     assert count >= 2200  # adapt this number to the current state, may change regularly
 
 
-def test_tree_from_elastic():
+@pytest.mark.asyncio
+async def test_tree_from_elastic():
     node_id_biology = uuid.UUID("15fce411-54d9-467f-8f35-61ea374a298d")
-    with elastic_search_mock("tree"):
-        tree = load_tree(node_id_biology)
+    with forest_mock("tree"):
+        tree = await load_tree(node_id_biology)
 
     expected = Tree(
         node_id=node_id_biology,
@@ -62,3 +80,250 @@ def test_tree_from_elastic():
         ],
     )
     assert tree == expected
+
+
+@pytest.mark.asyncio
+async def test_forest_search_request():
+    with open(Path(__file__).parent.parent / "resources" / "forest-request.json") as f:
+        expected = json.load(f)
+
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit"})
+    es.search = AsyncMock(
+        return_value={"timed_out": False, "_shards": {"total": 1, "successful": 1}, "hits": {"hits": []}}
+    )
+    es.close_point_in_time = AsyncMock()
+    with mock.patch("app.elastic.pagination.get_connection", return_value=es):
+        await fetch_forest()
+
+    # the body of the (first) page, except the point in time
+    body = {key: value for key, value in es.search.await_args.kwargs["body"].items() if key != "pit"}
+    assert body == expected
+
+
+@pytest.mark.asyncio
+async def test_tree_of_any_node():
+    with forest_mock("tree"):
+        subtree = await load_tree(uuid.UUID("220f48a8-4b53-4179-919d-7cd238ed567e"))
+        assert subtree.title == "Chemische Grundlagen"
+        assert [child.title for child in subtree.children] == ["Luft und Atmosphäre", "Wasser - Grundstoff des Lebens"]
+
+        # all top level collections are part of the forest, even without hits
+        chemie = await load_tree(uuid.UUID(COLLECTION_NAME_TO_ID["Chemie"]))
+        assert (chemie.title, chemie.level, chemie.children) == ("Chemie", 0, [])
+
+        with pytest.raises(HTTPException) as error:
+            await load_tree(uuid.uuid4())
+        assert error.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_tree_cache_serves_previous_forest_while_refreshing():
+    node_id = uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"])
+
+    def forest(title: str) -> Forest:
+        return Forest(TreeIndex(ids=[node_id], titles=[title], parent=[-1], level=[0]))
+
+    old, new = forest("old"), forest("new")
+    rebuilding = asyncio.Event()
+    release = asyncio.Event()
+
+    async def fetch():
+        if not rebuilding.is_set():
+            rebuilding.set()
+            return old
+        await release.wait()
+        return new
+
+    tree_cache.clear()
+    with mock.patch("app.api.collections.tree.fetch_forest", fetch):
+        assert (await load_tree(node_id)).title == "old"
+        assert (await load_tree(node_id)).title == "old"
+
+        refresh = asyncio.ensure_future(tree_cache.refresh())
+        await asyncio.sleep(0)
+        assert (await load_tree(node_id)).title == "old"  # still served while rebuilding
+        release.set()
+        await refresh
+        assert (await load_tree(node_id)).title == "new"
+
+        with mock.patch("app.api.collections.tree.fetch_forest", AsyncMock(side_effect=RuntimeError)):
+            await tree_cache.refresh()
+        assert (await load_tree(node_id)).title == "new"  # kept on failure
+
+    stats = tree_cache.stats()
+    assert (stats.hits, stats.misses, stats.refreshes, stats.failed_refreshes, stats.nodes) == (4, 1, 1, 1, 1)
+    tree_cache.clear()
+
+
+def test_traversal_of_deep_tree():
+    # deeper than the recursion limit
+    size = sys.getrecursionlimit() * 2
+    ids = [uuid.uuid4() for _ in range(size)]
+    forest = Forest(
+        TreeIndex(ids=ids, titles=[str(i) for i in range(size)], parent=range(-1, size - 1), level=range(size))
+    )
+    assert [node.node_id for node in forest.root.flatten()] == ids
+    assert [node.node_id for node in forest.root.bft(root=False)] == ids[1:]
+
+
+def test_traversal_order():
+    def node(title: str, *children: Tree) -> Tree:
+        return Tree(node_id=uuid.uuid4(), title=title, level=0, parent_id=None, children=list(children))
+
+    root = node("root", node("a", node("a1", node("a11")), node("a2")), node("b", node("b1")))
+    assert [n.title for n in root.flatten()] == ["root", "a", "a1", "a11", "a2", "b", "b1"]
+    assert [n.title for n in root.flatten(root=False)] == ["a", "a1", "a11", "a2", "b", "b1"]
+    assert [n.title for n in root.bft()] == ["root", "a", "b", "a1", "a2", "a11", "b1"]
+    assert [n.title for n in root.bft(root=False)] == ["a", "b", "a1", "a2", "a11", "b1"]
+
+
+def test_forest_materializes_shared_subtrees():
+    #   r
+    #   a    b
+    #   a1
+    r, a, a1, b = (uuid.uuid4() for _ in range(4))
+    forest = Forest(
+        TreeIndex(ids=[r, a, a1, b], titles=["r", "a", "a1", "b"], parent=[-1, 0, 1, 0], level=[-1, 0, 1, 0])
+    )
+
+    subtree = forest.subtree(a)
+    assert [node.title for node in subtree.flatten()] == ["a", "a1"]
+    # the root of a requested tree has no parent
+    assert subtree.parent_id is None and subtree.children[0].parent_id == a
+    assert forest.subtree(a) is subtree
+
+    # the subtree materialized before is linked into the root
+    assert [node.title for node in forest.root.flatten()] == ["r", "a", "a1", "b"]
+    assert forest.root.children[0].parent_id == r
+    assert forest.root.children[0].children is subtree.children
+    assert forest.subtree(b).title == "b" and forest.subtree(b).parent_id is None
+
+    with pytest.raises(HTTPException):
+        forest.subtree(uuid.uuid4())
+
+
+@pytest.mark.asyncio
+async def test_tree_index_of_cached_forest():
+    biology = uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"])
+    with forest_mock(resource="tree"):
+        collection = await load_tree(biology)
+        index, i = tree_index(collection)
+        assert index is tree_cache._forest.index
+        assert [index.ids[j] for j in index.preorder(i)] == [node.node_id for node in collection.flatten()]
+
+    # trees that are not part of the cached forest are indexed on the fly
+    index, i = tree_index(collection)
+    assert i == 0 and index.ids == [node.node_id for node in collection.flatten()]
+
+
+def collection(node_id: uuid.UUID, parent_id: uuid.UUID, title: str, modified: str) -> dict:
+    return {
+        "nodeRef": {"id": str(node_id)},
+        "parentRef": {"id": str(parent_id)},
+        "properties": {"cm:title": title, "cm:modified": modified},
+    }
+
+
+@pytest.mark.asyncio
+async def test_forest_changes_request():
+    forest = build_forest(
+        [collection(uuid.uuid4(), uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"]), "A", "2022-06-02T10:00:00.000Z")]
+    )
+
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit"})
+    es.search = AsyncMock(
+        return_value={"timed_out": False, "_shards": {"total": 1, "successful": 1}, "hits": {"hits": []}}
+    )
+    es.close_point_in_time = AsyncMock()
+    count = AsyncMock(
+        return_value={"timed_out": False, "_shards": {"total": 1, "successful": 1}, "hits": {"total": {"value": 1}}}
+    )
+    with (
+        mock.patch("app.elastic.pagination.get_connection", return_value=es),
+        mock.patch("app.elastic.search._Search.execute_raw", count),
+    ):
+        assert await fetch_forest_changes(forest) is forest
+
+    # cm:modified is mapped as text, the range has to compare the keyword
+    filters = es.search.await_args.kwargs["body"]["query"]["bool"]["filter"]
+    assert {"range": {"properties.cm:modified.keyword": {"gte": "2022-06-02T10:00:00.000Z"}}} in filters
+    assert not any("properties.cm:modified" in f.get("range", {}) for f in filters)
+
+
+@pytest.mark.asyncio
+async def test_splice_modified_collections():
+    biology = uuid.UUID(COLLECTION_NAME_TO_ID["Biologie"])
+    chemistry = uuid.UUID(COLLECTION_NAME_TO_ID["Chemie"])
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    forest = build_forest(
+        [
+            collection(a, biology, "A", "2022-06-01T10:00:00.000Z"),
+            collection(b, a, "B", "2022-06-02T10:00:00.000Z"),
+        ]
+    )
+    assert forest.modified == "2022-06-02T10:00:00.000Z"
+
+    # a is moved (with its child b) to chemistry and retitled, c is new
+    changes = [
+        collection(a, chemistry, "A'", "2022-06-03T10:00:00.000Z"),
+        collection(c, b, "C", "2022-06-03T11:00:00.000Z"),
+    ]
+    updated = build_forest(changes, base=forest)
+    assert updated.modified == "2022-06-03T11:00:00.000Z"
+    assert updated.found == {a, b, c}
+    assert [node.title for node in updated.subtree(chemistry).flatten()] == ["Chemie", "A'", "B", "C"]
+    assert updated.subtree(biology).children == []
+    assert updated.subtree(c).level == 3
+    # the base forest is left untouched
+    assert [node.title for node in forest.subtree(biology).flatten()] == ["Biologie", "A", "B"]
+
+    async def iterate_pages_mock(*args, **kwargs):  # noqa
+        yield {**ok, "hits": {"hits": [{"_source": source} for source in changes]}}
+
+    def count(total: int) -> AsyncMock:
+        return AsyncMock(return_value={**ok, "hits": {"total": {"value": total}}})
+
+    ok = {"_shards": {"total": 1, "successful": 1}, "timed_out": False}
+
+    with mock.patch("app.api.collections.tree.iterate_pages", iterate_pages_mock):
+        with mock.patch("app.elastic.search._Search.execute_raw", count(3)):
+            assert (await fetch_forest_changes(forest)).found == {a, b, c}
+        # a collection was deleted, the forest has to be rebuilt
+        with mock.patch("app.elastic.search._Search.execute_raw", count(2)):
+            assert await fetch_forest_changes(forest) is None
+
+    # collections without title are skipped, but still counted as found, such that they do not force a rebuild
+    untitled = uuid.uuid4()
+    changes = [{"nodeRef": {"id": str(untitled)}, "properties": {"cm:modified": "2022-06-04T10:00:00.000Z"}}]
+    with (
+        mock.patch("app.api.collections.tree.iterate_pages", iterate_pages_mock),
+        mock.patch("app.elastic.search._Search.execute_raw", count(3)),
+    ):
+        updated = await fetch_forest_changes(forest)
+    assert updated.found == {a, b, untitled} and untitled not in updated.index.position
+    assert updated.modified == "2022-06-04T10:00:00.000Z"
+
+
+@pytest.mark.asyncio
+async def test_tree_slice():
+    node_id_biology = uuid.UUID("15fce411-54d9-467f-8f35-61ea374a298d")
+    with forest_mock("tree"):
+        tree = await load_tree(node_id_biology)
+
+    assert tree_slice(tree) == json.loads(tree.json())
+    truncated = {"title": "Biologie", "children": [], "truncated": True}
+    assert tree_slice(tree, depth=0, fields=[TreeField.title]) == truncated
+    assert tree_slice(tree, depth=1, fields=[TreeField.title, TreeField.level]) == {
+        "title": "Biologie",
+        "level": 0,
+        "children": [
+            {"title": "Chemische Grundlagen", "level": 1, "children": [], "truncated": True},
+            {"title": "Evolution", "level": 1, "children": []},
+        ],
+    }
+    assert tree_slice(tree, depth=1, fields=[TreeField.node_id])["children"][1] == {
+        "node_id": "2e674483-0eae-4088-b51a-c4f4bbf86bcc",
+        "children": [],
+    }
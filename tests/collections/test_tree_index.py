@@ -0,0 +1,48 @@
+import uuid
+
+from app.api.collections.tree import Tree
+from app.api.collections.tree_index import TreeIndex
+
+
+def _tree() -> Tree:
+    #        a
+    #      /   \
+    #     b     e
+    #    / \
+    #   c   d
+    def node(name: str, level: int, *children: Tree) -> Tree:
+        return Tree(node_id=uuid.uuid5(uuid.NAMESPACE_URL, name), title=name, level=level, children=list(children))
+
+    return node("a", 0, node("b", 1, node("c", 2), node("d", 2)), node("e", 1))
+
+
+def test_tree_index_from_tree():
+    index = TreeIndex.from_tree(_tree())
+
+    assert len(index) == 5
+    assert index.titles == ["a", "b", "c", "d", "e"]
+    assert list(index.parent) == [-1, 0, 1, 1, 0]
+    assert list(index.level) == [0, 1, 2, 2, 1]
+    assert list(index.end) == [5, 4, 3, 4, 5]
+    assert list(index.children(0)) == [1, 4]
+    assert list(index.children(1)) == [2, 3]
+    assert list(index.children(2)) == []
+
+    assert list(index.preorder(1)) == [1, 2, 3]
+    assert index.is_ancestor(0, 3) and index.is_ancestor(1, 3) and index.is_ancestor(3, 3)
+    assert not index.is_ancestor(4, 3) and not index.is_ancestor(3, 1)
+
+
+def test_tree_index_from_parents():
+    a, b, c, d, e, orphan = (uuid.UUID(int=i) for i in range(6))
+    index = TreeIndex.from_parents(
+        root_id=a,
+        root_title="a",
+        # children are ordered by node id, not by title
+        nodes=[(e, a, "b"), (d, b, "c"), (b, a, "e"), (c, b, "d"), (orphan, uuid.uuid4(), "x")],
+        root_level=-1,
+    )
+
+    assert index.ids == [a, b, c, d, e]
+    assert list(index.level) == [-1, 0, 1, 1, 0]
+    assert orphan not in index.position
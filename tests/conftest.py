@@ -7,7 +7,7 @@ from unittest import mock
 @contextlib.contextmanager
 def elastic_search_mock(resource: str):
     """
-    Mock the execute call of the elasticsearch-dsl Search class package.
+    Mock the (async) execute and execute_raw calls of the search classes in app.elastic.search.
 
     Instead of issuing a http request to elastic, the build request will be validated for equality against a checked in
     request, the result of search.execute() will be constructed from the checked in response json file.
@@ -30,7 +30,7 @@ def elastic_search_mock(resource: str):
     with open(resource_path / f"{resource}-response.json", "r") as response:
         response = json.load(response)
 
-    def execute_mock(self, ignore_cache=False):  # noqa
+    async def execute_mock(self, ignore_cache=False):  # noqa
         assert request is not None and self.to_dict() == request, "Executed request did not match expected request"
         # just use the dictionary deserialized from the resource file and pass it through the original
         # elasticsearch_dsl machinery. I.e. search.execute() should behave __exactly__ as if the result was
@@ -38,5 +38,38 @@ def elastic_search_mock(resource: str):
         self._response = self._response_class(self, response)
         return self._response
 
-    with mock.patch("elasticsearch_dsl.search.Search.execute", execute_mock):
+    async def execute_raw_mock(self, filter_path=None, ignore_cache=False):  # noqa
+        assert request is not None and self.to_dict() == request, "Executed request did not match expected request"
+        # the response filtering of elasticsearch is not emulated, i.e. the complete response is returned.
+        return response
+
+    with mock.patch("app.elastic.search._Search.execute", execute_mock), mock.patch(
+        "app.elastic.search._Search.execute_raw", execute_raw_mock
+    ):
+        yield
+
+
+@contextlib.contextmanager
+def forest_mock(resource: str):
+    """
+    Mock the paginated search of the collection forest (see app.api.collections.tree.fetch_forest).
+
+    The collection forest is built from the hits of the checked in response json file (as single page) instead of
+    querying elastic. The tree cache is cleared before and after, such that the forest is built within this context.
+
+    :param resource: The key (filename) that identifies a response json in the test/resources directory.
+    """
+    import json
+
+    from app.api.collections.tree import tree_cache
+
+    with open(Path(__file__).parent / "resources" / f"{resource}-response.json", "r") as response:
+        response = json.load(response)
+
+    async def iterate_pages_mock(*args, **kwargs):  # noqa
+        yield response
+
+    tree_cache.clear()
+    with mock.patch("app.api.collections.tree.iterate_pages", iterate_pages_mock):
         yield
+    tree_cache.clear()
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.core.single_flight import single_flight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_computation():
+    calls = []
+
+    @single_flight(key=lambda node_id: node_id)
+    async def compute(node_id: str) -> str:
+        calls.append(node_id)
+        await asyncio.sleep(0.01)
+        return node_id.upper()
+
+    results = await asyncio.gather(compute("a"), compute("a"), compute("b"))
+
+    assert results == ["A", "A", "B"]
+    assert calls == ["a", "b"]
+
+    # finished computations are not cached
+    assert await compute("a") == "A"
+    assert calls == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_leader_failure_propagates_to_followers():
+    @single_flight(key=lambda: None)
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("failed")
+
+    results = await asyncio.gather(compute(), compute(), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancellation():
+    started = 0
+
+    @single_flight(key=lambda: None)
+    async def compute() -> int:
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return started
+
+    # cancelling the leader does not affect the follower
+    leader = asyncio.ensure_future(compute())
+    follower = asyncio.ensure_future(compute())
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    assert await follower == 1
+    assert leader.cancelled()
+
+    # if all callers are cancelled, the computation is cancelled as well, and the next call starts a new one
+    only = asyncio.ensure_future(compute())
+    await asyncio.sleep(0.01)
+    only.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await only
+    assert await compute() == 3
@@ -0,0 +1,130 @@
+import copy
+import json
+import uuid
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.api.collections.material_validation import (
+    _get_material_validation_single_collection,
+)
+from app.elastic.cache import SearchCache, search_cache
+from app.elastic.search import CollectionSearch, MaterialSearch
+
+
+def test_search_cache_key_is_canonical():
+    assert SearchCache.key(["workspace"], {"a": 1, "b": [1, 2]}, {}) == SearchCache.key(
+        ["workspace"], {"b": [1, 2], "a": 1}, {}
+    )
+    assert SearchCache.key(["workspace"], {"a": 1}, {}) != SearchCache.key(["other"], {"a": 1}, {})
+
+
+def test_search_cache_ttl():
+    cache = SearchCache(max_size=1024)
+    with mock.patch("app.elastic.cache.time.monotonic", return_value=100):
+        cache.put("key", {"took": 1}, ttl=10)
+        assert cache.get("key") == {"took": 1}
+    with mock.patch("app.elastic.cache.time.monotonic", return_value=110):
+        assert cache.get("key") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries, stats.size) == (1, 1, 0, 0)
+
+
+def test_search_cache_lru_eviction():
+    cache = SearchCache(max_size=30)
+    cache.put("a", {"v": "a"}, ttl=60)  # 10 bytes each
+    cache.put("b", {"v": "b"}, ttl=60)
+    cache.put("c", {"v": "c"}, ttl=60)
+    cache.get("a")  # "b" is now the least recently used entry
+    cache.put("d", {"v": "d"}, ttl=60)
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats().evictions == 1
+
+    cache.put("e", {"v": "e" * 100}, ttl=60)  # exceeds the budget on its own and hence is not cached
+    assert cache.get("e") is None
+    assert cache.stats().entries == 3
+
+
+def test_search_cache_size_estimate():
+    small = {"took": 1, "hits": {"total": {"value": 2}, "hits": [{"_id": "a"}, {"_id": "b"}]}}
+    assert SearchCache.estimate_size(small) == len(json.dumps(small))
+
+    large = {"took": 1, "hits": {"total": {"value": 10_000}, "hits": [{"_id": f"{i:05}"} for i in range(10_000)]}}
+    with mock.patch("app.elastic.cache.json.dumps", wraps=json.dumps) as dumps:
+        estimate = SearchCache.estimate_size(large)
+    assert all(len(call.args[0]) <= 32 for call in dumps.call_args_list if isinstance(call.args[0], list))
+    assert abs(estimate - len(json.dumps(large))) / len(json.dumps(large)) < 0.01
+
+
+@pytest.mark.asyncio
+async def test_execute_reuses_cached_response():
+    search_cache.clear()
+    response = {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": 3, "relation": "eq"}, "max_score": None, "hits": []},
+    }
+    es = mock.MagicMock()
+    es.search = AsyncMock(return_value=response)
+
+    with mock.patch("app.elastic.search.get_connection", return_value=es):
+        first = await MaterialSearch().extra(size=0).execute()
+        second = await MaterialSearch().extra(size=0).execute()
+        assert es.search.await_count == 1
+        assert first.hits.total.value == second.hits.total.value == 3
+
+        await MaterialSearch().extra(size=0).execute(ignore_cache=True)
+        assert es.search.await_count == 2
+
+        # searches with a different body or without ttl are not served from the cache
+        await CollectionSearch().extra(size=0).execute()
+        await MaterialSearch().extra(size=0).cache(ttl=0).execute()
+        await MaterialSearch().extra(size=0).cache(ttl=0).execute()
+        assert es.search.await_count == 5
+
+
+@pytest.mark.asyncio
+async def test_cached_responses_are_shared_read_only():
+    search_cache.clear()
+    response = {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": 1, "relation": "eq"}, "max_score": 1.0, "hits": [{"_id": "a", "_source": {}}]},
+        "aggregations": {"count": {"buckets": [{"key": "x", "doc_count": 1}]}},
+    }
+    snapshot = copy.deepcopy(response)
+    es = mock.MagicMock()
+    es.search = AsyncMock(return_value=response)
+
+    with mock.patch("app.elastic.search.get_connection", return_value=es):
+        raw = await MaterialSearch().extra(size=1).execute_raw()
+        assert await MaterialSearch().extra(size=1).execute_raw() is raw
+        # reading the wrapped response (as the endpoints do) does not modify the shared response
+        wrapped = await MaterialSearch().extra(size=1).execute()
+        assert [hit.meta.id for hit in wrapped.hits] == ["a"]
+        assert [bucket.key for bucket in wrapped.aggregations.count.buckets] == ["x"]
+        assert es.search.await_count == 1
+    assert raw == snapshot
+
+
+@pytest.mark.asyncio
+async def test_material_validation_bypasses_cache():
+    search_cache.clear()
+    response = {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": 0, "relation": "eq"}, "max_score": None, "hits": []},
+    }
+    es = mock.MagicMock()
+    es.search = AsyncMock(return_value=response)
+
+    with mock.patch("app.elastic.search.get_connection", return_value=es):
+        for _ in range(2):
+            await _get_material_validation_single_collection(collection_id=uuid.uuid4(), title="title")
+    assert es.search.await_count == 2 and search_cache.stats().entries == 0
@@ -0,0 +1,84 @@
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+
+from app.elastic.pagination import iterate_pages, search_page
+from app.elastic.search import CollectionSearch, MaterialSearch, hits
+
+
+def _page(pit_id: str, *node_ids: str) -> dict:
+    return {
+        "pit_id": pit_id,
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": 3, "relation": "eq"},
+            "max_score": None,
+            "hits": [
+                {"_index": "workspace", "_id": node_id, "_score": None, "_source": {}, "sort": [node_id, i]}
+                for i, node_id in enumerate(node_ids)
+            ],
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_search_page_follows_cursor_until_last_page():
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+    es.search = AsyncMock(side_effect=[_page("pit-2", "a", "b"), _page("pit-3", "c")])
+    es.close_point_in_time = AsyncMock()
+    search = MaterialSearch().extra(size=500_000, from_=0)
+
+    with mock.patch("app.elastic.pagination.get_connection", return_value=es):
+        first, cursor = await search_page(search, limit=2)
+        second, last = await search_page(search, limit=2, cursor=cursor)
+
+    es.open_point_in_time.assert_awaited_once_with(index=["workspace"], keep_alive="1m")
+    first_body, second_body = (call.kwargs["body"] for call in es.search.await_args_list)
+    assert first_body["pit"]["id"] == "pit-1"
+    assert first_body["size"] == 2
+    assert "from" not in first_body and "search_after" not in first_body
+    assert second_body["pit"]["id"] == "pit-2"
+    assert second_body["search_after"] == ["b", 1]
+    assert first_body["sort"] == second_body["sort"]
+
+    assert [hit["_id"] for hit in first["hits"]["hits"]] == ["a", "b"]
+    assert [hit["_id"] for hit in second["hits"]["hits"]] == ["c"]
+    assert last is None
+    es.close_point_in_time.assert_awaited_once_with(body={"id": "pit-3"})
+
+
+@pytest.mark.asyncio
+async def test_search_page_rejects_foreign_cursor():
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+    es.search = AsyncMock(return_value=_page("pit-1", "a"))
+
+    with mock.patch("app.elastic.pagination.get_connection", return_value=es):
+        _, cursor = await search_page(MaterialSearch(), limit=1)
+
+        with pytest.raises(HTTPException) as error:
+            await search_page(CollectionSearch(), limit=1, cursor=cursor)
+        assert error.value.status_code == 400
+
+        with pytest.raises(HTTPException) as error:
+            await search_page(MaterialSearch(), limit=1, cursor="not a cursor")
+        assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_iterate_pages():
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit"})
+    es.search = AsyncMock(side_effect=[_page("pit", "a", "b"), _page("pit", "c", "d"), _page("pit")])
+    es.close_point_in_time = AsyncMock()
+
+    with mock.patch("app.elastic.pagination.get_connection", return_value=es):
+        pages = [[hit["_id"] for hit in hits(page)] async for page in iterate_pages(MaterialSearch(), page_size=2)]
+
+    assert pages == [["a", "b"], ["c", "d"], []]
+    es.close_point_in_time.assert_awaited_once()
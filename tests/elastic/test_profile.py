@@ -0,0 +1,69 @@
+import logging
+from unittest import mock
+from unittest.mock import AsyncMock
+
+from starlette.testclient import TestClient
+
+from app.elastic.profile import summarize
+from app.main import api
+
+_profile = {
+    "shards": [
+        {
+            "searches": [
+                {
+                    "query": [
+                        {
+                            "type": "BooleanQuery",
+                            "description": "+type:ccm:map",
+                            "time_in_nanos": 2_000_000,
+                            "children": [
+                                {"type": "TermQuery", "description": "type:ccm:map", "time_in_nanos": 500_000}
+                            ],
+                        }
+                    ]
+                }
+            ],
+            "aggregations": [{"type": "MissingAggregator", "description": "title", "time_in_nanos": 1_000_000}],
+        }
+    ]
+    * 2  # two shards with identical timings
+}
+
+
+def test_summarize_sums_over_shards():
+    assert summarize(_profile) == {
+        ("query", ("BooleanQuery [+type:ccm:map]",)): 4.0,
+        ("query", ("BooleanQuery [+type:ccm:map]", "TermQuery [type:ccm:map]")): 1.0,
+        ("aggregation", ("MissingAggregator [title]",)): 2.0,
+    }
+
+
+def test_profile_header(caplog):
+    es = mock.MagicMock()
+    es.search = AsyncMock(
+        return_value={
+            "took": 7,
+            "timed_out": False,
+            "_shards": {"total": 2, "successful": 2, "skipped": 0, "failed": 0},
+            "profile": _profile,
+        }
+    )
+    client = TestClient(api())
+    url = "/collections/4940d5da-9b21-4ec0-8824-d16e0409e629/collection-validation"
+
+    with mock.patch("app.elastic.search.get_connection", return_value=es):
+        with mock.patch("app.elastic.profile.ELASTIC_PROFILING", False):
+            response = client.get(url, headers={"X-Profile": "true"})
+        assert response.status_code == 200
+        assert "profile" not in es.search.await_args.kwargs["body"]
+        assert "server-timing" not in response.headers
+
+        with mock.patch("app.elastic.profile.ELASTIC_PROFILING", True), caplog.at_level(logging.INFO, "meta.profile"):
+            response = client.get(url, params={"profile": "true"})
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert es.search.await_args.kwargs["body"]["profile"] is True
+    assert response.headers["server-timing"].startswith('es;desc="workspace #0";dur=7, total;dur=')
+    assert "MissingAggregator [title] 2.0ms" in caplog.text
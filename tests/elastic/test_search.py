@@ -0,0 +1,49 @@
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.elastic.cache import search_cache
+from app.elastic.search import CollectionSearch, MaterialSearch, execute_many
+
+
+def _response(total: int) -> dict:
+    return {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": total, "relation": "eq"}, "max_score": None, "hits": []},
+    }
+
+
+@pytest.mark.asyncio
+async def test_execute_many_single_request_with_per_search_failures():
+    search_cache.clear()
+    es = mock.MagicMock()
+    es.msearch = AsyncMock(
+        return_value={
+            "responses": [
+                _response(total=42),
+                {"error": {"type": "search_phase_execution_exception"}, "status": 400},
+            ]
+        }
+    )
+    collections = CollectionSearch().extra(size=0)
+    materials = MaterialSearch().oer_filter().extra(size=0)
+
+    with mock.patch("app.elastic.search.get_connection", return_value=es):
+        ok, failed = await execute_many(collections, materials)
+
+    es.msearch.assert_awaited_once()
+    body = es.msearch.await_args.kwargs["body"]
+    assert body == [{"index": ["workspace"]}, collections.to_dict(), {"index": ["workspace"]}, materials.to_dict()]
+
+    assert ok.success()
+    assert ok.hits.total.value == 42
+    assert not failed.success()
+    assert failed.error.type == "search_phase_execution_exception"
+
+
+@pytest.mark.asyncio
+async def test_execute_many_without_searches():
+    assert await execute_many() == []
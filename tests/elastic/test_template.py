@@ -0,0 +1,60 @@
+import uuid
+
+import pytest
+from elasticsearch_dsl import A
+
+from app.api.collections.score import _material_search_score_search
+from app.elastic.search import MaterialSearch
+from app.elastic.template import _MAX_SHAPES, search_template
+
+
+def test_search_template():
+    calls = []
+
+    @search_template("size")
+    def template(collection_id: uuid.UUID, size: int) -> MaterialSearch:
+        calls.append(size)
+        search = MaterialSearch().collection_filter(collection_id=collection_id, transitive=True).extra(size=0)
+        search.aggs.bucket("licenses", A("terms", field="license", size=size))
+        return search
+
+    def build(collection_id: uuid.UUID, size: int) -> MaterialSearch:
+        search = MaterialSearch().collection_filter(collection_id=collection_id, transitive=True).extra(size=0)
+        search.aggs.bucket("licenses", A("terms", field="license", size=size))
+        return search
+
+    a, b = uuid.uuid4(), uuid.uuid4()
+    assert template(a, size=10).to_dict() == build(a, size=10).to_dict()
+    assert template(b, size=10).to_dict() == build(b, size=10).to_dict()
+    assert template(collection_id=a, size=20).to_dict() == build(a, size=20).to_dict()
+    assert calls == [10, 20]  # compiled once per shape
+
+    # the bodies of different instances do not interfere
+    first, second = template(a, size=10), template(b, size=10)
+    assert str(a) in str(first.to_dict()) and str(a) not in str(second.to_dict())
+
+    with pytest.raises(RuntimeError):
+        template(a, size=10).extra(size=1)
+
+    # the number of compiled shapes is bounded, the least recently used ones are compiled again
+    for size in range(100, 100 + _MAX_SHAPES):
+        template(a, size=size)
+    template(a, size=10)
+    assert calls[-1] == 10 and len(calls) == 3 + _MAX_SHAPES
+
+
+def test_search_template_requires_plain_values():
+    @search_template()
+    def template(collection_id: uuid.UUID) -> MaterialSearch:
+        return MaterialSearch().query("match", title=f"prefix {collection_id}")
+
+    with pytest.raises(ValueError):
+        template(uuid.uuid4())
+
+
+def test_compiled_score_search():
+    collection_id = uuid.uuid4()
+    assert (
+        _material_search_score_search(collection_id).to_dict()
+        == _material_search_score_search.__wrapped__(collection_id).to_dict()
+    )
@@ -0,0 +1,70 @@
+import asyncio
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+from elasticsearch_dsl import connections
+
+from app.core.config import MAX_CONNECTIONS_COUNT, MIN_CONNECTIONS_COUNT
+from app.elastic.connection import connection_pool_stats
+from app.elastic.utils import close_elastic_connection, connect_to_elastic, gather
+
+
+@pytest.mark.asyncio
+async def test_gather_keeps_order_and_bounds_concurrency():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def query(value: int) -> int:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01 * (5 - value))
+        in_flight -= 1
+        return value
+
+    result = await gather(*(query(i) for i in range(5)), limit=2)
+
+    assert result == [0, 1, 2, 3, 4]
+    assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_gather_propagates_failure_and_cancels_remaining():
+    cancelled = asyncio.Event()
+
+    async def failing():
+        raise RuntimeError("query failed")
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(RuntimeError, match="query failed"):
+        await gather(slow(), failing())
+
+    await asyncio.sleep(0)
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_connect_to_elastic_opens_connection_pool():
+    info = '{"version": {"number": "7.17.0", "build_flavor": "default"}, "tagline": "You Know, for Search"}'
+    perform_request = AsyncMock(return_value=(200, {"x-elastic-product": "Elasticsearch"}, info))
+    with (
+        mock.patch("app.elastic.utils.ELASTICSEARCH_URL", "http://localhost:9200"),
+        mock.patch("app.elastic.connection.PooledConnection.perform_request", perform_request),
+    ):
+        await connect_to_elastic()
+    try:
+        es = connections.get_connection()
+        # the client additionally verifies the product upon the first request
+        assert perform_request.await_count >= MIN_CONNECTIONS_COUNT
+        (stats,) = connection_pool_stats(es)
+        assert stats.max_connections == MAX_CONNECTIONS_COUNT
+        assert stats.in_use == 0
+    finally:
+        await close_elastic_connection()
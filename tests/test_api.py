@@ -1,9 +1,14 @@
+import datetime
+import json
+import uuid
 from unittest import mock
+from unittest.mock import AsyncMock
 
 from starlette.testclient import TestClient
 
-from app.api.collections.quality_matrix import QualityMatrix
+from app.api.collections.quality_matrix import QualityMatrix, quality_matrix_cache
 from app.main import api
+from tests.conftest import forest_mock
 
 client = TestClient(api())
 
@@ -15,8 +20,121 @@ def test_404():
 
 
 def test_get_quality():
-    with mock.patch("app.api.api.quality_matrix", lambda collection, mode: QualityMatrix(rows=[], columns=[])):
-        with mock.patch("app.api.api.tree", lambda x: None):
+    computed_at = datetime.datetime(2022, 6, 1, 10, tzinfo=datetime.timezone.utc)
+    get = AsyncMock(return_value=(QualityMatrix(rows=[], columns=[]), computed_at))
+    with mock.patch("app.api.api.quality_matrix_cache.get", get):
+        with mock.patch("app.api.api.tree", AsyncMock(return_value=None)):
             node_id = "4940d5da-9b21-4ec0-8824-d16e0409e629"
             response = client.get(f"/collections/{node_id}/quality-matrix/collection")
             assert response.status_code == 200
+            assert response.headers["Last-Modified"] == "Wed, 01 Jun 2022 10:00:00 GMT"
+            assert get.call_args.kwargs["fresh"] is False
+
+            client.get(f"/collections/{node_id}/quality-matrix/collection?fresh=true")
+            assert get.call_args.kwargs["fresh"] is True
+
+
+def test_quality_matrix_etag():
+    node_id = uuid.UUID("4940d5da-9b21-4ec0-8824-d16e0409e629")
+    computed_at = datetime.datetime(2022, 6, 1, 10, tzinfo=datetime.timezone.utc)
+    url = f"/collections/{node_id}/quality-matrix/collection"
+    quality_matrix_cache._entries[(node_id, "collection")] = (QualityMatrix(rows=[], columns=[]), computed_at)
+    try:
+        with mock.patch("app.api.api.tree", AsyncMock(return_value=mock.MagicMock(node_id=node_id))):
+            response = client.get(url)
+            assert response.status_code == 200
+            tag = response.headers["ETag"]
+            assert client.get(f"{url}?columns=title").headers["ETag"] != tag
+
+            # the version of the cached matrix is checked before the matrix is looked up, selected and serialized
+            get = AsyncMock()
+            with mock.patch("app.api.api.quality_matrix_cache.get", get):
+                response = client.get(url, headers={"If-None-Match": tag})
+            assert response.status_code == 304
+            assert response.headers["ETag"] == tag
+            assert response.headers["Last-Modified"] == "Wed, 01 Jun 2022 10:00:00 GMT"
+            get.assert_not_awaited()
+
+            # a new version of the matrix has a new ETag
+            later = computed_at + datetime.timedelta(hours=1)
+            quality_matrix_cache._entries[(node_id, "collection")] = (QualityMatrix(rows=[], columns=[]), later)
+            response = client.get(url, headers={"If-None-Match": tag})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != tag
+    finally:
+        quality_matrix_cache.clear()
+
+
+def test_collection_validation_ndjson_stream():
+    def page(pit_id: str, *node_ids: str) -> dict:
+        return {
+            "pit_id": pit_id,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": 3, "relation": "eq"},
+                "hits": [
+                    {"_id": node_id, "_source": {"nodeRef": {"id": node_id}}, "matched_queries": ["title"], "sort": [i]}
+                    for i, node_id in enumerate(node_ids)
+                ],
+            },
+        }
+
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    es = mock.MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit"})
+    es.search = AsyncMock(return_value=page("pit", *ids))
+    es.close_point_in_time = AsyncMock()
+
+    with mock.patch("app.elastic.pagination.get_connection", return_value=es):
+        node_id = "4940d5da-9b21-4ec0-8824-d16e0409e629"
+        response = client.get(
+            f"/collections/{node_id}/collection-validation", headers={"Accept": "application/x-ndjson"}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["node_id"] for line in lines] == ids
+    assert all(line["title"] == ["missing"] for line in lines)
+
+
+def test_tree_etag():
+    node_id = "15fce411-54d9-467f-8f35-61ea374a298d"
+    with forest_mock("tree"):
+        response = client.get(f"/collections/{node_id}/tree")
+        assert response.status_code == 200
+        tag = response.headers["ETag"]
+
+        response = client.get(f"/collections/{node_id}/tree", headers={"If-None-Match": tag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == tag
+        assert response.content == b""
+
+        # another slice of the tree has another ETag
+        response = client.get(f"/collections/{node_id}/tree?depth=1", headers={"If-None-Match": tag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != tag
+
+
+def test_tree_response_schema():
+    schema = client.get("/openapi.json").json()
+    response = schema["paths"]["/collections/{node_id}/tree"]["get"]["responses"]["200"]
+    assert response["content"]["application/json"]["schema"] == {"$ref": "#/components/schemas/TreeSlice"}
+    tree_slice = schema["components"]["schemas"]["TreeSlice"]
+    # sliced trees only hold the selected attributes and may be truncated
+    assert tree_slice["required"] == ["children"]
+    assert "truncated" in tree_slice["properties"]
+
+
+def test_material_counts_etag():
+    with mock.patch("app.api.api.tree", AsyncMock(return_value=None)):
+        with mock.patch("app.api.api.material_counts", AsyncMock(return_value=[])):
+            node_id = "4940d5da-9b21-4ec0-8824-d16e0409e629"
+            response = client.get(f"/collections/{node_id}/material-counts")
+            assert response.status_code == 200
+            assert response.json() == []
+            tag = response.headers["ETag"]
+
+            response = client.get(f"/collections/{node_id}/material-counts", headers={"If-None-Match": f"W/{tag}"})
+            assert response.status_code == 304